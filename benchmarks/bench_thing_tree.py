@@ -0,0 +1,138 @@
+"""
+Memory use and construction time of Thing trees
+
+Builds a synthetic metadata tree (as returned by metaflow for a Thing
+with parts) and measures creating the Thing tree from it, materializing
+every node and pickling it.
+
+Usage:
+    python -m benchmarks.bench_thing_tree --nodes 50000
+"""
+import argparse
+import copy
+import pickle
+import time
+import tracemalloc
+import uuid
+
+from pyniva import Thing
+
+
+def synthetic_tree(n_nodes=50000, fanout=10, ts_per_component=20):
+    """Metaflow style tree dictionary with about n_nodes Things: a vessel,
+    nested components and time series (each with a flag time series)"""
+    n_ts = 0
+    max_ts = n_nodes // 2
+
+    def _node(ttype, path, part_of):
+        doc = {
+            "uuid": str(uuid.uuid4()),
+            "path": path,
+            "name": path.split("/")[-1],
+            "ttype": ttype,
+        }
+        if part_of is not None:
+            doc["part_of"] = part_of
+        return doc
+
+    def _component(path, part_of, depth):
+        nonlocal n_ts
+        doc = _node("component", path, part_of)
+        parts = []
+        if depth < 2:
+            for i in range(fanout):
+                if n_ts >= max_ts:
+                    break
+                parts.append(_component(f"{path}/C{i}", doc["uuid"], depth + 1))
+        else:
+            for i in range(min(ts_per_component, max_ts - n_ts)):
+                ts = _node("tseries", f"{path}/TS{i}", doc["uuid"])
+                ts["parts"] = [_node("qctseries", f"{path}/TS{i}/QC", ts["uuid"])]
+                parts.append(ts)
+                n_ts += 1
+        doc["parts"] = parts
+        return doc
+
+    vessel = _node("vessel", "SYNTH", None)
+    vessel["parts"] = []
+    i = 0
+    while n_ts < max_ts:
+        vessel["parts"].append(_component(f"SYNTH/S{i}", vessel["uuid"], 0))
+        i += 1
+    return vessel
+
+
+def count_nodes(tree):
+    n = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        n += 1
+        stack.extend(node.get("parts", []))
+    return n
+
+
+def materialize(thing):
+    """Access every node of the tree (turning all parts into Things)"""
+    n = 0
+    stack = [thing]
+    while stack:
+        node = stack.pop()
+        n += 1
+        stack.extend(getattr(node, "parts", []))
+    return n
+
+
+def timed(func, *args):
+    """Run func, returning (result, seconds)"""
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
+
+def traced(func, *args):
+    """Run func, returning (result, MiB allocated and still held afterwards)"""
+    tracemalloc.start()
+    result = func(*args)
+    held = tracemalloc.get_traced_memory()[0] / 2**20
+    tracemalloc.stop()
+    return result, held
+
+
+def build(tree, all_nodes=False):
+    """Thing tree from a private copy of the tree dictionary (the copy is
+    included, it is what the metaflow response is decoded into)"""
+    thing = Thing._thing_dispatch(copy.deepcopy(tree))
+    if all_nodes:
+        materialize(thing)
+    return thing
+
+
+def run(n_nodes=50000):
+    tree = synthetic_tree(n_nodes)
+    results = {"nodes": count_nodes(tree)}
+
+    # Memory and time are measured in separate runs as tracing is slow
+    _, results["tree_mib"] = traced(build, tree)
+    _, results["materialized_mib"] = traced(build, tree, True)
+
+    thing, results["dispatch_s"] = timed(Thing._thing_dispatch, copy.deepcopy(tree))
+    _, results["materialize_s"] = timed(materialize, thing)
+    _, results["as_dict_s"] = timed(thing.as_dict)
+
+    payload, results["pickle_s"] = timed(pickle.dumps, thing, pickle.HIGHEST_PROTOCOL)
+    results["pickle_mib"] = len(payload) / 2**20
+    _, results["unpickle_s"] = timed(pickle.loads, payload)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=50000)
+    args = parser.parse_args()
+    for name, value in run(args.nodes).items():
+        print(f"{name:>16}: {value:.4g}" if isinstance(value, float) else f"{name:>16}: {value}")
+
+
+if __name__ == "__main__":
+    main()
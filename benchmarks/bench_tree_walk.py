@@ -0,0 +1,71 @@
+"""
+Traversal time of metaflow tree walks
+
+Compares metaflow.thing_tree2ts (explicit stack) with the previous
+recursive generator on a wide synthetic tree and on a deep chain of
+components, and times filtered walks and ThingIndex.from_tree.
+
+Usage:
+    python -m benchmarks.bench_tree_walk --nodes 50000 --depth 900
+"""
+import argparse
+import time
+
+from pyniva import ThingIndex
+from pyniva.metaflow import TSERIES_TTYPES, thing_tree2ts, walk_tree
+
+from .bench_thing_tree import count_nodes, synthetic_tree, timed
+
+
+def recursive_tree2ts(top):
+    """The recursive implementation replaced by walk_tree (for reference)"""
+    if top.get("parts", False) and len(top["parts"]) > 0:
+        for t in top["parts"]:
+            for ct in recursive_tree2ts(t):
+                yield ct
+    if top.get("ttype") in TSERIES_TTYPES:
+        yield top
+
+
+def deep_tree(depth):
+    """Chain of nested components with one time series per level"""
+    top = node = {"path": "DEEP", "ttype": "vessel"}
+    for i in range(depth):
+        child = {"path": f"{node['path']}/C{i}", "ttype": "component"}
+        node["parts"] = [{"path": f"{node['path']}/TS", "ttype": "tseries"}, child]
+        node = child
+    return top
+
+
+def run(n_nodes=50000, depth=900):
+    results = {}
+    wide = synthetic_tree(n_nodes)
+    deep = deep_tree(depth)
+    results["wide_nodes"] = count_nodes(wide)
+    results["deep_nodes"] = count_nodes(deep)
+
+    for name, tree in (("wide", wide), ("deep", deep)):
+        _, results[f"{name}_recursive_s"] = timed(list, recursive_tree2ts(tree))
+        _, results[f"{name}_stack_s"] = timed(list, thing_tree2ts(tree))
+
+    _, results["wide_qctseries_s"] = timed(list, walk_tree(wide, ttypes={"qctseries"}))
+    _, results["wide_path_filter_s"] = timed(
+        list, thing_tree2ts(wide, path_filter=lambda p: p.startswith("SYNTH/S0/"))
+    )
+    _, results["wide_first_s"] = timed(next, thing_tree2ts(wide))
+    _, results["wide_index_s"] = timed(ThingIndex.from_tree, wide)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=50000)
+    # The recursive reference fails beyond the recursion limit
+    parser.add_argument("--depth", type=int, default=900)
+    args = parser.parse_args()
+    for name, value in run(args.nodes, args.depth).items():
+        print(f"{name:>20}: {value:.4g}" if isinstance(value, float) else f"{name:>20}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Benchmark suite for pyniva against a local tsb/metaflow stand-in server
+
+Starts the in-process stand-in from tests/standin.py, serving the
+synthetic FerryBox test data scaled up in time and number of paths, and
+measures throughput and peak (traced) memory of the main query paths.
+The report can be saved as JSON and compared with a report from
+another version of pyniva.
+
+Usage:
+    python -m benchmarks.suite --time-scale 20 --path-scale 4 --output new.json
+    python -m benchmarks.suite --compare old.json
+
+Note that the stand-in server runs in the same process, so its share of
+the time is included in the measurements (it is the same for all
+versions).
+"""
+import argparse
+import datetime as dt
+import functools
+import json
+import platform
+import time
+import tracemalloc
+from importlib.metadata import version
+
+from pyniva import Vessel, UuidPathMap, get_newly_inserted_data, get_ship_data, iter_ship_data
+from pyniva.tsb import get_signals, ts_list2df
+
+from tests.standin import StandInData, StandInServer, path2uuid
+
+VESSEL = "SYNTH_FA"
+
+
+class Case:
+    """A benchmark case, run(server, data) returns the number of items
+    (rows or Things) processed"""
+
+    def __init__(self, name, run, unit):
+        self.name = name
+        self.run = run
+        self.unit = unit
+
+
+def _time_range(data):
+    times = [t for _, c_times, _ in data.series.values() for t in (c_times[0], c_times[-1])]
+    return min(times).isoformat(), max(times).isoformat()
+
+
+def _tseries_paths(data):
+    return sorted(p for p, kind in data.kinds.items() if kind == "tseries")
+
+
+def _ship_data(server, data):
+    start, end = _time_range(data)
+    df = get_ship_data(
+        VESSEL,
+        _tseries_paths(data),
+        start,
+        end,
+        noqc=True,
+        header=None,
+        pub_tsb=server.tsb_url,
+        meta_host=server.meta_url,
+        max_workers=8,
+    )
+    return len(df)
+
+
+def _iter_ship_data(server, data):
+    # Chunks are consumed and dropped, peak memory is bounded by the window
+    start, end = _time_range(data)
+    rows = 0
+    for chunk in iter_ship_data(
+        VESSEL,
+        _tseries_paths(data),
+        start,
+        end,
+        True,
+        None,
+        window="PT1H",
+        pub_tsb=server.tsb_url,
+        meta_host=server.meta_url,
+        max_workers=8,
+    ):
+        rows += len(chunk)
+    return rows
+
+
+def _signals(server, data):
+    start, end = _time_range(data)
+    uuids = [path2uuid(p) for p in _tseries_paths(data)]
+    return len(get_signals(server.tsb_url, uuids, start_time=start, end_time=end, dt=0))
+
+
+@functools.lru_cache(maxsize=1)
+def _ts_rows(data):
+    uuids = [path2uuid(p) for p in _tseries_paths(data)]
+    return data.query_ts({"uuid": ",".join(uuids)})
+
+
+def _ts_list2df(server, data):
+    # Decoding only, the response rows are built once
+    return len(ts_list2df(_ts_rows(data)))
+
+
+def _all_tseries(server, data):
+    vessel = Vessel.get_thing(server.meta_url, path=VESSEL)
+    return len(vessel.get_all_tseries(server.meta_url))
+
+
+def _newly_inserted(server, data):
+    now = dt.datetime.now(dt.timezone.utc)
+    rows = get_newly_inserted_data(
+        now - dt.timedelta(days=1),
+        now + dt.timedelta(days=1),
+        aggregate=False,
+        meta_host=server.meta_url,
+        ts_host=server.tsb_url,
+        path_map=UuidPathMap(),
+    )
+    return len(rows)
+
+
+CASES = [
+    Case("get_ship_data", _ship_data, "rows"),
+    Case("iter_ship_data", _iter_ship_data, "rows"),
+    Case("get_signals", _signals, "rows"),
+    Case("ts_list2df", _ts_list2df, "rows"),
+    Case("get_all_tseries", _all_tseries, "things"),
+    Case("get_newly_inserted_data", _newly_inserted, "rows"),
+]
+
+
+def measure(case, server, data, repeat):
+    """Best and mean time of repeat runs, and the peak traced memory of
+    a separate run (tracing slows the code down)"""
+    seconds = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        items = case.run(server, data)
+        seconds.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    case.run(server, data)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    best = min(seconds)
+    return {
+        "items": items,
+        "unit": case.unit,
+        "best_s": best,
+        "mean_s": sum(seconds) / len(seconds),
+        "items_per_s": items / best if best > 0 else None,
+        "peak_mib": peak,
+    }
+
+
+def run(time_scale=1, path_scale=1, latency=0.0, repeat=3, cases=None):
+    """Run the benchmark cases, returning the report as a dictionary"""
+    data = StandInData(time_scale=time_scale, path_scale=path_scale)
+    report = {
+        "pyniva": version("pyniva"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": {
+            "time_scale": time_scale,
+            "path_scale": path_scale,
+            "latency": latency,
+            "repeat": repeat,
+        },
+        "results": {},
+    }
+    with StandInServer(data, latency=latency) as server:
+        for case in CASES:
+            if cases and case.name not in cases:
+                continue
+            report["results"][case.name] = measure(case, server, data, repeat)
+    return report
+
+
+def print_report(report, baseline=None):
+    print(
+        "pyniva %s, python %s, %s"
+        % (report["pyniva"], report["python"], json.dumps(report["config"]))
+    )
+    header = f"{'case':<24}{'items':>10}{'best s':>10}{'items/s':>12}{'peak MiB':>10}"
+    if baseline is not None:
+        header += f"{'speedup':>10}{'mem ratio':>10}"
+        print("baseline: pyniva %s, %s" % (baseline["pyniva"], json.dumps(baseline["config"])))
+    print(header)
+    for name, r in report["results"].items():
+        line = (
+            f"{name:<24}{r['items']:>10}{r['best_s']:>10.3f}"
+            f"{r['items_per_s'] or 0:>12.0f}{r['peak_mib']:>10.1f}"
+        )
+        old = (baseline or {}).get("results", {}).get(name)
+        if old is not None:
+            line += f"{old['best_s'] / r['best_s']:>10.2f}{r['peak_mib'] / old['peak_mib']:>10.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--time-scale", type=int, help="repeat the samples in time (10)")
+    parser.add_argument("--path-scale", type=int, help="copies of the time series (2)")
+    parser.add_argument("--latency", type=float, help="seconds per request (0)")
+    parser.add_argument("--repeat", type=int, help="runs per case (3)")
+    parser.add_argument("--case", action="append", help="only run this case (repeatable)")
+    parser.add_argument("--output", help="save the report as JSON")
+    parser.add_argument("--compare", help="JSON report to compare with")
+    args = parser.parse_args()
+
+    # Defaults, or the configuration of the baseline report
+    config = {"time_scale": 10, "path_scale": 2, "latency": 0.0, "repeat": 3}
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        config.update(baseline["config"])
+    for k in config:
+        if getattr(args, k) is not None:
+            config[k] = getattr(args, k)
+
+    report = run(cases=args.case, **config)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,34 @@
 from .thing import Thing, Platform, Vessel, Sensor, Component
-from .thing import TimeSeries, FlagTimeSeries, GPSTrack
+from .thing import TimeSeries, FlagTimeSeries, GPSTrack, Spectra, ThingIndex
+from .spectra import SpectralData
 from .get_data import token2header, PyNIVAError, get_newly_inserted_data
 from .request_dataframe import (
     get_paths_measurements,
     get_ship_data,
     get_data_discrete_dates,
     get_available_parameters,
+    iter_ship_data,
 )
-from .tsb import TSB_HOST, PUB_TSB
+from .tsb import TSB_HOST, PUB_TSB, DtypePolicy
 from .metaflow import META_HOST, PUB_META
+from .metaflow import (
+    MetaCache,
+    enable_meta_cache,
+    disable_meta_cache,
+    invalidate_meta_cache,
+    UuidPathMap,
+)
+from .instrument import (
+    add_request_hook,
+    remove_request_hook,
+    enable_metrics,
+    disable_metrics,
+    get_metrics,
+)
+from .profiling import StageProfiler
+from .cache import TimeSeriesCache
+from .client import Client
+from .sync import InsertTimeSync
 
 __all__ = [
     "Thing",
@@ -19,15 +39,34 @@ __all__ = [
     "Component",
     "FlagTimeSeries",
     "GPSTrack",
+    "Spectra",
+    "ThingIndex",
+    "SpectralData",
     "token2header",
     "META_HOST",
     "TSB_HOST",
     "PUB_META",
     "PUB_TSB",
+    "DtypePolicy",
     "PyNIVAError",
     "get_newly_inserted_data",
     "get_paths_measurements",
     "get_ship_data",
     "get_data_discrete_dates",
     "get_available_parameters",
+    "iter_ship_data",
+    "TimeSeriesCache",
+    "Client",
+    "InsertTimeSync",
+    "MetaCache",
+    "enable_meta_cache",
+    "disable_meta_cache",
+    "invalidate_meta_cache",
+    "UuidPathMap",
+    "add_request_hook",
+    "remove_request_hook",
+    "enable_metrics",
+    "disable_metrics",
+    "get_metrics",
+    "StageProfiler",
 ]
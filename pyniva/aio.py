@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio interface to the tsb and metaflow services
+
+Requires the optional httpx dependency (pip install pyniva[async]).
+"""
+__all__ = [
+    "AsyncClient",
+    "get_data",
+    "get_thing",
+    "get_signals",
+    "get_ship_data",
+]
+
+import asyncio
+import logging
+import uuid
+from urllib.parse import urlsplit
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+from .get_data import PyNIVAError, token2header, validate_query_parameters, __version__
+from .instrument import _request_timer
+from .metaflow import PUB_META, PUB_DETAIL
+from .tsb import (
+    PUB_TSB,
+    _signal_query,
+    _window_dt,
+    _split_windows,
+    _count_params,
+    _count_total,
+    _apply_dtypes,
+    _output,
+)
+
+
+def _require_httpx():
+    if httpx is None:
+        raise ImportError(
+            "The asyncio interface requires httpx, install it with 'pip install pyniva[async]'"
+        )
+
+
+def _encode_params(params):
+    """Query parameters encoded the same way as requests does it"""
+    return {
+        k: str(v) if isinstance(v, bool) else v
+        for k, v in (params or {}).items()
+        if v is not None
+    }
+
+
+def _raise_for_status(response, trace_id):
+    if not response.is_error:
+        return
+    if "application/json" in response.headers.get("Content-Type", ""):
+        body = response.json()
+        raise PyNIVAError(
+            body.get("message", body), trace_id=trace_id, req_args=body.get("req_args")
+        )
+    raise PyNIVAError(message=response.text, trace_id=trace_id)
+
+
+class AsyncClient:
+    """asyncio HTTP client for the tsb and metaflow services
+
+    Wraps a pooled httpx.AsyncClient and limits the number of concurrent
+    requests made through it.
+
+    Args:
+        tsb_host:        URL of the tsb service
+        meta_host:       URL of the metaflow service
+        header:          JWT header (see token2header)
+        token_file:      Token file, alternative to header
+        max_concurrency: Maximum number of concurrent requests
+        timeout:         Request timeout in seconds
+
+    Example:
+        async with AsyncClient(token_file="niva-service-account.json") as client:
+            df = await client.get_ship_data("FA", paths, start_time, end_time)
+    """
+
+    def __init__(
+        self,
+        tsb_host=PUB_TSB,
+        meta_host=PUB_META,
+        header=None,
+        token_file=None,
+        max_concurrency=10,
+        timeout=300,
+    ):
+        _require_httpx()
+        self.tsb_host = tsb_host
+        self.meta_host = meta_host
+        if token_file is not None:
+            header = token2header(token_file)
+        self._client = httpx.AsyncClient(
+            headers=header,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_concurrency, max_keepalive_connections=max_concurrency
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def get(self, url, params=None, headers=None):
+        """GET request, waits for a free slot if max_concurrency requests
+        are already running"""
+        async with self._semaphore:
+            return await self._client.get(
+                url, params=_encode_params(params), headers=headers
+            )
+
+    async def get_thing(self, params=None, **kwargs):
+        """Get Thing instance(s) from metaflow, see Thing.get_thing"""
+        from .thing import Thing
+
+        return await Thing.aget_thing(self.meta_host, params=params, client=self, **kwargs)
+
+    async def get_signals(self, uuids, **kwargs):
+        """Get time series data from tsb, see get_signals"""
+        return await get_signals(self.tsb_host, uuids, client=self, **kwargs)
+
+    async def get_ship_data(self, vessel_name, param_paths, start_time, end_time, noqc=False, **kwargs):
+        """Get data for a vessel, see get_ship_data"""
+        return await get_ship_data(
+            vessel_name,
+            param_paths,
+            start_time,
+            end_time,
+            noqc,
+            None,
+            pub_tsb=self.tsb_host,
+            meta_host=self.meta_host,
+            client=self,
+            **kwargs,
+        )
+
+
+async def _with_client(client, call):
+    """Run call(client) with the given client, or a temporary one"""
+    if client is not None:
+        return await call(client)
+    async with AsyncClient() as c_client:
+        return await call(c_client)
+
+
+async def get_data(url, params=None, headers=None, client=None):
+    """Get data from NIVA REST endpoints, asyncio version of
+    get_data.get_data
+
+    Params:
+       url (str):             The address of the rest endpoint
+       params (dict or None): Dictionary with query parameters or None
+       headers (dict):        Header data for the request, must include JWT access token
+       client (AsyncClient):  Client used for the request
+
+    Returns:
+       The data returned from the endpoint
+    """
+    validate_query_parameters(**(params or {}))
+    headers = dict(headers or {})
+    trace_id = str(uuid.uuid4())
+    headers["Trace-Id"] = trace_id
+    headers["User-Agent"] = f"pyniva/{__version__}"
+
+    async def _get(c_client):
+        with _request_timer(trace_id, "tsb", "GET", url, params=params) as timer:
+            response = await c_client.get(url, params=params, headers=headers)
+            timer.response(response)
+            _raise_for_status(response, trace_id)
+            # Parsed in a worker thread, large responses would block the loop
+            return await asyncio.to_thread(timer.decode, response)
+
+    full_data = await _with_client(client, _get)
+    if isinstance(full_data.get("t"), list):
+        return full_data["t"]
+    return full_data
+
+
+async def get_thing(meta_host, par, header=None, client=None):
+    """Get thing meta data dictionary from metaflow server, asyncio
+    version of metaflow.get_thing
+
+    Args:
+        meta_host: URL to meta server (i.e. metaflow service)
+        par:       Dictionary with query parameters
+        header:    HTTP request header (for JWT authentication and encryption)
+        client:    AsyncClient used for the request
+
+    Returns:
+        A list of Thing dictionaries or a single dictionary if only one
+        is returned from the meta service
+    """
+    par = dict(par)
+    header = dict(header or {})
+    trace_id = str(uuid.uuid4())
+    header["Trace-Id"] = trace_id
+    header["User-Agent"] = f"pyniva/{__version__}"
+
+    endpoint = urlsplit(meta_host).path
+    if meta_host.startswith(PUB_DETAIL) and "uuid" in par:
+        meta_host = meta_host + par["uuid"]
+        del par["uuid"]
+
+    async def _get(c_client):
+        with _request_timer(
+            trace_id, "metaflow", "GET", meta_host, endpoint=endpoint, params=par
+        ) as timer:
+            response = await c_client.get(meta_host, params=par, headers=header)
+            timer.response(response)
+            _raise_for_status(response, trace_id)
+            # Parsed in a worker thread, large responses would block the loop
+            return await asyncio.to_thread(timer.decode, response)
+
+    t = await _with_client(client, _get)
+    if "t" not in t:
+        raise PyNIVAError(
+            message=f"Could not find metadata for requested parameters {par}",
+            req_args=par,
+            trace_id=trace_id,
+        )
+    if isinstance(t["t"], list) and len(t["t"]) == 1:
+        return t["t"][0]
+    return t["t"]
+
+
+async def get_signals(signals_url, uuids, client=None, **kwargs):
+    """Get signals (time series data) from NIVA REST endpoints, asyncio
+    version of tsb.get_signals (with the same arguments).
+
+    A query with a window or max_rows argument (and start_time, end_time
+    and dt) is split in time windows that are fetched concurrently. With
+    a cache, the cache is consulted in a worker thread and only the
+    missing time ranges are fetched.
+
+    Returns:
+       A Pandas DataFrame with the data returned
+       If no data is returned an empty DataFrame is returned.
+    """
+    header = kwargs.pop("header", None)
+    window = kwargs.pop("window", None)
+    max_rows = kwargs.pop("max_rows", None)
+    # Concurrency is limited by the client (see AsyncClient)
+    kwargs.pop("max_workers", None)
+    cache = kwargs.pop("cache", None)
+    output = _output(kwargs.pop("output", None), kwargs.pop("dtypes", None))
+    params, start_time, end_time = _signal_query(uuids, kwargs)
+
+    async def _get_frame(c_client, w_start, w_end):
+        c_params = params.copy()
+        if w_start is not None:
+            c_params["start"] = w_start.isoformat()
+        if w_end is not None:
+            c_params["end"] = w_end.isoformat()
+        data = await get_data(signals_url, params=c_params, headers=header, client=c_client)
+        if len(data) == 0:
+            return output.empty()
+        return await asyncio.to_thread(output.decode, data)
+
+    async def _windows(c_client, c_start, c_end):
+        if (window is None and max_rows is None) or c_start is None or c_end is None:
+            return [(c_start, c_end)]
+        dt_seconds = _window_dt(params)
+        if dt_seconds is None:
+            return [(c_start, c_end)]
+        n_rows = None
+        if window is None and dt_seconds == 0:
+            n_rows = await _count_rows(c_client, signals_url, params, c_start, c_end, header)
+            if n_rows is None:
+                return [(c_start, c_end)]
+        return _split_windows(c_start, c_end, dt_seconds, window, max_rows, n_rows)
+
+    async def _fetch(c_client, c_start, c_end):
+        windows = await _windows(c_client, c_start, c_end)
+        frames = await asyncio.gather(
+            *(_get_frame(c_client, w_start, w_end) for w_start, w_end in windows)
+        )
+        return output.concat(frames, windows)
+
+    async def _get_all(c_client):
+        if cache is None:
+            return await _fetch(c_client, start_time, end_time)
+        if output.name != "pandas":
+            raise ValueError("The time series cache only supports pandas output")
+        loop = asyncio.get_running_loop()
+
+        def _fetch_range(c_start, c_end):
+            # Called by the cache in the worker thread, fetched in the loop
+            return asyncio.run_coroutine_threadsafe(
+                _fetch(c_client, c_start, c_end), loop
+            ).result()
+
+        df = await asyncio.to_thread(
+            cache.get_signals, uuids, params, start_time, end_time, _fetch_range
+        )
+        # Cached segments are stored with the default types
+        return df if output.policy is None else _apply_dtypes(df, output.policy)
+
+    return await _with_client(client, _get_all)
+
+
+async def _count_rows(client, query_url, params, start_time, end_time, header):
+    """Ask tsb for the number of raw rows in a query, None if unknown"""
+    c_params = _count_params(params, start_time, end_time)
+    try:
+        data = await get_data(query_url, params=c_params, headers=header, client=client)
+    except Exception as e:
+        logging.warning("Could not estimate size of query: %s", e)
+        return None
+    return _count_total(data)
+
+
+async def get_ship_data(
+    vessel_name,
+    param_paths,
+    start_time,
+    end_time,
+    noqc,
+    header,
+    dt=0,
+    pub_tsb=PUB_TSB,
+    meta_host=PUB_META,
+    client=None,
+    return_errors=False,
+):
+    """Download time series data for a vessel into one DataFrame,
+    asyncio version of request_dataframe.get_ship_data. All paths are
+    downloaded concurrently (limited by the client's max_concurrency).
+
+    Returns:
+        A DataFrame with a time column and one column per path
+    """
+    from .thing import Vessel, ThingIndex
+    from .request_dataframe import _assemble_ship_data
+
+    # The gpstrack is added to a copy, not to the caller's list
+    param_paths = list(param_paths)
+
+    async def _run(c_client):
+        vessel = await Vessel.aget_thing(
+            meta_host, header=header, client=c_client, params={"path": vessel_name}
+        )
+        full_vessel = await Vessel.aget_thing(
+            meta_host, header=header, client=c_client, uuid=vessel.uuid, parts=100
+        )
+        signals = ThingIndex.from_tree(full_vessel)
+
+        if f"{vessel_name}/gpstrack" not in param_paths:
+            param_paths.append(f"{vessel_name}/gpstrack")
+        paths = list(dict.fromkeys(param_paths))
+
+        async def _fetch(path):
+            ts = signals.by_path(path)
+            df = await get_signals(
+                pub_tsb,
+                [ts.uuid],
+                client=c_client,
+                header=header,
+                noqc=noqc,
+                dt=dt,
+                start_time=start_time,
+                end_time=end_time,
+            )
+            return df.rename(columns={ts.uuid: ts.path})
+
+        results = await asyncio.gather(
+            *(_fetch(path) for path in paths), return_exceptions=True
+        )
+        frames = {}
+        errors = {}
+        for path, result in zip(paths, results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, BaseException):
+                errors[path] = result
+            else:
+                frames[path] = result
+        return frames, errors
+
+    print("Downloading data for ", vessel_name)
+    frames, errors = await _with_client(client, _run)
+    return _assemble_ship_data(
+        vessel_name, param_paths, frames, errors, noqc, return_errors
+    )
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local on-disk cache for time series data from the tsb back-end
+"""
+__all__ = ["TimeSeriesCache"]
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+from .tsb import _index_time
+from .util import _atomic_write_frame, _atomic_write_json
+
+
+def _utc(t):
+    """UTC timestamp, naive timestamps are assumed to be UTC"""
+    t = pd.Timestamp(t)
+    return t.tz_localize("UTC") if t.tz is None else t.tz_convert("UTC")
+
+
+def _missing_ranges(start_time, end_time, covered):
+    """Parts of start_time - end_time not covered by the (start, end)
+    intervals in covered"""
+    missing = []
+    c_start = start_time
+    for s, e in sorted(covered):
+        if e <= c_start:
+            continue
+        if s >= end_time:
+            break
+        if s > c_start:
+            missing.append((c_start, s))
+        c_start = max(c_start, e)
+    if c_start < end_time:
+        missing.append((c_start, end_time))
+    return missing
+
+
+def _concat_ordered(frames):
+    """Concatenate time ordered frames, neighbouring frames may share the
+    boundary timestamp (kept once)"""
+    out = []
+    last_time = None
+    for f in frames:
+        if not f.empty and last_time is not None:
+            f = f[f.index > last_time]
+        if not f.empty:
+            out.append(f)
+            last_time = f.index[-1]
+    return pd.concat(out) if len(out) > 0 else pd.DataFrame()
+
+
+class TimeSeriesCache:
+    """Opt-in on-disk cache of tsb query results
+
+    Data is stored as one pickled (columnar) DataFrame per cached time
+    range, in one directory per query key. A JSON index keeps track of
+    the time ranges covered for each key, where the key is the uuid(s)
+    and a fingerprint of the query parameters (dt, agg_type, noqc, ...).
+    Queries only fetch the missing parts of the requested range from tsb,
+    and store them as new ranges. When a key has more than max_segments
+    ranges, neighbouring ranges are merged. The least recently used ranges
+    are evicted when the cache grows above max_bytes.
+
+    Data for the last settle_margin seconds before now may still arrive
+    at tsb, that part of a query is always fetched and never cached.
+
+    The cache is safe to share between threads, but not between processes.
+
+    Example:
+        cache = TimeSeriesCache("~/.cache/pyniva", max_bytes=2 * 2**30)
+        df = ts.get_tseries(PUB_TSB, header=header, start_time=start,
+                            end_time=end, dt=0, cache=cache)
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory, max_bytes=2**30, settle_margin=3600, max_segments=32):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.max_segments = max_segments
+        self.settle_margin = settle_margin
+        self._lock = threading.RLock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        index_file = os.path.join(self.directory, self.INDEX_FILE)
+        if not os.path.exists(index_file):
+            return {}
+        try:
+            with open(index_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logging.warning("Could not read cache index %s, starting empty", index_file)
+            return {}
+
+    def _save_index(self):
+        _atomic_write_json(os.path.join(self.directory, self.INDEX_FILE), self._index)
+
+    @staticmethod
+    def key(uuids, params):
+        """Cache key for a query, the uuid(s) and a fingerprint of all query
+        parameters except the time range"""
+        key_params = {
+            k: v for k, v in params.items() if k not in ("start", "end", "uuid")
+        }
+        fingerprint = hashlib.sha1(
+            json.dumps(
+                {"uuid": list(uuids), "params": key_params}, sort_keys=True, default=str
+            ).encode("utf-8")
+        ).hexdigest()
+        return f"{uuids[0]}-{fingerprint[:16]}"
+
+    @property
+    def size(self):
+        """Total size (bytes) of cached data"""
+        with self._lock:
+            return sum(
+                seg["size"] for e in self._index.values() for seg in e["segments"]
+            )
+
+    def _read_segment(self, key, seg):
+        if seg["file"] is None:
+            return pd.DataFrame()
+        return pd.read_pickle(os.path.join(self.directory, key, seg["file"]))
+
+    def _write_segment(self, key, start_time, end_time, df):
+        seg = {
+            "start": start_time.isoformat(),
+            "end": end_time.isoformat(),
+            "file": None,
+            "size": 0,
+            "accessed": time.time(),
+        }
+        if not df.empty:
+            os.makedirs(os.path.join(self.directory, key), exist_ok=True)
+            seg["file"] = f"{start_time.value}_{end_time.value}.pkl"
+            file_name = os.path.join(self.directory, key, seg["file"])
+            _atomic_write_frame(file_name, df)
+            seg["size"] = os.path.getsize(file_name)
+        return seg
+
+    def _remove_segment(self, key, seg):
+        if seg["file"] is not None:
+            try:
+                os.remove(os.path.join(self.directory, key, seg["file"]))
+            except FileNotFoundError:
+                pass
+
+    def get_signals(self, uuids, params, start_time, end_time, fetch):
+        """Get data for a signals query, fetching only missing time ranges
+
+        Params:
+            uuids (list):  UUIDs of the query
+            params (dict): tsb query parameters (without the time range)
+            start_time, end_time (datetime): Time range of query
+            fetch:         Function fetching data from tsb for a
+                           (start_time, end_time) range
+
+        Returns:
+            A time indexed DataFrame as returned by get_signals
+        """
+        if start_time is None or end_time is None:
+            return fetch(start_time, end_time)
+        if "dt" not in params:
+            logging.warning(
+                "Queries without dt are aggregated to a fixed number of points "
+                "and are not cached."
+            )
+            return fetch(start_time, end_time)
+
+        key = self.key(uuids, params)
+        start, end = _utc(start_time), _utc(end_time)
+        with self._lock:
+            covered = [
+                (_utc(seg["start"]), _utc(seg["end"]))
+                for seg in self._entry(key, uuids, params)["segments"]
+            ]
+
+        # Ranges ending after the cutoff are returned but only cached up to it
+        cutoff = pd.Timestamp.now(tz="UTC") - pd.Timedelta(seconds=self.settle_margin)
+        recent = []
+        stored = False
+        for m_start, m_end in _missing_ranges(start, end, covered):
+            df = fetch(m_start.to_pydatetime(), m_end.to_pydatetime())
+            if m_end > cutoff:
+                recent.append(df)
+                if m_start >= cutoff:
+                    continue
+                m_end = cutoff
+            with self._lock:
+                self._add_segments(key, self._entry(key, uuids, params), m_start, m_end, df)
+            stored = True
+
+        with self._lock:
+            entry = self._entry(key, uuids, params)
+            if stored:
+                self._compact(key, entry)
+            used = [
+                seg
+                for seg in entry["segments"]
+                if _utc(seg["end"]) >= start and _utc(seg["start"]) <= end
+            ]
+            frames = []
+            for seg in used:
+                seg["accessed"] = time.time()
+                frames.append(self._read_segment(key, seg))
+            if stored:
+                self._evict()
+            self._save_index()
+
+        df = _concat_ordered(frames + recent)
+        if df.empty:
+            return df
+        return df[
+            (df.index >= _index_time(start, df.index))
+            & (df.index <= _index_time(end, df.index))
+        ]
+
+    def _entry(self, key, uuids, params):
+        """Index entry of a query key, created if missing"""
+        return self._index.setdefault(
+            key,
+            {
+                "uuid": list(uuids),
+                "params": {k: str(v) for k, v in params.items() if k != "uuid"},
+                "segments": [],
+            },
+        )
+
+    def _add_segments(self, key, entry, start_time, end_time, df):
+        """Store the data fetched for a time range as new segments. Parts
+        of the range cached by another query since it was fetched are
+        skipped, so segments do not overlap."""
+        covered = [(_utc(seg["start"]), _utc(seg["end"])) for seg in entry["segments"]]
+        for s, e in _missing_ranges(start_time, end_time, covered):
+            part = df
+            if not df.empty:
+                part = df[
+                    (df.index >= _index_time(s, df.index))
+                    & (df.index <= _index_time(e, df.index))
+                ]
+            entry["segments"].append(self._write_segment(key, s, e, part))
+        entry["segments"].sort(key=lambda seg: _utc(seg["start"]))
+
+    def _compact(self, key, entry):
+        """Merge runs of neighbouring segments into one segment each, when
+        a key has more than max_segments segments"""
+        if len(entry["segments"]) <= self.max_segments:
+            return
+        runs = []
+        for seg in entry["segments"]:
+            if runs and _utc(seg["start"]) <= _utc(runs[-1][-1]["end"]):
+                runs[-1].append(seg)
+            else:
+                runs.append([seg])
+        segments = []
+        for run in runs:
+            if len(run) == 1:
+                segments.append(run[0])
+                continue
+            df = _concat_ordered([self._read_segment(key, seg) for seg in run])
+            merged = self._write_segment(key, _utc(run[0]["start"]), _utc(run[-1]["end"]), df)
+            merged["accessed"] = max(seg["accessed"] for seg in run)
+            for seg in run:
+                if seg["file"] != merged["file"]:
+                    self._remove_segment(key, seg)
+            segments.append(merged)
+        entry["segments"] = segments
+
+    def _evict(self):
+        """Remove least recently used time ranges until below max_bytes"""
+        total = sum(seg["size"] for e in self._index.values() for seg in e["segments"])
+        if total <= self.max_bytes:
+            return
+        segments = sorted(
+            (
+                (seg["accessed"], key, seg)
+                for key, e in self._index.items()
+                for seg in e["segments"]
+            ),
+            key=lambda x: x[0],
+        )
+        for _, key, seg in segments:
+            if total <= self.max_bytes:
+                break
+            self._index[key]["segments"].remove(seg)
+            self._remove_segment(key, seg)
+            total -= seg["size"]
+        for key in [k for k, e in self._index.items() if len(e["segments"]) == 0]:
+            del self._index[key]
+
+    def clear(self):
+        """Remove all cached data"""
+        with self._lock:
+            for key, e in self._index.items():
+                for seg in e["segments"]:
+                    self._remove_segment(key, seg)
+            self._index = {}
+            self._save_index()
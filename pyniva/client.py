@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reusable HTTP client for NIVA's data platform
+"""
+__all__ = ["Client"]
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .get_data import token2header, get_newly_inserted_data
+from .metaflow import PUB_META
+from .tsb import PUB_TSB, get_signals, iter_signals
+from .thing import Thing
+from .request_dataframe import get_ship_data, get_available_parameters, iter_ship_data
+
+
+class _Retry(Retry):
+    """Retry of GET requests on RETRY_STATUS responses and connection
+    errors. PUT and DELETE are not idempotent in metaflow (a PUT without
+    uuid creates a Thing), they are only retried on responses to
+    requests that were not processed."""
+
+    UNPROCESSED_METHODS = frozenset(["PUT", "DELETE"])
+    UNPROCESSED_STATUS = frozenset([429, 503])
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() in self.UNPROCESSED_METHODS:
+            return status_code in self.UNPROCESSED_STATUS
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class Client(requests.Session):
+    """HTTP client for the tsb and metaflow services
+
+    The client is a requests.Session with a tuned connection pool
+    (keep-alive connections are reused between calls), default timeouts,
+    retry with exponential backoff on 429 and 5xx responses, and the
+    authentication header set on all requests.
+    Only GET requests are retried on all of these responses and on
+    connection errors. PUT and DELETE requests (e.g. Thing.save) are
+    only retried on 429 and 503, retrying them after another error
+    could save a Thing twice.
+    A Client can be passed as the session argument to all pyniva
+    functions and Thing methods, and also has shortcuts for the
+    most common queries.
+
+    Args:
+        tsb_host:       URL of the tsb service
+        meta_host:      URL of the metaflow service
+        header:         JWT header (see token2header)
+        token_file:     Token file, alternative to header
+        timeout:        Request timeout in seconds, or a (connect, read) tuple
+        retries:        Maximum number of retries for a request
+        backoff_factor: Backoff factor between retries (seconds)
+        pool_size:      Number of pooled connections per host
+
+    Example:
+        with Client(token_file="niva-service-account.json") as client:
+            vessel = Vessel.get_thing(client.meta_host, path="FA", session=client)
+            df = client.get_ship_data("FA", paths, start_time, end_time)
+    """
+
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        tsb_host=PUB_TSB,
+        meta_host=PUB_META,
+        header=None,
+        token_file=None,
+        timeout=(10, 300),
+        retries=3,
+        backoff_factor=0.5,
+        pool_size=10,
+    ):
+        super().__init__()
+        self.tsb_host = tsb_host
+        self.meta_host = meta_host
+        self.timeout = timeout
+        if token_file is not None:
+            header = token2header(token_file)
+        if header is not None:
+            self.headers.update(header)
+
+        retry = _Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUS,
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().request(method, url, **kwargs)
+
+    def get_thing(self, params=None, **kwargs):
+        """Get Thing instance(s) from metaflow, see Thing.get_thing"""
+        return Thing.get_thing(self.meta_host, params=params, session=self, **kwargs)
+
+    def get_signals(self, uuids, **kwargs):
+        """Get time series data from tsb, see tsb.get_signals"""
+        return get_signals(self.tsb_host, uuids, session=self, **kwargs)
+
+    def iter_signals(self, uuids, start_time, end_time, **kwargs):
+        """Iterate over time series data in chunks, see tsb.iter_signals"""
+        return iter_signals(self.tsb_host, uuids, start_time, end_time, session=self, **kwargs)
+
+    def get_available_parameters(self, platform_code, exclude_tests=True):
+        """Paths of the time series for a platform, see
+        request_dataframe.get_available_parameters"""
+        return get_available_parameters(
+            platform_code,
+            None,
+            meta_host=self.meta_host,
+            exclude_tests=exclude_tests,
+            session=self,
+        )
+
+    def get_ship_data(self, vessel_name, param_paths, start_time, end_time, noqc=False, **kwargs):
+        """Get data for a vessel, see request_dataframe.get_ship_data"""
+        return get_ship_data(
+            vessel_name,
+            param_paths,
+            start_time,
+            end_time,
+            noqc,
+            None,
+            pub_tsb=self.tsb_host,
+            meta_host=self.meta_host,
+            session=self,
+            **kwargs,
+        )
+
+    def iter_ship_data(self, vessel_name, param_paths, start_time, end_time, noqc=False, **kwargs):
+        """Iterate over the data for a vessel in chunks, see
+        request_dataframe.iter_ship_data"""
+        return iter_ship_data(
+            vessel_name,
+            param_paths,
+            start_time,
+            end_time,
+            noqc,
+            None,
+            pub_tsb=self.tsb_host,
+            meta_host=self.meta_host,
+            session=self,
+            **kwargs,
+        )
+
+    def get_newly_inserted_data(self, start_time, end_time, aggregate, **kwargs):
+        """Get data inserted in a time range, see get_newly_inserted_data"""
+        return get_newly_inserted_data(
+            start_time,
+            end_time,
+            aggregate,
+            self.meta_host,
+            self.tsb_host,
+            session=self,
+            **kwargs,
+        )
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Apache Arrow and Polars output for tsb queries
+
+The decoded tsb rows are built directly into Arrow tables or Polars
+DataFrames, column by column, without an intermediate pandas DataFrame.
+Select the output with the output argument of get_signals,
+TimeSeries.get_timeseries_list and get_ship_data ("arrow" or "polars").
+The frames have a time column (UTC) followed by longitude and latitude
+(for GPS tracks) and one column per time series.
+
+Requires the optional pyarrow or polars dependency
+(pip install pyniva[arrow] or pip install pyniva[polars]).
+"""
+__all__ = ["ts_list2table", "ts_list2polars"]
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover
+    pa = None
+
+try:
+    import polars as pl
+except ImportError:  # pragma: no cover
+    pl = None
+
+from .tsb import _TS_INDEX_KEYS, _dtype_policy, _parse_utc_times, _warn_dropped
+
+
+def _require(module, package, extra):
+    if module is None:
+        raise ImportError(
+            f"{extra.capitalize()} output requires {package}, install it with "
+            f"'pip install pyniva[{extra}]'"
+        )
+
+
+def _column_keys(ts_dict_list):
+    """Column names in ts_list2df order: longitude and latitude first,
+    then the union of the other keys in first-seen order"""
+    assert len(ts_dict_list) > 0
+    keys = dict.fromkeys(ts_dict_list[0])
+    for row in ts_dict_list:
+        if not keys.keys() >= row.keys():
+            keys.update(dict.fromkeys(row))
+    assert "time" in keys
+    columns = []
+    if "longitude" in keys and "latitude" in keys:
+        columns += ["longitude", "latitude"]
+    columns += [k for k in keys if k not in _TS_INDEX_KEYS]
+    return columns
+
+
+def _int_type_bounds(lo, hi):
+    """Smallest signed integer type (name) holding lo and hi"""
+    for name in ("int8", "int16", "int32"):
+        info = np.iinfo(name)
+        if info.min <= lo and hi <= info.max:
+            return name
+    return "int64"
+
+
+def _time_bound(t, tz):
+    """Window bound as a datetime comparable with a time column in tz,
+    naive bounds are assumed to be UTC"""
+    t = pd.Timestamp(t)
+    t = t.tz_localize("UTC") if t.tz is None else t.tz_convert("UTC")
+    if tz is None:
+        t = t.tz_localize(None)
+    return t.to_pydatetime()
+
+
+# Arrow
+
+
+def _arrow_time(times):
+    parsed = _parse_utc_times(times)
+    if parsed is not None:
+        unit = np.datetime_data(parsed.dtype)[0]
+        return pa.array(parsed).cast(pa.timestamp(unit, tz="UTC"))
+    return pa.array(pd.to_datetime(times, format="ISO8601"))
+
+
+def _arrow_column(values, key, policy):
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed value types, fall back to strings
+        array = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    measurement = policy is not None and key not in _TS_INDEX_KEYS
+    if pa.types.is_null(array.type):
+        float32 = measurement and policy.float_dtype == np.float32
+        return array.cast(pa.float32() if float32 else pa.float64())
+    if policy is None:
+        return array
+    if pa.types.is_floating(array.type) and measurement:
+        return array.cast(pa.from_numpy_dtype(policy.float_dtype))
+    if pa.types.is_integer(array.type) and policy.nullable:
+        bounds = pc.min_max(array).as_py()
+        if bounds["min"] is not None:
+            return array.cast(_int_type_bounds(bounds["min"], bounds["max"]))
+    if pa.types.is_string(array.type) and policy.categorical:
+        return array.dictionary_encode()
+    return array
+
+
+def ts_list2table(ts_dict_list, dtypes=None):
+    """Create an Arrow table from a list of tsb row dictionaries
+
+    Params:
+        ts_dict_list (list like): List of dictionaries for time series
+             like JSON returned by tsb endpoint, each of the dictionaries
+             must contain a timestamp (key = time)
+        dtypes: None for the default column types, "compact" or a
+             DtypePolicy (see tsb.DtypePolicy)
+    Returns:
+        A pyarrow.Table with a time column and the data columns
+    """
+    _require(pa, "pyarrow", "arrow")
+    policy = _dtype_policy(dtypes)
+    columns = _column_keys(ts_dict_list)
+    arrays = [_arrow_time([r.get("time") for r in ts_dict_list])]
+    arrays += [_arrow_column([r.get(k) for r in ts_dict_list], k, policy) for k in columns]
+    return pa.Table.from_arrays(arrays, names=["time"] + columns)
+
+
+class _ArrowOutput:
+    """Arrow table output of the tsb query functions"""
+
+    name = "arrow"
+
+    def __init__(self, policy=None):
+        _require(pa, "pyarrow", "arrow")
+        self.policy = policy
+
+    def decode(self, ts_dict_list):
+        return ts_list2table(ts_dict_list, dtypes=self.policy)
+
+    def empty(self):
+        return pa.table({})
+
+    def concat(self, frames, windows):
+        """Concatenate the tables of consecutive time windows, dropping
+        rows at a window boundary from the first one"""
+        frames = list(frames)
+        for i, (_, w_end) in enumerate(windows[:-1]):
+            f = frames[i]
+            if f.num_rows:
+                time_type = f.schema.field("time").type
+                bound = pa.scalar(_time_bound(w_end, time_type.tz), type=time_type)
+                frames[i] = f.filter(pc.less(f["time"], bound))
+        frames = [f for f in frames if f.num_rows]
+        if len(frames) == 0:
+            return self.empty()
+        return pa.concat_tables(frames, promote_options="permissive")
+
+    def rename(self, frame, names):
+        return frame.rename_columns([names.get(c, c) for c in frame.column_names])
+
+    def align(self, frames, keep="last"):
+        """Outer join tables on time, see tsb.align_frames"""
+        frames = [f for f in frames if f.num_rows]
+        if len(frames) == 0:
+            return self.empty()
+
+        clean = []
+        for f in frames:
+            f = f.combine_chunks()
+            f = f.take(pc.sort_indices(f, sort_keys=[("time", "ascending")]))
+            if f.num_rows > 1:
+                times = f["time"].combine_chunks()
+                # Sorting is stable, keep the first or last row per timestamp
+                new = pc.not_equal(times[1:], times[:-1])
+                if keep == "last":
+                    mask = pa.concat_arrays([new, pa.array([True])])
+                else:
+                    mask = pa.concat_arrays([pa.array([True]), new])
+                f = f.filter(mask)
+            clean.append(f)
+
+        time_type = clean[0].schema.field("time").type
+        union = pa.chunked_array([f["time"].cast(time_type) for f in clean]).combine_chunks()
+        if len(clean) > 1:
+            union = pc.unique(union)
+            union = union.take(pc.sort_indices(union))
+
+        names, arrays = ["time"], [union]
+        for f in clean:
+            indices = None
+            for name in f.column_names:
+                if name == "time":
+                    continue
+                if name in names:
+                    logging.warning("Column %s found in several frames, keeping the first", name)
+                    continue
+                if indices is None:
+                    indices = pc.index_in(
+                        union, value_set=f["time"].cast(time_type).combine_chunks()
+                    )
+                names.append(name)
+                arrays.append(f[name].take(indices))
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def conform(self, frame, columns, w_end=None):
+        """Rows before w_end (if given) with the time column and exactly
+        the given columns, missing columns are filled with nulls"""
+        if w_end is not None and frame.num_rows:
+            time_type = frame.schema.field("time").type
+            bound = pa.scalar(_time_bound(w_end, time_type.tz), type=time_type)
+            frame = frame.filter(pc.less(frame["time"], bound))
+        _warn_dropped(frame.column_names, columns)
+        float_type = pa.float64() if self.policy is None else pa.from_numpy_dtype(self.policy.float_dtype)
+        names = frame.column_names
+        arrays = [frame["time"]] + [
+            frame[c] if c in names else pa.nulls(frame.num_rows, type=float_type)
+            for c in columns
+        ]
+        return pa.Table.from_arrays(arrays, names=["time"] + list(columns))
+
+    def finish_ship_data(self, frame, noqc, empty_paths):
+        """get_ship_data post processing of the aligned table"""
+        names = frame.column_names
+        if not noqc and "latitude" in names and "longitude" in names:
+            frame = frame.filter(
+                pc.or_(pc.is_valid(frame["latitude"]), pc.is_valid(frame["longitude"]))
+            )
+        float_type = pa.float64() if self.policy is None else pa.from_numpy_dtype(self.policy.float_dtype)
+        for path in empty_paths:
+            if path not in frame.column_names:
+                frame = frame.append_column(path, pa.nulls(frame.num_rows, type=float_type))
+        return frame
+
+
+# Polars
+
+
+def _polars_time(times):
+    parsed = _parse_utc_times(times)
+    if parsed is not None:
+        return pl.Series("time", parsed).dt.replace_time_zone("UTC")
+    return pl.Series("time", pd.to_datetime(times, format="ISO8601").to_pydatetime())
+
+
+def _polars_column(values, key, policy):
+    series = pl.Series(key, values, strict=False)
+    measurement = policy is not None and key not in _TS_INDEX_KEYS
+    if series.dtype == pl.Null:
+        float32 = measurement and policy.float_dtype == np.float32
+        return series.cast(pl.Float32 if float32 else pl.Float64)
+    if policy is None:
+        return series
+    if series.dtype.is_float() and measurement and policy.float_dtype == np.float32:
+        return series.cast(pl.Float32)
+    if series.dtype.is_integer() and policy.nullable and series.null_count() < len(series):
+        name = _int_type_bounds(series.min(), series.max())
+        return series.cast(getattr(pl, name.capitalize()))
+    if series.dtype == pl.String and policy.categorical:
+        return series.cast(pl.Categorical)
+    return series
+
+
+def ts_list2polars(ts_dict_list, dtypes=None):
+    """Create a Polars DataFrame from a list of tsb row dictionaries
+
+    Params:
+        ts_dict_list (list like): List of dictionaries for time series
+             like JSON returned by tsb endpoint, each of the dictionaries
+             must contain a timestamp (key = time)
+        dtypes: None for the default column types, "compact" or a
+             DtypePolicy (see tsb.DtypePolicy)
+    Returns:
+        A polars.DataFrame with a time column and the data columns
+    """
+    _require(pl, "polars", "polars")
+    policy = _dtype_policy(dtypes)
+    columns = _column_keys(ts_dict_list)
+    series = [_polars_time([r.get("time") for r in ts_dict_list])]
+    series += [_polars_column([r.get(k) for r in ts_dict_list], k, policy) for k in columns]
+    return pl.DataFrame(series)
+
+
+class _PolarsOutput:
+    """Polars DataFrame output of the tsb query functions"""
+
+    name = "polars"
+
+    def __init__(self, policy=None):
+        _require(pl, "polars", "polars")
+        self.policy = policy
+
+    def decode(self, ts_dict_list):
+        return ts_list2polars(ts_dict_list, dtypes=self.policy)
+
+    def empty(self):
+        return pl.DataFrame()
+
+    def concat(self, frames, windows):
+        """Concatenate the frames of consecutive time windows, dropping
+        rows at a window boundary from the first one"""
+        frames = list(frames)
+        for i, (_, w_end) in enumerate(windows[:-1]):
+            f = frames[i]
+            if f.height:
+                bound = _time_bound(w_end, f.schema["time"].time_zone)
+                frames[i] = f.filter(pl.col("time") < bound)
+        frames = [f for f in frames if f.height]
+        if len(frames) == 0:
+            return self.empty()
+        return pl.concat(frames, how="diagonal_relaxed")
+
+    def rename(self, frame, names):
+        return frame.rename({c: names[c] for c in frame.columns if c in names})
+
+    def align(self, frames, keep="last"):
+        """Outer join frames on time, see tsb.align_frames"""
+        clean = []
+        seen = set()
+        for f in frames:
+            if f.height == 0:
+                continue
+            duplicated = [c for c in f.columns if c != "time" and c in seen]
+            for c in duplicated:
+                logging.warning("Column %s found in several frames, keeping the first", c)
+            f = f.drop(duplicated)
+            seen.update(f.columns)
+            clean.append(f.unique(subset="time", keep=keep, maintain_order=True).sort("time"))
+        if len(clean) == 0:
+            return self.empty()
+        if len(clean) == 1:
+            return clean[0]
+        return pl.concat(clean, how="align")
+
+    def conform(self, frame, columns, w_end=None):
+        """Rows before w_end (if given) with the time column and exactly
+        the given columns, missing columns are filled with nulls"""
+        if w_end is not None and frame.height:
+            frame = frame.filter(pl.col("time") < _time_bound(w_end, frame.schema["time"].time_zone))
+        _warn_dropped(frame.columns, columns)
+        float32 = self.policy is not None and self.policy.float_dtype == np.float32
+        return frame.select(
+            [pl.col("time")]
+            + [
+                pl.col(c) if c in frame.columns
+                else pl.lit(None, dtype=pl.Float32 if float32 else pl.Float64).alias(c)
+                for c in columns
+            ]
+        )
+
+    def finish_ship_data(self, frame, noqc, empty_paths):
+        """get_ship_data post processing of the aligned frame"""
+        if not noqc and "latitude" in frame.columns and "longitude" in frame.columns:
+            frame = frame.filter(
+                pl.col("latitude").is_not_null() | pl.col("longitude").is_not_null()
+            )
+        float32 = self.policy is not None and self.policy.float_dtype == np.float32
+        return frame.with_columns(
+            [
+                pl.lit(None, dtype=pl.Float32 if float32 else pl.Float64).alias(path)
+                for path in empty_paths
+                if path not in frame.columns
+            ]
+        )
@@ -3,17 +3,26 @@
 """
 Functions to authenticate against and grab data from NIVA API endpoints
 """
-__all__ = ["get_data", "token2header", "PyNIVAError", "get_newly_inserted_data"]
+__all__ = [
+    "get_data",
+    "token2header",
+    "PyNIVAError",
+    "get_newly_inserted_data",
+    "pooled_session",
+]
 import logging
 import uuid
 import datetime as dt
 import json
-from math import ceil
 from urllib.parse import urljoin
+import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 import jwt
 import io
 
+from .instrument import _request_timer
+
 from importlib.metadata import version
 __version__ = version("pyniva")
 
@@ -33,6 +42,23 @@ class PyNIVAError(Exception):
         )
 
 
+def pooled_session(pool_size=10):
+    """Create a requests session with a connection pool sized for
+    concurrent use from several threads.
+
+    Params:
+        pool_size (int): Maximum number of pooled connections per host
+
+    Returns:
+        A requests.Session instance
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 def validate_query_parameters(**params):
     if "dt" not in params.keys() and "n" not in params.keys():
         logging.warning(
@@ -57,14 +83,16 @@ def get_data(url: str, params: dict=None, headers: dict =None, session: requests
     """
     validate_query_parameters(**params)
     rq = session or requests
-    if headers is None:
-        headers = {}
+    # Copy, the same header dictionary may be shared between threads
+    headers = dict(headers or {})
     trace_id = str(uuid.uuid4())
     headers["Trace-Id"] = trace_id
     headers["User-Agent"] = f"pyniva/{__version__}"
-    response = rq.get(url, headers=headers, params=params)
-    tsb_response_raise_for_status(response, trace_id)
-    full_data = response.json()
+    with _request_timer(trace_id, "tsb", "GET", url, params=params) as timer:
+        response = rq.get(url, headers=headers, params=params)
+        timer.response(response)
+        tsb_response_raise_for_status(response, trace_id)
+        full_data = timer.decode(response)
 
     # If no error occurred the data is found in the "t" attribute of
     # returned data
@@ -126,7 +154,38 @@ def get_newly_inserted_data(
     ts_host: str,
     headers=None,
     session=None,
+    path_map=None,
+    as_frame=False,
+    max_workers=4,
 ):
+    """Get the data inserted into tsb in a time range (insert time)
+
+    The paths of the time series are requested from metaflow in batches.
+    Pass a UuidPathMap as path_map to reuse the paths between calls, so
+    only uuids that have not been seen before are requested.
+
+    Params:
+       start_time (datetime):   Start of the insert time range
+       end_time (datetime):     End of the insert time range
+       aggregate (bool):        Aggregate the data per time series
+       meta_host (str):         URL of the metaflow service
+       ts_host (str):           URL of the tsb service
+       headers (dict):          Header data for the request, must include JWT access token
+       session (Session):       Requests session object
+       path_map (UuidPathMap):  uuid -> path mapping reused between calls, by
+                                default the paths are only kept for this call
+       as_frame (bool):         Return a DataFrame (with a categorical path column)
+       max_workers (int):       Maximum number of concurrent metaflow requests
+
+    Returns:
+       A list of dictionaries with a path key added to each row, or a
+       DataFrame if as_frame is True
+
+    Raises:
+       KeyError if the path of a uuid is not found in metaflow
+    """
+    from .metaflow import UuidPathMap
+
     params = {
         "start": start_time.isoformat(),
         "end": end_time.isoformat(),
@@ -134,28 +193,39 @@ def get_newly_inserted_data(
     }
 
     rq = session or requests
-    if headers is None:
-        headers = {}
+    headers = dict(headers or {})
     trace_id = str(uuid.uuid4())
     headers["Trace-Id"] = trace_id
     headers["User-Agent"] = f"pyniva/{__version__}"
-    response = rq.get(
-        urljoin(ts_host, "time-series-by-insert-time"), headers=headers, params=params
+    url = urljoin(ts_host, "time-series-by-insert-time")
+    with _request_timer(trace_id, "tsb", "GET", url, params=params) as timer:
+        response = rq.get(url, headers=headers, params=params)
+        timer.response(response)
+        tsb_response_raise_for_status(response, trace_id)
+        data = timer.decode(response)
+
+    path_map = path_map if path_map is not None else UuidPathMap()
+    uuids = [row["uuid"] for row in data]
+    uuid_path_map = path_map.resolve(
+        meta_host,
+        uuids,
+        header=headers,
+        session=session,
+        max_workers=max_workers,
     )
-    tsb_response_raise_for_status(response, trace_id)
-    data = response.json()
-
-    uuids = list({row["uuid"] for row in data})
-    uuid_path_map = {}
-    query_size = 80  # Number of uuids to query per request, url length is limited so we need to bunch..
-    for i in range(ceil(len(uuids) / query_size)):
-        r = rq.get(
-            meta_host,
-            params={"uuid": ",".join(uuids[i * query_size : (i + 1) * query_size])},
-            headers=headers,
-        )
-        r.raise_for_status()
-        t = r.json()
-        for thing in t["t"]:
-            uuid_path_map[thing["uuid"]] = thing["path"]
-    return [{**row, "path": uuid_path_map[row["uuid"]]} for row in data]
+    missing = [u for u in dict.fromkeys(uuids) if u not in uuid_path_map]
+    if missing:
+        raise KeyError(f"Could not find the path of uuids {missing}")
+    if not as_frame:
+        return [{**row, "path": uuid_path_map[row["uuid"]]} for row in data]
+
+    df = pd.DataFrame(data)
+    if df.empty:
+        return df
+    for column in ("time", "created_timestamp"):
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], format="ISO8601", utc=True)
+    df["uuid"] = df["uuid"].astype("category")
+    # Mapping a categorical maps its categories, not every row
+    df["path"] = df["uuid"].map(uuid_path_map).astype("category")
+    return df
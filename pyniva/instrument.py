@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the requests made to the tsb and metaflow services
+
+Every request made by get_data, get_thing and get_newly_inserted_data
+(and their asyncio versions) is described by a RequestEvent, tagged with
+the Trace-Id sent to the service. Events are passed to the registered
+request hooks and recorded in the metrics registry, if enabled. Without
+hooks or registry the requests are not instrumented.
+
+Example:
+    from pyniva.instrument import add_request_hook, enable_metrics
+
+    add_request_hook(lambda e: e.latency > 5 and print("slow", e.trace_id, e.url))
+    metrics = enable_metrics()
+    ...
+    print(metrics.summary())
+"""
+__all__ = [
+    "RequestEvent",
+    "MetricsRegistry",
+    "add_request_hook",
+    "remove_request_hook",
+    "enable_metrics",
+    "disable_metrics",
+    "get_metrics",
+]
+
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class RequestEvent:
+    """Timing and size of a single request
+
+    Attributes:
+        trace_id:       Trace-Id header sent with the request
+        service:        "tsb" or "metaflow"
+        method:         HTTP method
+        url:            Request URL (without query parameters)
+        endpoint:       Endpoint used for aggregated metrics
+        params:         Query parameters
+        start:          Start of the request (epoch seconds)
+        latency:        Seconds until the response was received
+        decode_time:    Seconds spent decoding the JSON response
+        response_bytes: Size of the response body
+        status:         HTTP status code, None if no response was received
+        retries:        Number of retries made by the session (see Client)
+        error:          Exception raised by the request, or None
+    """
+
+    __slots__ = (
+        "trace_id",
+        "service",
+        "method",
+        "url",
+        "endpoint",
+        "params",
+        "start",
+        "latency",
+        "decode_time",
+        "response_bytes",
+        "status",
+        "retries",
+        "error",
+    )
+
+    def __init__(self, trace_id, service, method, url, endpoint=None, params=None):
+        self.trace_id = trace_id
+        self.service = service
+        self.method = method
+        self.url = url
+        self.endpoint = endpoint or url
+        self.params = params
+        self.start = time.time()
+        self.latency = None
+        self.decode_time = 0.0
+        self.response_bytes = None
+        self.status = None
+        self.retries = 0
+        self.error = None
+
+    def as_dict(self):
+        d = {k: getattr(self, k) for k in self.__slots__}
+        d["error"] = None if self.error is None else repr(self.error)
+        return d
+
+    def __repr__(self):
+        return (
+            f"RequestEvent({self.trace_id} {self.method} {self.url} "
+            f"status={self.status} latency={self.latency})"
+        )
+
+
+class MetricsRegistry:
+    """In-memory metrics for the instrumented requests
+
+    Keeps per endpoint counts, errors, retries, response bytes, decode
+    time and a latency histogram, and the most recent events so slow or
+    failing requests can be looked up by trace id.
+
+    Args:
+        max_events: Number of recent events kept
+        buckets:    Upper bounds (seconds) of the latency histogram buckets
+    """
+
+    def __init__(self, max_events=1000, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.events = deque(maxlen=max_events)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def _new_endpoint(self):
+        return {
+            "count": 0,
+            "errors": 0,
+            "retries": 0,
+            "response_bytes": 0,
+            "latency": 0.0,
+            "max_latency": 0.0,
+            "decode_time": 0.0,
+            # The last bucket counts latencies above the largest bound
+            "histogram": [0] * (len(self.buckets) + 1),
+        }
+
+    def record(self, event):
+        """Add a RequestEvent to the metrics"""
+        with self._lock:
+            self.events.append(event)
+            key = (event.service, event.endpoint)
+            m = self._endpoints.get(key)
+            if m is None:
+                m = self._endpoints[key] = self._new_endpoint()
+            m["count"] += 1
+            m["errors"] += event.error is not None
+            m["retries"] += event.retries
+            m["response_bytes"] += event.response_bytes or 0
+            m["decode_time"] += event.decode_time
+            if event.latency is not None:
+                m["latency"] += event.latency
+                m["max_latency"] = max(m["max_latency"], event.latency)
+                m["histogram"][bisect.bisect_left(self.buckets, event.latency)] += 1
+
+    def summary(self):
+        """Metrics per endpoint
+
+        Returns:
+            Dictionary with a dictionary of metrics for each
+            "service endpoint", including the mean latency and the
+            histogram as a {bucket upper bound: count} dictionary
+        """
+        with self._lock:
+            endpoints = {k: dict(m) for k, m in self._endpoints.items()}
+        summary = {}
+        for (service, endpoint), m in sorted(endpoints.items()):
+            m["mean_latency"] = m["latency"] / m["count"] if m["count"] else None
+            m["histogram"] = dict(zip(self.buckets + (float("inf"),), m["histogram"]))
+            summary[f"{service} {endpoint}"] = m
+        return summary
+
+    def find(self, trace_id):
+        """The recent event with the given trace id, or None"""
+        with self._lock:
+            for event in self.events:
+                if event.trace_id == trace_id:
+                    return event
+        return None
+
+    def slowest(self, n=10):
+        """The n slowest recent events"""
+        with self._lock:
+            events = [e for e in self.events if e.latency is not None]
+        return sorted(events, key=lambda e: e.latency, reverse=True)[:n]
+
+    def reset(self):
+        with self._lock:
+            self.events.clear()
+            self._endpoints.clear()
+
+
+# Registered hooks and metrics registry, hooks are replaced (not
+# mutated) so requests running in other threads see a consistent list
+_request_hooks = ()
+_metrics = None
+
+
+def add_request_hook(hook):
+    """Register a function called with a RequestEvent after every request
+
+    Hooks are called in the thread making the request (also for failed
+    requests), exceptions raised by hooks are logged and ignored.
+    """
+    global _request_hooks
+    _request_hooks = _request_hooks + (hook,)
+
+
+def remove_request_hook(hook):
+    """Unregister a hook added with add_request_hook"""
+    global _request_hooks
+    # Compared by equality, bound methods are created anew on every access
+    _request_hooks = tuple(h for h in _request_hooks if h != hook)
+
+
+def enable_metrics(max_events=1000, buckets=LATENCY_BUCKETS):
+    """Enable the module wide metrics registry
+
+    Returns:
+        The MetricsRegistry instance
+    """
+    global _metrics
+    _metrics = MetricsRegistry(max_events=max_events, buckets=buckets)
+    return _metrics
+
+
+def disable_metrics():
+    global _metrics
+    _metrics = None
+
+
+def get_metrics():
+    """The module wide MetricsRegistry, None if not enabled"""
+    return _metrics
+
+
+def _retry_count(response):
+    """Number of retries made by urllib3 for a requests response"""
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    return len(getattr(retries, "history", None) or ())
+
+
+class _RequestTimer:
+    """Context manager filling in and emitting a RequestEvent"""
+
+    __slots__ = ("event", "_t0", "_hooks", "_metrics")
+
+    def __init__(self, event, hooks, metrics):
+        self.event = event
+        self._hooks = hooks
+        self._metrics = metrics
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def response(self, response):
+        """Record the status and size of a received response"""
+        event = self.event
+        event.latency = time.perf_counter() - self._t0
+        event.status = getattr(response, "status_code", None)
+        content = getattr(response, "content", None)
+        event.response_bytes = len(content) if content is not None else None
+        event.retries = _retry_count(response)
+
+    def decode(self, response):
+        """Decode the JSON response, recording the time it takes"""
+        t0 = time.perf_counter()
+        data = response.json()
+        self.event.decode_time += time.perf_counter() - t0
+        return data
+
+    def __exit__(self, exc_type, exc, tb):
+        event = self.event
+        if event.latency is None:
+            event.latency = time.perf_counter() - self._t0
+        event.error = exc
+        if self._metrics is not None:
+            self._metrics.record(event)
+        for hook in self._hooks:
+            try:
+                hook(event)
+            except Exception:
+                logging.exception("Request hook %r failed", hook)
+        return False
+
+
+class _NullTimer:
+    """Stand-in for _RequestTimer when nothing is instrumented"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def response(self, response):
+        pass
+
+    def decode(self, response):
+        return response.json()
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _request_timer(trace_id, service, method, url, endpoint=None, params=None):
+    """Timer for a request, use as
+
+        with _request_timer(trace_id, "tsb", "GET", url) as timer:
+            response = session.get(url)
+            timer.response(response)
+            data = timer.decode(response)
+    """
+    hooks, metrics = _request_hooks, _metrics
+    if not hooks and metrics is None:
+        return _NULL_TIMER
+    if endpoint is None:
+        endpoint = urlsplit(url).path
+    event = RequestEvent(trace_id, service, method, url, endpoint=endpoint, params=params)
+    return _RequestTimer(event, hooks, metrics)
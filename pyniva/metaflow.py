@@ -10,10 +10,18 @@ __all__ = [
     "PUB_DETAIL",
     "PUB_META",
     "get_thing",
+    "get_things_by_uuid",
+    "UuidPathMap",
+    "MetaCache",
+    "enable_meta_cache",
+    "disable_meta_cache",
+    "invalidate_meta_cache",
     "update_thing",
     "delete_thing",
+    "walk_tree",
     "thing_tree2ts",
     "path2all_ts",
+    "TSERIES_TTYPES",
 ]
 
 import uuid
@@ -22,11 +30,19 @@ import requests
 import json
 import os
 import logging
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
 
 from importlib.metadata import version
 __version__ = version("pyniva")
 
 from .get_data import PyNIVAError
+from .instrument import _request_timer
+from .util import _atomic_write_json
 
 # "Internal" endpoint for meta dat
 META_HOST_ADDR = os.environ.get("METAFLOW_SERVICE_HOST", "localhost")
@@ -41,8 +57,220 @@ PUB_PLATFORM = f"{path}/v1/vessels"
 PUB_DETAIL = f"{path}/v1/details/"
 PUB_META = f"{path}/v1/metaflow/"
 
+# Thing types holding time series data
+TSERIES_TTYPES = ("tseries", "qctseries", "gpstrack", "spectra")
 
-def get_thing(meta_host, par, header=None, session=None):
+# Conservative limit for the length of request URLs (including query)
+MAX_URL_LENGTH = 2000
+
+
+class MetaCache:
+    """In-process TTL/LRU cache for metaflow responses
+
+    Entries are keyed on metaflow host, normalized query parameters and
+    a hash of the Authorization header, so metadata is never shared
+    between tokens. Entries older than ttl seconds are stale; a stale
+    entry younger than ttl + stale_ttl is returned immediately and
+    refreshed in a background thread (stale-while-revalidate). Older
+    entries are fetched again. If directory is set, entries are also
+    persisted on disk as JSON files and shared between processes and
+    sessions. Expired files are removed and about max_files entries (at
+    most max_files + max_files // 8) are kept on disk.
+
+    Args:
+        ttl:       Seconds an entry is fresh
+        maxsize:   Maximum number of entries kept in memory
+        stale_ttl: Seconds a stale entry may be served while refreshed
+        directory: Optional directory for on-disk persistence
+        max_files: Maximum number of entries kept on disk
+    """
+
+    def __init__(self, ttl=300, maxsize=256, stale_ttl=0, directory=None, max_files=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stale_ttl = stale_ttl
+        self.max_files = max_files
+        self.directory = os.path.expanduser(directory) if directory else None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(meta_host, par, header=None):
+        """Cache key for host, (normalized) query parameters and the
+        Authorization header of the request"""
+        norm_par = sorted((str(k), str(v)) for k, v in (par or {}).items())
+        auth = next(
+            (str(v) for k, v in (header or {}).items() if k.lower() == "authorization"), ""
+        )
+        auth_hash = hashlib.sha256(auth.encode("utf-8")).hexdigest()[:32] if auth else ""
+        return json.dumps([meta_host.rstrip("/"), norm_par, auth_hash])
+
+    @staticmethod
+    def _host_prefix(meta_host):
+        return hashlib.sha1(meta_host.rstrip("/").encode("utf-8")).hexdigest()[:16] + "-"
+
+    def _file_name(self, key):
+        return os.path.join(
+            self.directory,
+            self._host_prefix(json.loads(key)[0])
+            + hashlib.sha1(key.encode("utf-8")).hexdigest()
+            + ".json",
+        )
+
+    def get(self, key):
+        """Get a cached value
+
+        Returns:
+            Tuple (value, stale), value is None for missing or expired entries
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.directory:
+            file_name = self._file_name(key)
+            try:
+                with open(file_name, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = None
+            if isinstance(data, dict) and data.get("key") == key:
+                if self._expired(data["stored"]):
+                    _remove_file(file_name)
+                    return None, False
+                entry = (data["stored"], json.dumps(data["value"]))
+                with self._lock:
+                    self._store(key, entry)
+        if entry is None:
+            return None, False
+
+        stored, payload = entry
+        if self._expired(stored):
+            return None, False
+        return json.loads(payload), time.time() - stored > self.ttl
+
+    def _expired(self, stored):
+        return time.time() - stored > self.ttl + self.stale_ttl
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def set(self, key, value):
+        """Cache a value (a private copy is stored)"""
+        stored = time.time()
+        with self._lock:
+            self._store(key, (stored, json.dumps(value)))
+        if self.directory:
+            _atomic_write_json(
+                self._file_name(key), {"key": key, "stored": stored, "value": value}
+            )
+            # The directory is listed once per max_files // 8 writes
+            with self._lock:
+                self._writes += 1
+                prune = self._writes >= max(1, self.max_files // 8)
+                if prune:
+                    self._writes = 0
+            if prune:
+                self._prune_files()
+
+    def _prune_files(self):
+        """Remove expired entries from disk, and the oldest entries above
+        max_files (file modification time is the time stored)"""
+        files = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".json"):
+                continue
+            c_file = os.path.join(self.directory, file_name)
+            try:
+                files.append((os.path.getmtime(c_file), c_file))
+            except OSError:
+                pass
+        files.sort()
+        n_remove = max(0, len(files) - self.max_files)
+        for i, (mtime, c_file) in enumerate(files):
+            if i < n_remove or self._expired(mtime):
+                _remove_file(c_file)
+
+    def refresh(self, key, fetch):
+        """Refresh an entry in a background thread, unless already refreshing"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _refresh():
+            try:
+                self.set(key, fetch())
+            except Exception as e:
+                logging.warning("Could not refresh cached metadata: %s", e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=_refresh, daemon=True).start()
+
+    def invalidate(self, meta_host=None):
+        """Remove all entries, or all entries for one metaflow host"""
+        host = meta_host.rstrip("/") if meta_host is not None else None
+        with self._lock:
+            keys = [
+                k for k in self._entries if host is None or json.loads(k)[0] == host
+            ]
+            for k in keys:
+                del self._entries[k]
+        if self.directory:
+            prefix = self._host_prefix(meta_host) if meta_host is not None else ""
+            for file_name in os.listdir(self.directory):
+                if file_name.startswith(prefix) and file_name.endswith(".json"):
+                    _remove_file(os.path.join(self.directory, file_name))
+
+
+def _remove_file(file_name):
+    try:
+        os.remove(file_name)
+    except FileNotFoundError:
+        pass
+
+
+# Module wide metadata cache used by get_thing, disabled by default
+_meta_cache = None
+
+
+def enable_meta_cache(ttl=300, maxsize=256, stale_ttl=0, directory=None, max_files=1024):
+    """Enable the module wide metadata cache used by get_thing (and all
+    Thing methods fetching metadata). See MetaCache for the arguments.
+
+    Returns:
+        The MetaCache instance
+    """
+    global _meta_cache
+    _meta_cache = MetaCache(
+        ttl=ttl, maxsize=maxsize, stale_ttl=stale_ttl, directory=directory,
+        max_files=max_files,
+    )
+    return _meta_cache
+
+
+def disable_meta_cache():
+    """Disable the module wide metadata cache"""
+    global _meta_cache
+    _meta_cache = None
+
+
+def invalidate_meta_cache(meta_host=None):
+    """Drop cached metadata, for all hosts or only for meta_host"""
+    if _meta_cache is not None:
+        _meta_cache.invalidate(meta_host)
+
+
+def get_thing(meta_host, par, header=None, session=None, cache=None):
     """Helper function to get thing meta data dictionary from metaflow server
 
     Args:
@@ -50,24 +278,52 @@ def get_thing(meta_host, par, header=None, session=None):
         par:       Dictionary with query parameters
         header:    HTTP request header (for JWT authentication and encryption)
         session:   Requests session object
+        cache:     MetaCache instance, defaults to the module wide cache
+                   (see enable_meta_cache)
 
     Returns:
         A list of Thing dictionaries or a single dictionary if only one
         is returned from the meta service
     """
+    cache = cache if cache is not None else _meta_cache
+    if cache is None:
+        return _get_thing(meta_host, par, header=header, session=session)
+
+    key = cache.key(meta_host, par, header)
+    thing, stale = cache.get(key)
+    if thing is not None:
+        if stale:
+            cache.refresh(
+                key,
+                lambda: _get_thing(meta_host, dict(par), header=header, session=session),
+            )
+        return thing
+    thing = _get_thing(meta_host, dict(par), header=header, session=session)
+    cache.set(key, thing)
+    return thing
+
+
+def _get_thing(meta_host, par, header=None, session=None):
     rq = session or requests
 
+    header = dict(header or {})
     trace_id = str(uuid.uuid4())
     header["Trace-Id"] = trace_id
     header["User-Agent"] = f"pyniva/{__version__}"
 
+    # Aggregate metrics on the endpoint, not on the uuid in detail URLs
+    endpoint = urlsplit(meta_host).path
     if meta_host.startswith(PUB_DETAIL) and "uuid" in par:
         meta_host = meta_host + par["uuid"]
         del par["uuid"]
 
-    r = rq.get(meta_host, params=par, headers=header)
-    r.raise_for_status()
-    t = r.json()
+    with _request_timer(
+        trace_id, "metaflow", "GET", meta_host, endpoint=endpoint, params=par
+    ) as timer:
+        r = rq.get(meta_host, params=par, headers=header)
+        timer.response(r)
+        r.raise_for_status()
+        t = timer.decode(r)
 
     if "t" not in t:
         raise PyNIVAError(
@@ -81,7 +337,165 @@ def get_thing(meta_host, par, header=None, session=None):
     return t["t"]
 
 
-def path2all_ts(meta_host, path, search_depth=100, session=None):
+def _uuid_batches(meta_host, uuids, max_url_length=MAX_URL_LENGTH):
+    """Split uuids into batches where each comma joined batch keeps the
+    query URL below max_url_length"""
+    base_length = len(meta_host) + len("?uuid=")
+    batches = []
+    batch = []
+    length = base_length
+    for c_uuid in uuids:
+        c_length = len(quote(c_uuid, safe="")) + (len("%2C") if batch else 0)
+        if batch and length + c_length > max_url_length:
+            batches.append(batch)
+            batch = []
+            length = base_length
+            c_length = len(quote(c_uuid, safe=""))
+        batch.append(c_uuid)
+        length += c_length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def get_things_by_uuid(
+    meta_host,
+    uuids,
+    header=None,
+    session=None,
+    max_url_length=MAX_URL_LENGTH,
+    max_workers=4,
+):
+    """Get the meta data dictionaries for many uuids
+
+    The uuids are requested in comma joined batches, sized so that the
+    request URLs stay below max_url_length, and the batches are requested
+    concurrently.
+
+    Args:
+        meta_host:      URL to meta server (i.e. metaflow service)
+        uuids:          List of uuids
+        header:         HTTP request header (for JWT authentication and encryption)
+        session:        Requests session object
+        max_url_length: Maximum length of request URLs
+        max_workers:    Maximum number of concurrent requests
+
+    Returns:
+        Dictionary with the Thing dictionary for each uuid
+    """
+    uuids = list(dict.fromkeys(uuids))
+    if meta_host.startswith(PUB_DETAIL):
+        # The details endpoint only takes a single uuid
+        batches = [[u] for u in uuids]
+    else:
+        batches = _uuid_batches(meta_host, uuids, max_url_length)
+
+    def _get_batch(batch):
+        things = get_thing(
+            meta_host, {"uuid": ",".join(batch)}, header=header, session=session
+        )
+        return things if isinstance(things, list) else [things]
+
+    if len(batches) <= 1 or max_workers is None or max_workers <= 1:
+        results = [_get_batch(batch) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_get_batch, batches))
+    return {thing["uuid"]: thing for things in results for thing in things}
+
+
+class UuidPathMap:
+    """Mapping from time series uuid to path, reused between calls
+
+    Only uuids that are not already known are requested from metaflow
+    (with get_things_by_uuid). At most maxsize paths are kept, the least
+    recently used are dropped first. If directory is set the mapping is
+    also persisted on disk, so it survives between sessions.
+
+    Args:
+        directory: Optional directory for on-disk persistence
+        maxsize:   Maximum number of paths kept
+    """
+
+    FILE_NAME = "uuid_paths.json"
+
+    def __init__(self, directory=None, maxsize=100_000):
+        self.directory = os.path.expanduser(directory) if directory else None
+        self.maxsize = maxsize
+        # (host, uuid) -> path, least recently used first
+        self._paths = OrderedDict()
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            try:
+                with open(self._file_name(), "r") as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                stored = {}
+            for host, paths in stored.items():
+                self._paths.update(((host, u), p) for u, p in paths.items())
+            self._evict()
+
+    def _file_name(self):
+        return os.path.join(self.directory, self.FILE_NAME)
+
+    def _evict(self):
+        while len(self._paths) > self.maxsize:
+            self._paths.popitem(last=False)
+
+    def _save(self):
+        if self.directory:
+            stored = {}
+            for (host, u), p in self._paths.items():
+                stored.setdefault(host, {})[u] = p
+            _atomic_write_json(self._file_name(), stored)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def resolve(self, meta_host, uuids, header=None, session=None, max_workers=4):
+        """Get the path of each uuid, requesting only unknown uuids
+
+        Returns:
+            Dictionary with the path for each uuid found in metaflow,
+            uuids that are not found are left out
+        """
+        host = meta_host.rstrip("/")
+        uuids = list(dict.fromkeys(uuids))
+        paths = {}
+        with self._lock:
+            for u in uuids:
+                if (host, u) in self._paths:
+                    self._paths.move_to_end((host, u))
+                    paths[u] = self._paths[(host, u)]
+        missing = [u for u in uuids if u not in paths]
+        if missing:
+            things = get_things_by_uuid(
+                meta_host, missing, header=header, session=session, max_workers=max_workers
+            )
+            new_paths = {u: things[u]["path"] for u in missing if u in things}
+            paths.update(new_paths)
+            with self._lock:
+                self._paths.update(((host, u), p) for u, p in new_paths.items())
+                self._evict()
+                self._save()
+        return paths
+
+    def invalidate(self, meta_host=None):
+        """Forget all paths, or all paths for one metaflow host"""
+        with self._lock:
+            if meta_host is None:
+                self._paths.clear()
+            else:
+                host = meta_host.rstrip("/")
+                for key in [k for k in self._paths if k[0] == host]:
+                    del self._paths[key]
+            self._save()
+
+
+def path2all_ts(
+    meta_host, path, search_depth=100, session=None, header=None, path_filter=None
+):
     """Helper function to get all time series from a thing
 
     Args:
@@ -89,19 +503,32 @@ def path2all_ts(meta_host, path, search_depth=100, session=None):
         par:          Path to parent thing
         search_depth: How many levels of "parts" to search to get the list
         session:      Requests session object
+        header:       HTTP request header (for JWT authentication and encryption)
+        path_filter:  If given, only return time series for which
+                      path_filter(path) is True
 
     Returns:
         A list of time series meta dictionaries
     """
-    thing = get_thing(meta_host, {"path": path}, session=session)
+    thing = get_thing(meta_host, {"path": path}, header=header, session=session)
     assert isinstance(thing, dict) and "uuid" in thing
     thing = get_thing(
-        meta_host, {"uuid": thing["uuid"], "parts": search_depth}, session=session
+        meta_host,
+        {"uuid": thing["uuid"], "parts": search_depth},
+        header=header,
+        session=session,
     )
-    return [
-        get_thing(meta_host, {"uuid": ts["uuid"]}, session=session)
-        for ts in thing_tree2ts(thing)
-    ]
+    ts_uuids = [ts["uuid"] for ts in thing_tree2ts(thing, path_filter=path_filter)]
+    uuid2thing = get_things_by_uuid(
+        meta_host, ts_uuids, header=header, session=session
+    )
+    missing = [u for u in ts_uuids if u not in uuid2thing]
+    if len(missing) > 0:
+        raise PyNIVAError(
+            message=f"Could not find metadata for uuids {missing}",
+            req_args={"uuid": missing},
+        )
+    return [uuid2thing[u] for u in ts_uuids]
 
 
 def update_thing(meta_host, thing, header=None, session=None):
@@ -160,12 +587,81 @@ def delete_thing(meta_host, thing, header=None, session=None):
     return d_thing["t"]
 
 
-def thing_tree2ts(top):
+def _dict_get(node, key):
+    return node.get(key)
+
+
+def walk_tree(
+    top,
+    ttypes=None,
+    path_filter=None,
+    max_depth=None,
+    min_depth=0,
+    postorder=True,
+    get=_dict_get,
+):
+    """Iterate over the nodes of a tree of parts
+
+    The tree is traversed with an explicit stack, so deep trees do not
+    hit the recursion limit, and nodes are produced lazily (stop the
+    iteration to stop the traversal).
+
+    Args:
+        top:         Top thing node in the tree
+        ttypes:      If given, only yield nodes with one of these ttypes
+        path_filter: If given, only yield nodes for which path_filter(path) is True
+        max_depth:   Do not descend below this depth (top has depth 0)
+        min_depth:   Only yield nodes at this depth or deeper
+        postorder:   If True parts are yielded before their parent
+        get:         Function get(node, key) returning node attributes,
+                     defaults to dictionary lookup
+
+    Returns:
+        Iterator over the matching nodes
+
+    Useage:
+        gps_tracks = list(walk_tree(thing_root, ttypes={"gpstrack"}))
+    """
+
+    if get is _dict_get:
+        # Dictionary nodes, avoid a function call per lookup
+        get = dict.get
+    stack = [(top, 0, False)]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        node, depth, expanded = pop()
+        if expanded or not postorder:
+            if (
+                depth >= min_depth
+                and (ttypes is None or get(node, "ttype") in ttypes)
+                and (path_filter is None or path_filter(get(node, "path")))
+            ):
+                yield node
+            if expanded:
+                continue
+        if max_depth is None or depth < max_depth:
+            parts = get(node, "parts")
+        else:
+            parts = None
+        if postorder:
+            push((node, depth, True))
+        if parts:
+            # Reversed, so the parts are visited in their original order
+            depth += 1
+            for part in reversed(parts):
+                push((part, depth, False))
+
+
+def thing_tree2ts(top, path_filter=None, max_depth=None):
     """Walk a tree of parts and yield all time series objects
-    (ttype in [tseries, qctseries, gpstrack])
+    (ttype in TSERIES_TTYPES), parts before their parent
 
     Args:
-        top: Top thing node in the tree
+        top:         Top thing node in the tree
+        path_filter: If given, only yield time series for which
+                     path_filter(path) is True
+        max_depth:   Do not descend below this depth
 
     Returns:
         Next time series dictionary in the iterator
@@ -173,9 +669,6 @@ def thing_tree2ts(top):
     Useage:
         all_ts = [ts for ts in thing_tree2ts(thing_root)]
     """
-    if top.get("parts", False) and len(top["parts"]) > 0:
-        for t in top["parts"]:
-            for ct in thing_tree2ts(t):
-                yield ct
-    if top.get("ttype") in ["tseries", "qctseries", "gpstrack", "spectra"]:
-        yield top
+    return walk_tree(
+        top, ttypes=TSERIES_TTYPES, path_filter=path_filter, max_depth=max_depth
+    )
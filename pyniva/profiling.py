@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stage level profiling of the high level query functions
+
+A StageProfiler passed as the profile argument of get_ship_data or
+get_ramses_data records wall time, rows and memory of every stage
+(metaflow tree fetching, downloads per path, aligning, ...). The tsb and
+metaflow requests made during a stage are recorded as well (through the
+request hooks in pyniva.instrument), splitting the time of a download
+into network time, JSON decoding and DataFrame parsing.
+
+Example:
+    profiler = StageProfiler()
+    df = get_ship_data("FA", paths, start_time, end_time, noqc=True,
+                       header=header, profile=profiler)
+    print(profiler.format())
+    profiler.to_frame()
+"""
+__all__ = ["StageProfiler"]
+
+import logging
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+from .instrument import add_request_hook, remove_request_hook
+
+
+def _frame_size(result):
+    """Rows and memory (bytes) of a DataFrame (pandas, Arrow or Polars)
+    result, or None"""
+    if isinstance(result, pd.DataFrame):
+        return len(result), int(result.memory_usage(index=True, deep=True).sum())
+    if hasattr(result, "nbytes"):
+        return len(result), int(result.nbytes)
+    if hasattr(result, "estimated_size"):
+        return len(result), int(result.estimated_size())
+    return None, None
+
+
+class Stage:
+    """Measurements of a single stage
+
+    Attributes:
+        name:           Stage name, e.g. "metaflow", "download" or "align"
+        path:           Time series path (or time slice) for per path stages
+        seconds:        Wall time of the stage
+        rows:           Rows in the resulting DataFrame
+        bytes:          Memory of the resulting DataFrame
+        peak_mib:       Peak traced memory (only with trace_memory)
+        requests:       Number of requests made during the stage
+        network_s:      Time waiting for responses
+        decode_s:       Time decoding JSON responses
+        response_bytes: Size of the responses
+        trace_ids:      Trace ids of the requests
+    """
+
+    __slots__ = (
+        "name",
+        "path",
+        "seconds",
+        "rows",
+        "bytes",
+        "peak_mib",
+        "requests",
+        "network_s",
+        "decode_s",
+        "response_bytes",
+        "trace_ids",
+    )
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path
+        self.seconds = None
+        self.rows = None
+        self.bytes = None
+        self.peak_mib = None
+        self.requests = 0
+        self.network_s = 0.0
+        self.decode_s = 0.0
+        self.response_bytes = 0
+        self.trace_ids = []
+
+    def result(self, result):
+        """Record the rows and memory of the stage result"""
+        self.rows, self.bytes = _frame_size(result)
+        return result
+
+    def as_dict(self):
+        d = {k: getattr(self, k) for k in self.__slots__}
+        # Time not spent waiting for or decoding responses
+        d["compute_s"] = (
+            None
+            if self.seconds is None
+            else max(0.0, self.seconds - self.network_s - self.decode_s)
+        )
+        return d
+
+
+class _StageContext:
+    __slots__ = ("profiler", "stage", "_t0", "_previous", "_trace")
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        local = self.profiler._local
+        self._previous = getattr(local, "stage", None)
+        local.stage = self.stage
+        # Peak memory is only meaningful for the top level stages, the
+        # per path stages run concurrently
+        self._trace = (
+            self.profiler.trace_memory and self.stage.path is None and tracemalloc.is_tracing()
+        )
+        if self._trace:
+            tracemalloc.reset_peak()
+        self._t0 = time.perf_counter()
+        return self.stage
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stage.seconds = time.perf_counter() - self._t0
+        if self._trace:
+            self.stage.peak_mib = tracemalloc.get_traced_memory()[1] / 2**20
+        self.profiler._local.stage = self._previous
+        return False
+
+
+class _NullStage:
+    """Stand-in for the stages when profiling is off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def result(self, result):
+        return result
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageProfiler:
+    """Wall time, rows and memory per stage of a query
+
+    The profiler can be reused for several calls, the stages are appended.
+
+    Args:
+        trace_memory: Record the peak memory of each (top level) stage with
+                      tracemalloc. Tracing slows down the query considerably.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._started_tracing = False
+
+    def stage(self, name, path=None):
+        """Context manager measuring a stage, returns the Stage"""
+        stage = Stage(name, path)
+        with self._lock:
+            self.stages.append(stage)
+        return _StageContext(self, stage)
+
+    def _on_request(self, event):
+        # Requests are attributed to the current stage of their thread
+        stage = getattr(self._local, "stage", None)
+        if stage is None:
+            return
+        with self._lock:
+            stage.requests += 1
+            stage.network_s += event.latency or 0.0
+            stage.decode_s += event.decode_time
+            stage.response_bytes += event.response_bytes or 0
+            stage.trace_ids.append(event.trace_id)
+
+    def __enter__(self):
+        if self._active == 0:
+            add_request_hook(self._on_request)
+            if self.trace_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+        self._active += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._active -= 1
+        if self._active == 0:
+            remove_request_hook(self._on_request)
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+        return False
+
+    def report(self):
+        """The stages as a list of dictionaries"""
+        return [stage.as_dict() for stage in self.stages]
+
+    def to_frame(self):
+        """The stages as a DataFrame, one row per stage"""
+        return pd.DataFrame(self.report())
+
+    def format(self):
+        """The stages as a text table"""
+        lines = [
+            f"{'stage':<12}{'path':<48}{'seconds':>9}{'network':>9}{'decode':>9}"
+            f"{'rows':>10}{'MiB':>9}{'requests':>9}"
+        ]
+        for s in self.report():
+            mib = "" if s["bytes"] is None else f"{s['bytes'] / 2**20:.2f}"
+            lines.append(
+                f"{s['name']:<12}{str(s['path'] or ''):<48}{s['seconds'] or 0:>9.3f}"
+                f"{s['network_s']:>9.3f}{s['decode_s']:>9.3f}"
+                f"{'' if s['rows'] is None else s['rows']:>10}{mib:>9}{s['requests']:>9}"
+            )
+        return "\n".join(lines)
+
+
+class _LoggingProfiler(StageProfiler):
+    """Profiler logging its report when the profiled call finishes"""
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        if self._active == 0:
+            logging.info("pyniva stage profile:\n%s", self.format())
+        return False
+
+
+def _profiler(profile):
+    """StageProfiler for the profile argument of the query functions:
+    a StageProfiler is used as is, True logs the report, None or False
+    disables profiling"""
+    if isinstance(profile, StageProfiler):
+        return profile
+    if profile:
+        return _LoggingProfiler()
+    return None
+
+
+def _stage(profiler, name, path=None):
+    if profiler is None:
+        return _NULL_STAGE
+    return profiler.stage(name, path)
@@ -3,30 +3,54 @@
 """
 Script to read time series tsb backend
 """
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime, timedelta
 import numpy as np
 import time
-from .thing import Vessel
+from .thing import Vessel, ThingIndex
 from .metaflow import PUB_META
-from .tsb import PUB_TSB
+from .tsb import (
+    PUB_TSB,
+    ITER_WINDOW,
+    align_frames,
+    _time_windows,
+    _concat_windows,
+    _dtype_policy,
+    _output,
+    _iter_windows,
+    _prefetched,
+)
+from .get_data import pooled_session
+from .spectra import SpectralData
+from .profiling import _profiler, _stage
 import pandas as pd
+from dateutil.parser import parse
 
 
-def get_paths_measurements(vessel_name, header, meta_host=PUB_META):
+def get_paths_measurements(vessel_name, header, meta_host=PUB_META, session=None):
     # Here we can directly get one object for the vessel we need without getting all of them as
 
     vessel_object = Vessel.get_thing(
-        meta_host=meta_host, header=header, params={"path": vessel_name}
+        meta_host=meta_host, header=header, params={"path": vessel_name}, session=session
     )
 
-    vessel_signals = vessel_object.get_all_tseries(meta_host, header)
-    tseries_paths = [m.path for m in vessel_signals]
-    return vessel_signals, tseries_paths
+    vessel_signals = vessel_object.get_all_tseries(meta_host, header, session=session)
+    return vessel_signals, vessel_signals.paths
 
 
-def get_available_parameters(platform_code, header, meta_host=PUB_META, exclude_tests=True):
+def _as_index(vessel_signals):
+    """ThingIndex of the time series (which may be given as a list)"""
+    if isinstance(vessel_signals, ThingIndex):
+        return vessel_signals
+    return ThingIndex(vessel_signals)
+
+
+def get_available_parameters(
+    platform_code, header, meta_host=PUB_META, exclude_tests=True, session=None
+):
     measurements, tseries_paths = get_paths_measurements(
-        platform_code, header, meta_host
+        platform_code, header, meta_host, session=session
     )
     if exclude_tests:
         available_paths = [p for p in tseries_paths if "TEST" not in p]
@@ -36,6 +60,60 @@ def get_available_parameters(platform_code, header, meta_host=PUB_META, exclude_
     return available_paths
 
 
+def _download_paths(
+    paths,
+    signals,
+    pub_tsb,
+    header,
+    max_workers=None,
+    session=None,
+    profiler=None,
+    **query,
+):
+    """Download time series data for each path.
+
+    Paths are fetched one after another, or concurrently on a bounded
+    thread pool if max_workers is larger than one. The time series are
+    looked up in signals, a ThingIndex.
+
+    Returns:
+        Tuple of two dictionaries keyed on path in input order, the
+        downloaded DataFrames and the exceptions for failed paths
+    """
+
+    def _fetch(path):
+        with _stage(profiler, "download", path) as stage:
+            return stage.result(
+                signals.by_path(path).get_tseries(
+                    pub_tsb, header=header, session=session, **query
+                )
+            )
+
+    paths = list(dict.fromkeys(paths))
+    frames = {}
+    errors = {}
+    if max_workers is None or max_workers <= 1:
+        for path in paths:
+            try:
+                frames[path] = _fetch(path)
+            except Exception as e:
+                errors[path] = e
+        return frames, errors
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {path: executor.submit(_fetch, path) for path in paths}
+        for path, future in futures.items():
+            try:
+                frames[path] = future.result()
+            except Exception as e:
+                errors[path] = e
+    # Keep the input order regardless of completion order
+    return (
+        {p: frames[p] for p in paths if p in frames},
+        {p: errors[p] for p in paths if p in errors},
+    )
+
+
 def get_ship_data(
     vessel_name: str,
     param_paths: list,
@@ -46,69 +124,267 @@ def get_ship_data(
     dt=0,
     pub_tsb=PUB_TSB,
     meta_host=PUB_META,
+    max_workers=None,
+    session=None,
+    return_errors=False,
+    profile=None,
+    dtypes=None,
+    output="pandas",
 ):
+    """Download time series data for a vessel into one DataFrame
+
+    Params:
+        vessel_name (str):    Vessel path, e.g. "FA"
+        param_paths (list):   Paths of the time series to download
+        start_time, end_time: Time range of the query
+        noqc (bool):          Ignore the data quality flag
+        header (dict):        JWT header for the NIVA public endpoints
+        dt:                   Aggregation time window, 0 gives raw data
+        pub_tsb (str):        URL of the tsb endpoint
+        meta_host (str):      URL of the metaflow endpoint
+        max_workers (int):    If larger than one the paths are downloaded
+                              concurrently with this many workers
+        session (Session):    Requests session object (or pyniva.Client), a
+                              pooled session is created for concurrent
+                              downloads if not given
+        return_errors (bool): If True return a tuple of the DataFrame and a
+                              dictionary with the exception for each failed
+                              path, instead of printing the failures
+        profile:              A pyniva.profiling.StageProfiler recording
+                              time, rows and memory of the metaflow, download
+                              (per path), align and finalize stages, or True
+                              to log the stage profile
+        dtypes:               Column types, None for the default types,
+                              "compact" (float32 measurements, nullable
+                              integer flags, categorical strings) or a
+                              pyniva.tsb.DtypePolicy
+        output (str):         "pandas" (default), "arrow" for a pyarrow.Table
+                              or "polars" for a polars.DataFrame, built without
+                              intermediate pandas DataFrames
+
+    Returns:
+        A DataFrame with a time column and one column per path
+    """
     print("Downloading data for ", vessel_name)
 
-    vessel_signals, vessel_paths = get_paths_measurements(
-        vessel_name, meta_host=meta_host, header=header
-    )
+    policy = _dtype_policy(dtypes)
+    c_output = _output(output, policy)
+    profiler = _profiler(profile)
+    with profiler or nullcontext():
+        with _stage(profiler, "metaflow"):
+            vessel_signals, vessel_paths = get_paths_measurements(
+                vessel_name, meta_host=meta_host, header=header, session=session
+            )
 
-    df = pd.DataFrame()
-    # make sure that all datasets have coordinates
-    if f"{vessel_name}/gpstrack" not in param_paths:
-        param_paths.append(f"{vessel_name}/gpstrack")
-    empty_paths = []
-    for path in param_paths:
+        # make sure that all datasets have coordinates
+        if f"{vessel_name}/gpstrack" not in param_paths:
+            param_paths.append(f"{vessel_name}/gpstrack")
+
+        own_session = session is None and max_workers is not None and max_workers > 1
+        if own_session:
+            session = pooled_session(max_workers)
         try:
-            tseries_idx = vessel_paths.index(path)
-
-            var = vessel_signals[tseries_idx].get_tseries(
-                pub_tsb,
-                header=header,
-                noqc=noqc,
-                dt=dt,
-                start_time=start_time,
-                end_time=end_time,
-            )
+            with _stage(profiler, "download"):
+                frames, errors = _download_paths(
+                    param_paths,
+                    _as_index(vessel_signals),
+                    pub_tsb,
+                    header,
+                    max_workers=max_workers,
+                    session=session,
+                    profiler=profiler,
+                    noqc=noqc,
+                    dt=dt,
+                    start_time=start_time,
+                    end_time=end_time,
+                    dtypes=policy,
+                    output=c_output.name,
+                )
+        finally:
+            if own_session:
+                session.close()
+
+        return _assemble_ship_data(
+            vessel_name,
+            param_paths,
+            frames,
+            errors,
+            noqc,
+            return_errors,
+            profiler,
+            policy,
+            c_output,
+        )
+
+
+def _assemble_ship_data(
+    vessel_name,
+    param_paths,
+    frames,
+    errors,
+    noqc,
+    return_errors,
+    profiler=None,
+    policy=None,
+    output=None,
+):
+    """Combine the downloaded per-path frames into the get_ship_data result"""
+    empty_paths = []
+    for path, var in frames.items():
+        if len(var) == 0:
+            print(f"No data for path {path}")
+            empty_paths.append(path)
+    with _stage(profiler, "align") as stage:
+        if output is not None and output.name != "pandas":
+            df = output.align(frames.values())
+        else:
+            df = align_frames(frames.values())
+        stage.result(df)
+    if not return_errors:
+        for path, e in errors.items():
+            print(f"could not download {path, e}")
 
-            if var.empty:
-                print(f"No data for path {path}")
-                empty_paths.append(path)
+    if output is not None and output.name != "pandas":
+        if len(df) == 0:
+            print("Nothing was downloaded")
+        with _stage(profiler, "finalize") as stage:
+            df = stage.result(output.finish_ship_data(df, noqc, empty_paths))
+        return (df, errors) if return_errors else df
 
-            elif df.empty:
-                df = var
-            else:
-                df = df.merge(var, on="time", how="outer")
+    with _stage(profiler, "finalize") as stage:
+        if df.empty:
+            print("Nothing was downloaded")
+        else:
 
-        except Exception as e:
-            print(f"could not download {path, e}")
+            if not noqc:
+
+                df = df.dropna(subset=["latitude", "longitude"], how="all")
+                print(f" downloaded data for {param_paths}")
+                # also do not get coordinates if all data columns are empty
+                data_cols = [
+                    p
+                    for p in param_paths
+                    if p not in ["time", "latitude", "longitude", f"{vessel_name}/gpstrack"]
+                    and "TEST" not in p
+                    and p in df.columns
+                ]
+
+                # print(f"drop nans")
+                # df = df.dropna(subset=data_cols, how="all")
+                # keep columns with nans
+            df = df.reset_index()
+            # add columns from empty paths and fill with nans
+            float_dtype = np.float64 if policy is None else policy.float_dtype
+            for path in empty_paths:
+                df[path] = np.full(len(df), np.nan, dtype=float_dtype)
+        stage.result(df)
+    if return_errors:
+        return df, errors
+    return df
 
-    if df.empty:
-        print("Nothing was downloaded")
-    else:
 
-        if not noqc:
+def iter_ship_data(
+    vessel_name: str,
+    param_paths: list,
+    start_time,
+    end_time,
+    noqc,
+    header,
+    dt=0,
+    window=ITER_WINDOW,
+    prefetch=1,
+    pub_tsb=PUB_TSB,
+    meta_host=PUB_META,
+    max_workers=None,
+    session=None,
+    dtypes=None,
+    output="pandas",
+):
+    """Iterate over the data for a vessel in chunks of a time window
+
+    Streaming version of get_ship_data: the metadata is fetched once,
+    then the time range is downloaded one window at a time while the
+    next window(s) are downloaded in the background, so memory use is
+    bounded by the window length regardless of the length of the time
+    range. Rows at a window boundary are only included in one chunk.
+
+    All chunks have the same columns: time, longitude, latitude and one
+    column per path in param_paths order (NaN for paths without data in
+    a window).
+
+    Params:
+        vessel_name, param_paths, start_time, end_time, noqc, header, dt,
+        pub_tsb, meta_host, max_workers, session, dtypes, output:
+                              See get_ship_data, max_workers is the number
+                              of paths downloaded concurrently per window
+        window:               Window length (seconds, timedelta or ISO8601
+                              duration), rounded down to a multiple of dt
+        prefetch (int):       Number of windows downloaded ahead
+
+    Yields:
+        One DataFrame per window with data, in time order
+
+    Raises:
+        The exception of the first failed path in a window
+    """
+    policy = _dtype_policy(dtypes)
+    c_output = _output(output, policy)
+    signals, _ = get_paths_measurements(
+        vessel_name, meta_host=meta_host, header=header, session=session
+    )
+    signals = _as_index(signals)
+
+    gpstrack = f"{vessel_name}/gpstrack"
+    paths = list(dict.fromkeys(list(param_paths) + [gpstrack]))
+    columns = ["longitude", "latitude"] + [p for p in paths if p != gpstrack]
+
+    start_time = parse(start_time) if isinstance(start_time, str) else start_time
+    end_time = parse(end_time) if isinstance(end_time, str) else end_time
+    windows = _iter_windows(start_time, end_time, {"dt": dt}, window)
+
+    # Windows are prefetched and paths may be downloaded concurrently
+    own_session = session is None and (prefetch or (max_workers is not None and max_workers > 1))
+    c_session = (
+        pooled_session((prefetch + 1) * max(1, max_workers or 1)) if own_session else session
+    )
 
+    def _fetch(time_window):
+        frames, errors = _download_paths(
+            paths,
+            signals,
+            pub_tsb,
+            header,
+            max_workers=max_workers,
+            session=c_session,
+            noqc=noqc,
+            dt=dt,
+            start_time=time_window[0],
+            end_time=time_window[1],
+            dtypes=policy,
+            output=c_output.name,
+        )
+        if errors:
+            raise next(iter(errors.values()))
+        df = c_output.align(frames.values())
+        if c_output.name != "pandas":
+            return c_output.finish_ship_data(df, noqc, [])
+        if not noqc and "latitude" in df.columns and "longitude" in df.columns:
             df = df.dropna(subset=["latitude", "longitude"], how="all")
-            print(f" downloaded data for {param_paths}")
-            # also do not get coordinates if all data columns are empty
-            data_cols = [
-                p
-                for p in param_paths
-                if p not in ["time", "latitude", "longitude", f"{vessel_name}/gpstrack"]
-                and "TEST" not in p
-                and p in df.columns
-            ]
-
-            # print(f"drop nans")
-            # df = df.dropna(subset=data_cols, how="all")
-            # keep columns with nans
-        df = df.sort_values(by="time", ascending=True)
-        df = df.reset_index()
-        # add columns from empty paths and fill with nans
-        for path in empty_paths:
-            df[path] = None
-    return df
+        return df
+
+    chunks = _prefetched(_fetch, windows, prefetch)
+    try:
+        for (_, w_end), df in zip(windows, chunks):
+            if len(df) == 0:
+                continue
+            df = c_output.conform(df, columns, None if w_end == end_time else w_end)
+            if len(df) == 0:
+                continue
+            yield df.reset_index() if c_output.name == "pandas" else df
+    finally:
+        chunks.close()
+        if own_session:
+            c_session.close()
 
 
 def get_data_discrete_dates(
@@ -137,28 +413,28 @@ def get_ramses_time_slice(
             noqc,
             header,
             dt=0,
-            pub_tsb=PUB_TSB):
+            pub_tsb=PUB_TSB,
+            session=None):
     
     # get spectral data
     # first get spectral data
     print(f"Downloading spectral data {spectral_paths[0]} times {start_time} to {end_time}")
-    df = pd.DataFrame()
-    tseries_idx = vessel_paths.index(spectral_paths[0])
-    df = vessel_signals[tseries_idx].get_tseries(
+    signals = _as_index(vessel_signals)
+    df = signals.by_path(spectral_paths[0]).get_tseries(
                     pub_tsb,
                     header=header,
                     noqc=noqc,
                     dt=dt,
                     start_time=start_time,
-                    end_time=end_time)
+                    end_time=end_time,
+                    session=session)
     if df.empty:
         print(f"No ramses data found for path {spectral_paths[0]}")
         return df
-    df = df.sort_values(by="time", ascending=True)
-    df = df.reset_index()
-    df = df.pivot(index = "time", columns="wl", values="value") 
+    df = SpectralData.from_long(df).to_frame()
 
     # add other ramses data
+    frames = [df]
     for path in param_paths:
         if path in spectral_paths:
                 continue
@@ -166,17 +442,17 @@ def get_ramses_time_slice(
             print(f"ship data needs to be downloaded separately. Skipping {path}")
             continue            
         print(f"Add {path} to spectral profile")    
-        tseries_idx = vessel_paths.index(path)
-        var = vessel_signals[tseries_idx].get_tseries(
+        var = signals.by_path(path).get_tseries(
                     pub_tsb,
                     header=header,
                     noqc=noqc,
                     dt=dt,
                     start_time=start_time,
                     end_time=end_time,
+                    session=session,
             )
-        df = df.merge(var, on="time", how="outer")        
-    return df
+        frames.append(var)
+    return align_frames(frames)
 
 
 def get_ramses_data(
@@ -189,48 +465,115 @@ def get_ramses_data(
     dt=0,
     pub_tsb=PUB_TSB,
     meta_host=PUB_META,
+    period=timedelta(hours=12),
+    max_workers=4,
+    session=None,
+    profile=None,
 ):
+    """Download a RAMSES spectral profile and other RAMSES paths for a vessel
+
+    The time range is downloaded in slices of the given period, fetched
+    concurrently, and the slices are concatenated once at the end.
+
+    Params:
+        vessel_name (str):    Vessel path, e.g. "FA"
+        param_paths (list):   Paths to download, exactly one must be a spectra
+        start_time, end_time: Time range of the query
+        noqc (bool):          Ignore the data quality flag
+        header (dict):        JWT header for the NIVA public endpoints
+        dt:                   Aggregation time window, 0 gives raw data
+        pub_tsb (str):        URL of the tsb endpoint
+        meta_host (str):      URL of the metaflow endpoint
+        period (timedelta):   Length of the time slices
+        max_workers (int):    Number of slices downloaded concurrently
+        session (Session):    Requests session object (or pyniva.Client)
+        profile:              A pyniva.profiling.StageProfiler recording
+                              the metaflow, download (per time slice) and
+                              concat stages, or True to log the stage profile
+
+    Returns:
+        A time indexed DataFrame with one column per wavelength and one
+        column per additional path
+    """
     print("Downloading data for ", vessel_name)
 
-    vessel_signals, vessel_paths = get_paths_measurements(
-        vessel_name, meta_host=meta_host, header=header
-    )
-    spectral_paths = [path for path in param_paths if vessel_signals[vessel_paths.index(path)].TTYPE=="spectra"]
-    assert len(spectral_paths)==1, "Only one spectral profile can be downloaded at a time"
-
-    start_datetime=datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%S")
-    end_datetime=datetime.strptime(end_time, "%Y-%m-%dT%H:%M:%S")
-
-    #slide in 12 h slices
-    period = timedelta(hours=12)
-    periods = 1
-    if (end_datetime-start_datetime)>period:
-        periods = int((end_datetime-start_datetime)/period)
-
-
-    start_times = [t.strftime('%Y-%m-%dT%H:%M:%S') for t in [start_datetime+i*period for i in range(0,periods)]]
-    end_times = [t.strftime('%Y-%m-%dT%H:%M:%S') for t in [start_datetime+i*period for i in range(1,periods)]]
-    end_times.append(end_time)
-
-   
-    df = pd.DataFrame()
-    for start_time, end_time in zip(start_times, end_times):
-        print(f"Downloading data for {start_time} to {end_time}")
-        df_slice =get_ramses_time_slice(              
-            vessel_name, 
+    profiler = _profiler(profile)
+    with profiler or nullcontext():
+        return _get_ramses_data(
+            vessel_name,
             param_paths,
-            spectral_paths, 
-            vessel_paths,
-            vessel_signals,
             start_time,
             end_time,
             noqc,
             header,
-            dt=0,
-            pub_tsb=PUB_TSB)
-        if df.empty:
-            df = df_slice
+            dt,
+            pub_tsb,
+            meta_host,
+            period,
+            max_workers,
+            session,
+            profiler,
+        )
+
+
+def _get_ramses_data(
+    vessel_name,
+    param_paths,
+    start_time,
+    end_time,
+    noqc,
+    header,
+    dt,
+    pub_tsb,
+    meta_host,
+    period,
+    max_workers,
+    session,
+    profiler,
+):
+    with _stage(profiler, "metaflow"):
+        vessel_signals, vessel_paths = get_paths_measurements(
+            vessel_name, meta_host=meta_host, header=header, session=session
+        )
+    vessel_signals = _as_index(vessel_signals)
+    spectral_paths = [path for path in param_paths if vessel_signals.by_path(path).TTYPE=="spectra"]
+    assert len(spectral_paths)==1, "Only one spectral profile can be downloaded at a time"
+
+    start_datetime = parse(start_time) if isinstance(start_time, str) else start_time
+    end_datetime = parse(end_time) if isinstance(end_time, str) else end_time
+    slices = _time_windows(start_datetime, end_datetime, period)
+
+    def _get_slice(time_slice):
+        print(f"Downloading data for {time_slice[0]} to {time_slice[1]}")
+        with _stage(profiler, "download", f"{time_slice[0]} - {time_slice[1]}") as stage:
+            return stage.result(
+                get_ramses_time_slice(
+                    vessel_name,
+                    param_paths,
+                    spectral_paths,
+                    vessel_paths,
+                    vessel_signals,
+                    time_slice[0],
+                    time_slice[1],
+                    noqc,
+                    header,
+                    dt=dt,
+                    pub_tsb=pub_tsb,
+                    session=c_session,
+                )
+            )
+
+    own_session = session is None and max_workers is not None and max_workers > 1
+    c_session = pooled_session(max_workers) if own_session else session
+    try:
+        if max_workers is None or max_workers <= 1:
+            df_slices = [_get_slice(time_slice) for time_slice in slices]
         else:
-            df = pd.concat([df, df_slice])
-    
-    return df
\ No newline at end of file
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                df_slices = list(executor.map(_get_slice, slices))
+    finally:
+        if own_session:
+            c_session.close()
+
+    with _stage(profiler, "concat") as stage:
+        return stage.result(_concat_windows(df_slices, slices))
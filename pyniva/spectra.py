@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dense time x wavelength container for spectral (Spectra) time series
+"""
+__all__ = ["SpectralData"]
+
+import numpy as np
+import pandas as pd
+
+
+class SpectralData:
+    """Spectral time series as a contiguous 2-D array
+
+    Holds a (time x wavelength) NumPy array together with a shared,
+    ascending wavelength axis and a time index, instead of repeating the
+    wavelength for every value as in the long (time, wl, value) format
+    returned by tsb.
+
+    Slicing by time and wavelength band with sel() returns views of the
+    same array (no copy).
+
+    Args:
+        values:      2-D array (time x wavelength)
+        wavelengths: 1-D array with the (ascending) wavelengths, integer
+                     or float
+        time:        Time index (DatetimeIndex) for the rows
+    """
+
+    def __init__(self, values, wavelengths, time):
+        values = np.asarray(values)
+        # Integer wavelengths keep their type, as labels of to_frame()
+        wavelengths = np.asarray(wavelengths)
+        if wavelengths.dtype.kind not in "iuf":
+            wavelengths = wavelengths.astype(np.float64)
+        if values.ndim != 2 or values.shape != (len(time), len(wavelengths)):
+            raise ValueError(
+                f"values must have shape (time, wavelength) = "
+                f"{(len(time), len(wavelengths))}, got {values.shape}"
+            )
+        self.values = values
+        self.wavelengths = wavelengths
+        self.time = pd.DatetimeIndex(time, name="time")
+
+    @classmethod
+    def from_long(cls, df, dtype=np.float64):
+        """Create from long format data, a time indexed frame with wl and
+        value columns as returned by tsb for spectra time series.
+        For duplicate (time, wl) pairs the last value is kept.
+
+        Args:
+            df:    DataFrame in long format
+            dtype: dtype of the array, e.g. np.float32 to halve memory use
+
+        Returns:
+            A SpectralData instance
+        """
+        if df.empty:
+            return cls(np.empty((0, 0), dtype=dtype), [], pd.DatetimeIndex([]))
+        time_index = df.index
+        if time_index.tz is not None:
+            time_index = time_index.tz_convert(None)
+        times, t_codes = np.unique(time_index.to_numpy(), return_inverse=True)
+        wls, wl_codes = np.unique(df["wl"].to_numpy(), return_inverse=True)
+        values = np.full((len(times), len(wls)), np.nan, dtype=dtype)
+        values[t_codes, wl_codes] = df["value"].to_numpy(dtype=dtype)
+        index = pd.DatetimeIndex(times, name="time")
+        if df.index.tz is not None:
+            index = index.tz_localize("UTC").tz_convert(df.index.tz)
+        return cls(values, wls, index)
+
+    @classmethod
+    def from_frame(cls, df, dtype=None):
+        """Create from a wide time indexed frame with wavelengths as column labels"""
+        wavelengths = np.asarray(df.columns)
+        if wavelengths.dtype.kind not in "iuf":
+            wavelengths = wavelengths.astype(np.float64)
+        order = np.argsort(wavelengths, kind="stable")
+        values = df.to_numpy(dtype=dtype)[:, order]
+        return cls(np.ascontiguousarray(values), wavelengths[order], df.index)
+
+    def to_frame(self):
+        """Wide time indexed DataFrame with wavelengths as column labels"""
+        return pd.DataFrame(
+            self.values,
+            index=self.time,
+            columns=pd.Index(self.wavelengths, name="wl"),
+            copy=False,
+        )
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def __len__(self):
+        return len(self.time)
+
+    def __repr__(self):
+        if len(self.wavelengths) > 0:
+            wl_range = f"{self.wavelengths[0]:g}-{self.wavelengths[-1]:g}"
+        else:
+            wl_range = "-"
+        return (
+            f"SpectralData(times={len(self.time)}, wavelengths={len(self.wavelengths)} "
+            f"[{wl_range}], dtype={self.values.dtype})"
+        )
+
+    def sel(self, start_time=None, end_time=None, wl_min=None, wl_max=None):
+        """Select a time range and wavelength band (both inclusive)
+
+        The time index must be sorted (as returned from tsb). The returned
+        instance shares memory with this instance.
+
+        Returns:
+            A SpectralData instance viewing the selected data
+        """
+        t0, t1 = 0, len(self.time)
+        if start_time is not None:
+            t0 = self.time.searchsorted(self._as_index_time(start_time), side="left")
+        if end_time is not None:
+            t1 = self.time.searchsorted(self._as_index_time(end_time), side="right")
+        w0, w1 = 0, len(self.wavelengths)
+        if wl_min is not None:
+            w0 = np.searchsorted(self.wavelengths, wl_min, side="left")
+        if wl_max is not None:
+            w1 = np.searchsorted(self.wavelengths, wl_max, side="right")
+        return SpectralData(
+            self.values[t0:t1, w0:w1], self.wavelengths[w0:w1], self.time[t0:t1]
+        )
+
+    def _as_index_time(self, t):
+        t = pd.Timestamp(t)
+        if self.time.tz is not None and t.tz is None:
+            return t.tz_localize("UTC")
+        if self.time.tz is None and t.tz is not None:
+            return t.tz_convert("UTC").tz_localize(None)
+        return t
+
+    def interpolate(self, wavelengths):
+        """Linear interpolation of all spectra onto a new wavelength grid.
+        Wavelengths outside the current range are NaN.
+
+        Args:
+            wavelengths: The new (ascending) wavelength grid
+
+        Returns:
+            A new SpectralData instance
+        """
+        grid = np.asarray(wavelengths, dtype=np.float64)
+        src = self.wavelengths
+        if len(src) == 0:
+            values = np.full((len(self.time), len(grid)), np.nan, dtype=self.values.dtype)
+            return SpectralData(values, grid, self.time)
+        if len(src) == 1:
+            i0 = i1 = np.zeros(len(grid), dtype=np.intp)
+            weight = np.zeros(len(grid))
+        else:
+            i1 = np.clip(np.searchsorted(src, grid, side="left"), 1, len(src) - 1)
+            i0 = i1 - 1
+            weight = (grid - src[i0]) / (src[i1] - src[i0])
+        values = self.values[:, i0] * (1 - weight) + self.values[:, i1] * weight
+        outside = (grid < src[0]) | (grid > src[-1])
+        values[:, outside] = np.nan
+        # Exact matches should not depend on the neighbour (may be NaN)
+        exact = np.isin(grid, src)
+        if exact.any():
+            values[:, exact] = self.values[:, np.searchsorted(src, grid[exact])]
+        return SpectralData(values.astype(self.values.dtype, copy=False), grid, self.time)
+
+    def bin(self, edges):
+        """Average all spectra in wavelength bins, ignoring NaN values
+
+        Args:
+            edges: Ascending bin edges, bin i covers [edges[i], edges[i + 1])
+
+        Returns:
+            A new SpectralData instance with the bin centres as wavelengths
+        """
+        edges = np.asarray(edges, dtype=np.float64)
+        bin_idx = np.searchsorted(edges, self.wavelengths, side="right") - 1
+        inside = (bin_idx >= 0) & (bin_idx < len(edges) - 1)
+        n_bins = len(edges) - 1
+
+        values = self.values[:, inside]
+        bin_idx = bin_idx[inside]
+        valid = ~np.isnan(values)
+        # Sum per bin as a matrix product with a (wavelength x bin) indicator
+        indicator = np.zeros((len(bin_idx), n_bins))
+        indicator[np.arange(len(bin_idx)), bin_idx] = 1.0
+        sums = np.where(valid, values, 0.0) @ indicator
+        counts = valid.astype(np.float64) @ indicator
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / counts
+        centres = (edges[:-1] + edges[1:]) / 2
+        return SpectralData(means.astype(self.values.dtype, copy=False), centres, self.time)
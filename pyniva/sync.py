@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental sync of tsb data into a local store, based on the tsb
+insert time (time-series-by-insert-time endpoint)
+"""
+__all__ = ["InsertTimeSync"]
+
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from .util import _atomic_write_frame, _atomic_write_json
+from .get_data import get_newly_inserted_data
+from .metaflow import UuidPathMap
+
+
+class InsertTimeSync:
+    """Keep a local columnar copy of tsb data current
+
+    Each sync asks tsb for the rows inserted since the last sync (the
+    insert time watermark, persisted per tsb host) and upserts them, on
+    (uuid, time), into the store. Late-arriving and re-inserted rows
+    therefore replace the stored rows. The new rows of a sync are
+    appended as a pickled segment file in one directory per uuid, so a
+    sync only writes the new rows; the segments of a uuid are compacted
+    into one when there are more than max_segments of them.
+
+    The rows re-read in the overlap before the watermark are only stored
+    if they were not stored before (rows committed late), the keys of
+    the stored rows in the overlap are kept in a small file.
+
+    The watermark is only advanced after the rows of a sync window are
+    written, and the writes are atomic, so a sync that crashes is simply
+    repeated on the next run. Only one process should sync into a store.
+
+    Args:
+        directory:  Directory of the local store
+        meta_host:  URL of the metaflow service (to resolve paths)
+        ts_host:    URL of the tsb service
+        header:     JWT header (see token2header)
+        session:    Requests session object (or pyniva.Client)
+        start_time: Insert time to start from for a new store
+        overlap:    Each sync re-reads this much before the watermark, to
+                    include rows committed out of insert time order
+        max_window: Maximum insert time range queried per request
+        max_segments: Number of segment files per uuid before compacting
+
+    Example:
+        sync = InsertTimeSync("/data/ferrybox", PUB_META, PUB_TSB, header=header)
+        sync.run(interval=60)
+    """
+
+    STATE_FILE = "state.json"
+    OVERLAP_FILE = "overlap.pkl"
+    # Columns identifying a stored row
+    ROW_KEYS = ["uuid", "time", "created_timestamp"]
+
+    def __init__(
+        self,
+        directory,
+        meta_host,
+        ts_host,
+        header=None,
+        session=None,
+        start_time=None,
+        overlap=timedelta(minutes=5),
+        max_window=timedelta(days=1),
+        max_segments=32,
+    ):
+        self.directory = os.path.expanduser(directory)
+        self.meta_host = meta_host
+        self.ts_host = ts_host
+        self.header = header
+        self.session = session
+        self.overlap = overlap
+        self.max_window = max_window
+        self.max_segments = max_segments
+        # Paths are only requested for uuids not seen in earlier syncs
+        self._path_map = UuidPathMap()
+        self.data_dir = os.path.join(
+            self.directory, hashlib.sha1(ts_host.encode("utf-8")).hexdigest()[:16]
+        )
+        os.makedirs(self.data_dir, exist_ok=True)
+
+        self._state = self._load_state()
+        host_state = self._state.setdefault(self.ts_host, {})
+        if "watermark" not in host_state:
+            if start_time is None:
+                start_time = datetime.now(timezone.utc) - timedelta(days=1)
+            host_state["watermark"] = self._utc(start_time).isoformat()
+            host_state.setdefault("paths", {})
+            self._save_state()
+        self._overlap = self._load_overlap()
+
+    @staticmethod
+    def _utc(t):
+        t = pd.Timestamp(t)
+        return t.tz_localize("UTC") if t.tz is None else t.tz_convert("UTC")
+
+    def _load_state(self):
+        state_file = os.path.join(self.directory, self.STATE_FILE)
+        if not os.path.exists(state_file):
+            return {}
+        with open(state_file, "r") as f:
+            return json.load(f)
+
+    def _save_state(self):
+        _atomic_write_json(os.path.join(self.directory, self.STATE_FILE), self._state)
+
+    def _load_overlap(self):
+        overlap_file = os.path.join(self.data_dir, self.OVERLAP_FILE)
+        if not os.path.exists(overlap_file):
+            return pd.DataFrame(columns=self.ROW_KEYS)
+        return pd.read_pickle(overlap_file)
+
+    def _row_keys(self, df):
+        return pd.MultiIndex.from_arrays(
+            [df["uuid"].astype(str), df["time"], df["created_timestamp"]]
+        )
+
+    def _new_rows(self, df):
+        """Rows of df not stored by an earlier sync"""
+        if len(self._overlap) == 0:
+            return df
+        return df[~self._row_keys(df).isin(self._row_keys(self._overlap))]
+
+    def _update_overlap(self, df, w_end):
+        """Keep the keys of the stored rows the next sync re-reads"""
+        start = w_end - pd.Timedelta(self.overlap)
+        frames = [f for f in (self._overlap, df[self.ROW_KEYS]) if len(f) > 0]
+        overlap = pd.concat(frames) if frames else pd.DataFrame(columns=self.ROW_KEYS)
+        overlap = overlap[pd.to_datetime(overlap["created_timestamp"], utc=True) > start]
+        overlap = overlap.astype({"uuid": str}).drop_duplicates()
+        _atomic_write_frame(os.path.join(self.data_dir, self.OVERLAP_FILE), overlap)
+        self._overlap = overlap
+
+    @property
+    def watermark(self):
+        """Insert time up to which all rows are stored locally"""
+        return pd.Timestamp(self._state[self.ts_host]["watermark"]).to_pydatetime()
+
+    @property
+    def paths(self):
+        """Dictionary with the path of each stored uuid"""
+        return dict(self._state[self.ts_host].get("paths", {}))
+
+    def _segment_dir(self, c_uuid):
+        return os.path.join(self.data_dir, c_uuid)
+
+    def _segments(self, c_uuid):
+        """Segment files of a uuid, oldest first"""
+        segment_dir = self._segment_dir(c_uuid)
+        if not os.path.isdir(segment_dir):
+            return []
+        return sorted(
+            os.path.join(segment_dir, f) for f in os.listdir(segment_dir) if f.endswith(".pkl")
+        )
+
+    def _read_segments(self, segments):
+        frames = [pd.read_pickle(f) for f in segments]
+        if len(frames) == 0:
+            return pd.DataFrame()
+        df = pd.concat(frames) if len(frames) > 1 else frames[0]
+        # Rows of later inserts replace earlier rows with the same time
+        df = df.sort_values("created_timestamp", kind="stable")
+        df = df[~df.index.duplicated(keep="last")].sort_index(kind="stable")
+        df.index.name = "time"
+        return df
+
+    def read(self, uuid=None, path=None):
+        """Read the stored data for a uuid or path
+
+        Returns:
+            Time indexed DataFrame, empty if nothing is stored
+        """
+        if uuid is None:
+            uuid = {p: u for u, p in self.paths.items()}.get(path)
+        if uuid is None:
+            return pd.DataFrame()
+        return self._read_segments(self._segments(uuid))
+
+    def _write_segment(self, c_uuid, segments, df):
+        """Write df as the segment after the given (existing) segments"""
+        last = os.path.basename(segments[-1]) if segments else "-1.pkl"
+        file_name = os.path.join(
+            self._segment_dir(c_uuid), f"{int(last.split('.')[0]) + 1:012d}.pkl"
+        )
+        _atomic_write_frame(file_name, df)
+
+    def _upsert(self, c_uuid, rows):
+        """Append new rows for a uuid as a segment, compacting the
+        segments when there are too many of them"""
+        rows = rows.sort_values("created_timestamp", kind="stable")
+        rows = rows.drop(columns=["uuid", "path"], errors="ignore").set_index("time")
+        os.makedirs(self._segment_dir(c_uuid), exist_ok=True)
+        segments = self._segments(c_uuid)
+        self._write_segment(c_uuid, segments, rows)
+        segments = self._segments(c_uuid)
+        if len(segments) > self.max_segments:
+            # Written before the old segments are removed, a crash in
+            # between only leaves duplicate rows that read() drops
+            self._write_segment(c_uuid, segments, self._read_segments(segments))
+            for f in segments:
+                os.remove(f)
+
+    def sync_once(self, end_time=None):
+        """Fetch and store all rows inserted since the watermark
+
+        Args:
+            end_time: Insert time to sync up to, defaults to now
+
+        Returns:
+            Number of rows fetched
+        """
+        end = self._utc(end_time if end_time is not None else datetime.now(timezone.utc))
+        n_rows = 0
+        while True:
+            watermark = self._utc(self.watermark)
+            w_start = watermark - pd.Timedelta(self.overlap)
+            w_end = min(end, watermark + pd.Timedelta(self.max_window))
+            if w_end <= watermark:
+                break
+            df = get_newly_inserted_data(
+                w_start.to_pydatetime(),
+                w_end.to_pydatetime(),
+                aggregate=False,
+                meta_host=self.meta_host,
+                ts_host=self.ts_host,
+                headers=self.header,
+                session=self.session,
+                path_map=self._path_map,
+                as_frame=True,
+            )
+            n_rows += len(df)
+            host_state = self._state[self.ts_host]
+            if len(df) > 0:
+                new_rows = self._new_rows(df)
+                for c_uuid, c_rows in new_rows.groupby("uuid", sort=False, observed=True):
+                    self._upsert(c_uuid, c_rows)
+                uuid_paths = new_rows[["uuid", "path"]].drop_duplicates().dropna()
+                host_state.setdefault("paths", {}).update(
+                    zip(uuid_paths["uuid"].astype(str), uuid_paths["path"].astype(str))
+                )
+                self._update_overlap(df, w_end)
+            # Rows committed late with an earlier insert time are picked
+            # up by the overlap of the next sync
+            host_state["watermark"] = w_end.isoformat()
+            self._save_state()
+            logging.info(
+                "Synced %d rows inserted %s - %s", len(df), w_start, w_end
+            )
+            if w_end >= end:
+                break
+        return n_rows
+
+    def run(self, interval=60, iterations=None):
+        """Sync repeatedly
+
+        Args:
+            interval:   Seconds between syncs
+            iterations: Number of syncs, None to run forever
+        """
+        i = 0
+        while iterations is None or i < iterations:
+            try:
+                self.sync_once()
+            except Exception as e:
+                logging.error("Sync failed, retrying in %s seconds: %s", interval, e)
+            i += 1
+            if iterations is None or i < iterations:
+                time.sleep(interval)
@@ -11,18 +11,29 @@ __all__ = [
     "TimeSeries",
     "FlagTimeSeries",
     "GPSTrack",
+    "Spectra",
+    "ThingIndex",
     "ThingError",
 ]
 
+import copy
+from collections.abc import MutableMapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+
 from dateutil.parser import parse
+import numpy as np
 
 
 from .metaflow import get_thing as meta_get_thing
 from .metaflow import update_thing as meta_update_thing
 from .metaflow import delete_thing as meta_delete_thing
-from .metaflow import thing_tree2ts
-from .get_data import PyNIVAError
-from .tsb import get_signals
+from .metaflow import walk_tree
+from .metaflow import TSERIES_TTYPES
+from .metaflow import invalidate_meta_cache
+from .get_data import PyNIVAError, pooled_session
+from .tsb import get_signals, _output
+from .spectra import SpectralData
 
 
 class ThingError(PyNIVAError):
@@ -31,8 +42,89 @@ class ThingError(PyNIVAError):
     pass
 
 
+# Core fields stored in slots, all other meta data is kept in Thing._extra
+_CORE_FIELDS = ("uuid", "path", "name", "ttype", "part_of")
+_SLOTS = _CORE_FIELDS + ("_extra", "_changes")
+
+# Thing._changes of a Thing not modified since it was fetched (shared by
+# all instances, the original values are only recorded on modification)
+_UNCHANGED = ()
+
+
+class _Missing:
+    """Original value of a field that was not set"""
+
+    def __repr__(self):
+        return "<missing>"
+
+    def __reduce__(self):
+        return "_MISSING"
+
+
+_MISSING = _Missing()
+
+
+def _is_thing_data(value):
+    return isinstance(value, dict) and "ttype" in value
+
+
+def _path_name(path):
+    """Default name of a Thing, the last element of its path"""
+    assert isinstance(path, str)
+    return path.split("/")[-1]
+
+
+def _nested_meta(thing_data):
+    """Meta data of a nested Thing not created yet, with the fields the
+    Thing will have (see Thing.__init__)"""
+    if "path" in thing_data and "name" not in thing_data:
+        return dict(thing_data, name=_path_name(thing_data["path"]))
+    return thing_data
+
+
+class _MetaView(MutableMapping):
+    """Dictionary view of the meta data of a Thing (writes go to the Thing)"""
+
+    __slots__ = ("_thing",)
+
+    def __init__(self, thing):
+        self._thing = thing
+
+    def __getitem__(self, key):
+        try:
+            return self._thing._get_meta(key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self._thing, key, value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self._thing, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return iter(self._thing._meta_copy())
+
+    def __len__(self):
+        return len(self._thing._meta_copy())
+
+
 class Thing:
-    """Base class for the Thing universe"""
+    """Base class for the Thing universe
+
+    The core fields (uuid, path, name, ttype and part_of) are stored in
+    slots, other meta data in a dictionary. Nested Things (e.g. 'parts')
+    are kept as dictionaries until they are accessed.
+
+    Things fetched from 'metaflow' track changes: the original value of
+    each modified field is kept, and save skips Things without changes.
+    Things created locally are always saved.
+    """
+
+    __slots__ = _SLOTS
 
     TTYPE = "thing"
 
@@ -41,31 +133,166 @@ class Thing:
             meta_dict = {}
         for k, v in kwargs.items():
             meta_dict[k] = v
+        _set_changes(self, None)
+        self._set_meta(meta_dict)
         if "path" in meta_dict and "name" not in meta_dict:
-            assert isinstance(meta_dict["path"], str)
-            meta_dict["name"] = meta_dict["path"].split("/")[-1]
+            self.name = _path_name(meta_dict["path"])
 
         if "ttype" not in meta_dict:
-            meta_dict["ttype"] = self.TTYPE
-        self._meta_dict = meta_dict
+            self.ttype = self.TTYPE
 
-    def __getattr__(self, attr):
+    def _set_meta(self, meta_dict):
+        extra = {}
+        for k, v in meta_dict.items():
+            setter = _CORE_SETTERS.get(k)
+            if setter is None:
+                extra[k] = v
+            else:
+                setter(self, v)
+        _set_extra(self, extra)
+        if _is_thing_data(meta_dict.get("part_of")):
+            _CORE_SETTERS["part_of"](self, self._thing_dispatch(meta_dict["part_of"]))
+
+    def _get_meta(self, attr):
+        if attr in _CORE_FIELDS:
+            return object.__getattribute__(self, attr)
         try:
-            return self._meta_dict[attr]
-        except:
+            value = self._extra[attr]
+        except KeyError:
+            raise AttributeError("Attribute '%s' not found" % (attr,)) from None
+        # Create nested Things on first access, fetched with their parent
+        if _is_thing_data(value):
+            value = self._extra[attr] = self._nested_thing(value)
+        elif isinstance(value, list) and any(_is_thing_data(e) for e in value):
+            value = self._extra[attr] = [
+                self._nested_thing(e) if _is_thing_data(e) else e for e in value
+            ]
+        return value
+
+    def _nested_thing(self, thing_data):
+        thing = self._thing_dispatch(thing_data)
+        if self._changes is not None:
+            _set_changes(thing, _UNCHANGED)
+        return thing
+
+    def _track(self, attr):
+        """Record the original value of attr before it is modified"""
+        changes = self._changes
+        if changes is None or attr == "parts" or attr in changes:
+            return
+        if changes is _UNCHANGED:
+            changes = {}
+            _set_changes(self, changes)
+        try:
+            changes[attr] = self._get_meta(attr)
+        except AttributeError:
+            changes[attr] = _MISSING
+
+    @property
+    def is_new(self):
+        """True if the Thing was not fetched from (or saved to) 'metaflow'"""
+        return self._changes is None
+
+    @property
+    def changed_fields(self):
+        """Set of the fields modified since the Thing was fetched"""
+        return set(self.changes())
+
+    def changes(self):
+        """Fields modified since the Thing was fetched
+
+        Assignments (including update and deletes) are tracked; use
+        mark_changed after modifying a value in place, e.g. a list.
+
+        Returns:
+            Dictionary with a tuple (original, current) for each changed
+            field, a missing value is returned as None
+        """
+        out_dict = {}
+        for k, original in (self._changes or {}).items():
+            try:
+                current = self._get_meta(k)
+            except AttributeError:
+                current = _MISSING
+            if original is _MISSING and current is _MISSING:
+                continue
+            if original is _MISSING or current is _MISSING or original != current:
+                out_dict[k] = (
+                    None if original is _MISSING else original,
+                    None if current is _MISSING else current,
+                )
+        return out_dict
+
+    def mark_changed(self, *fields):
+        """Mark fields as changed (e.g. after modifying a list in place)"""
+        if self._changes is None:
+            return
+        if self._changes is _UNCHANGED:
+            _set_changes(self, {})
+        for k in fields:
+            self._changes[k] = _MISSING
+
+    def _mark_saved(self):
+        """Mark the Thing as unchanged, i.e. in sync with 'metaflow'"""
+        _set_changes(self, _UNCHANGED)
+        return self
+
+    def _needs_save(self):
+        return self._changes is None or len(self.changes()) > 0
+
+    def _meta_copy(self):
+        """Plain dictionary with the meta data of the instance"""
+        out_dict = {}
+        for k in _CORE_FIELDS:
+            try:
+                out_dict[k] = object.__getattribute__(self, k)
+            except AttributeError:
+                pass
+        out_dict.update(self._extra)
+        return out_dict
+
+    @property
+    def _meta_dict(self):
+        """Meta data as a dictionary like view (kept for backwards compatibility)"""
+        return _MetaView(self)
+
+    def __getattr__(self, attr):
+        # Only called when normal lookup fails, i.e. for unset slots and
+        # meta data stored in _extra
+        if attr in _SLOTS or attr.startswith("__"):
             raise AttributeError("Attribute '%s' not found" % (attr,))
+        return self._get_meta(attr)
 
     def __setattr__(self, attr, value):
-        if attr != "_meta_dict":
-            self.__dict__["_meta_dict"][attr] = value
+        self._track(attr)
+        if attr in _CORE_FIELDS:
+            object.__setattr__(self, attr, value)
+        else:
+            self._extra[attr] = value
+
+    def __delattr__(self, attr):
+        self._track(attr)
+        if attr in _CORE_FIELDS:
+            object.__delattr__(self, attr)
         else:
-            self.__dict__[attr] = value
+            try:
+                del self._extra[attr]
+            except KeyError:
+                raise AttributeError("Attribute '%s' not found" % (attr,)) from None
 
     def __dir__(self):
         return super().__dir__() + [
-            k for k in self._meta_dict.keys() if not k.startswith("_")
+            k for k in self._extra.keys() if not k.startswith("_")
         ]
 
+    def __getstate__(self):
+        return self._meta_copy(), self._changes
+
+    def __setstate__(self, state):
+        meta, changes = state
+        _set_changes(self, dict(changes) if isinstance(changes, dict) else changes)
+        self._set_meta(meta)
+
     @classmethod
     def _thing_dispatch(cls, thing_data):
         if isinstance(thing_data, list):
@@ -85,18 +312,7 @@ class Thing:
                 assert thing_data["ttype"] in _valid_types
             except AssertionError:
                 raise ThingError("%s is not a valid thing type" % thing_data["ttype"])
-            for k, v in thing_data.items():
-                if isinstance(v, dict) and "ttype" in v:
-                    thing_data[k] = cls._thing_dispatch(v)
-                elif isinstance(v, list):
-                    c_list = []
-                    for e in v:
-                        if isinstance(e, dict) and "ttype" in e:
-                            c_list.append(cls._thing_dispatch(e))
-                        else:
-                            c_list.append(e)
-                    thing_data[k] = c_list
-
+            # Nested Things are created on access, see Thing._get_meta
             thing_meta = _dispatcher[thing_data["ttype"]](thing_data)
         else:
             raise ThingError(
@@ -129,7 +345,26 @@ class Thing:
         for k, v in kwargs.items():
             c_params[k] = v
         thing_meta = meta_get_thing(meta_host, c_params, header=header, session=session)
-        return cls._thing_dispatch(thing_meta)
+        return _fetched(cls._thing_dispatch(thing_meta))
+
+    @classmethod
+    async def aget_thing(cls, meta_host, params=None, header=None, client=None, **kwargs):
+        """asyncio version of get_thing, see get_thing for the arguments.
+        Requires the optional httpx dependency.
+
+        Args:
+            client: pyniva.aio.AsyncClient used for the request
+        """
+        from .aio import get_thing as aio_get_thing
+
+        if params is None:
+            c_params = dict()
+        else:
+            c_params = params.copy()
+        for k, v in kwargs.items():
+            c_params[k] = v
+        thing_meta = await aio_get_thing(meta_host, c_params, header=header, client=client)
+        return _fetched(cls._thing_dispatch(thing_meta))
 
     @classmethod
     def get_or_create(
@@ -227,11 +462,14 @@ class Thing:
             tdict: Dictionary with parameters, must contain a 'ttype'
             parts: If True the method will build a domain model tree if present in tdict
         Returns:
-            A Thing (or subclass) instance
+            A Thing (or subclass) instance, unchanged (not new) if tdict
+            has a uuid
         """
         if parts and "parts" in tdict:
             tdict["parts"] = [cls.tdict2thing(part) for part in tdict["parts"]]
-        return _dispatcher[tdict["ttype"]](tdict)
+        thing = _dispatcher[tdict["ttype"]](tdict)
+        # Documents with a uuid come from 'metaflow' (which assigns them)
+        return thing._mark_saved() if "uuid" in tdict else thing
 
     def as_dict(self, shallow=False):
         """Return data of instance as a dictionary.
@@ -244,38 +482,37 @@ class Thing:
             A JSON serializable dictionary representing the Thing instance
         """
 
+        def _thing2dict(thing, as_ref):
+            # Nested Things may still be unconverted dictionaries
+            if as_ref:
+                if isinstance(thing, Thing):
+                    return thing.uuid if hasattr(thing, "uuid") else thing.path
+                return thing["uuid"] if "uuid" in thing else thing["path"]
+            if isinstance(thing, Thing):
+                return thing.as_dict(shallow)
+            return _dict_iter(_nested_meta(thing))
+
         def _dict_iter(c_dict):
             out_dict = c_dict.copy()
-            for k in out_dict.keys():
-                if isinstance(c_dict[k], Thing):
-                    if not shallow and not k == "part_of":
-                        out_dict[k] = out_dict[k].as_dict(shallow)
-                    else:
-                        out_dict[k] = (
-                            out_dict[k].uuid
-                            if hasattr(out_dict[k], "uuid")
-                            else out_dict[k].path
-                        )
-                elif isinstance(out_dict[k], list):
+            for k, v in out_dict.items():
+                as_ref = shallow or k == "part_of"
+                if isinstance(v, Thing) or _is_thing_data(v):
+                    out_dict[k] = _thing2dict(v, as_ref)
+                elif isinstance(v, list):
                     c_list = []
-                    for e in out_dict[k]:
-                        if isinstance(e, Thing):
-                            if not shallow and not k == "part_of":
-                                c_list.append(e.as_dict())
-                            else:
-                                c_list.append(e.uuid if hasattr(e, "uuid") else e.path)
+                    for e in v:
+                        if isinstance(e, Thing) or _is_thing_data(e):
+                            c_list.append(_thing2dict(e, as_ref))
                         elif isinstance(e, dict):
                             c_list.append(_dict_iter(e))
                         else:
                             c_list.append(e)
                     out_dict[k] = c_list
-                elif isinstance(out_dict[k], dict):
-                    out_dict[k] = _dict_iter(out_dict[k])
-                else:
-                    pass
+                elif isinstance(v, dict):
+                    out_dict[k] = _dict_iter(v)
             return out_dict
 
-        return _dict_iter(self._meta_dict)
+        return _dict_iter(self._meta_copy())
 
     def update(self, data=None, **kwargs):
         """Update Thing instance in place
@@ -295,75 +532,293 @@ class Thing:
             meta_dict[k] = v
 
         for k, v in meta_dict.items():
-            self._meta_dict[k] = v
+            setattr(self, k, v)
 
         return self
 
-    def save(self, meta_host, header=None, session=None):
+    def save(
+        self,
+        meta_host,
+        header=None,
+        session=None,
+        max_workers=None,
+        return_errors=False,
+        force=False,
+        dry_run=False,
+    ):
         """Save/update Thing in 'metaflow' meta-data service
 
         Note that the method will also recursively update/save
         objects found in self.parts list to ensure 'metaflow' is kept
         in a consistent state.
 
+        Things fetched from 'metaflow' without changes (see changes) are
+        not written, unless force is True.
+
+        If max_workers is larger than one the tree is saved in bulk: level
+        by level from the top (parents need uuids before their parts get
+        part_of), with the Things of each level saved concurrently. A failed
+        Thing does not abort the rest of the tree, but its parts are not
+        saved.
+
         Args:
             meta_host: URL of 'metaflow' service
             header: HTTP request header (for JWT authentication and encryption)
-            session: Requests session object
+            session: Requests session object (or pyniva.Client), a pooled
+                     session is created for bulk saves if not given
+            max_workers: Number of concurrent requests in a bulk save
+            return_errors: If True (bulk save only) return a tuple of the
+                     persisted instance and a dictionary with the exception
+                     for each Thing (keyed on path) that was not saved,
+                     instead of raising a ThingError
+            force: Save all Things, also unchanged ones
+            dry_run: If True nothing is saved, the documents that would
+                     be sent are returned
 
         Returns:
             The persisted instance. Note that the returned instance will
-            be different from the caller instance.
+            be different from the caller instance (unless it was not
+            changed). In a bulk save the parts of the returned tree are
+            also the persisted instances. For a dry run a list of the
+            documents that would be sent, parents before their parts
+            (part_of is not known for parts of new Things).
         """
-        c_parts = self._meta_dict.get("parts", None)
+        if dry_run:
+            return self._save_plan(force)
+        if max_workers is not None and max_workers > 1:
+            return self._bulk_save(
+                meta_host, header, session, max_workers, return_errors, force
+            )
+
+        c_parts = self._extra.get("parts", None)
         if c_parts is not None:
-            del self._meta_dict["parts"]
+            c_parts = self.parts
+            del self.parts
 
-        updated_data = meta_update_thing(
-            meta_host, self.as_dict(shallow=True), header=header, session=session
-        )
-        updated_thing = self._thing_dispatch(updated_data)
+        if force or self._needs_save():
+            updated_data = meta_update_thing(
+                meta_host, self.as_dict(shallow=True), header=header, session=session
+            )
+            invalidate_meta_cache(meta_host)
+            updated_thing = _fetched(self._thing_dispatch(updated_data))
+            self._mark_saved()
+        else:
+            updated_thing = self
 
         if c_parts is not None:
             # Handle possible inconsistencies in parts
             assert isinstance(c_parts, list)
             for p in c_parts:
-                p.part_of = updated_thing.uuid
-                p = p.save(meta_host, header=header, session=session)
+                _set_part_of(p, updated_thing.uuid)
+                p = p.save(meta_host, header=header, session=session, force=force)
             updated_thing.parts = c_parts
 
         return updated_thing
 
-    def delete(self, meta_host, header=None, recursive=True, session=None):
+    def _save_document(self):
+        data = self.as_dict(shallow=True)
+        data.pop("parts", None)
+        return data
+
+    def _save_plan(self, force):
+        """Documents save would send, see save"""
+        plan = []
+        level = [self]
+        while level:
+            next_level = []
+            for thing in level:
+                if force or thing._needs_save():
+                    plan.append(thing._save_document())
+                for p in thing.parts if thing._extra.get("parts") else []:
+                    if getattr(thing, "uuid", None) is not None:
+                        # As set by save, without changing p
+                        p = copy.copy(p)
+                        _set_part_of(p, thing.uuid)
+                    next_level.append(p)
+            level = next_level
+        return plan
+
+    def _bulk_save(self, meta_host, header, session, max_workers, return_errors, force):
+        """Save the tree level by level, see save"""
+
+        def _put(thing):
+            if not force and not thing._needs_save():
+                return thing
+            updated_data = meta_update_thing(
+                meta_host, thing._save_document(), header=header, session=c_session
+            )
+            thing._mark_saved()
+            return _fetched(thing._thing_dispatch(updated_data))
+
+        def _key(thing):
+            return getattr(thing, "path", None) or getattr(thing, "uuid", None)
+
+        saved = {}
+        errors = {}
+        own_session = session is None
+        c_session = pooled_session(max_workers) if own_session else session
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                level = [self]
+                while level:
+                    futures = [(t, executor.submit(_put, t)) for t in level]
+                    level = []
+                    for thing, future in futures:
+                        parts = thing.parts if thing._extra.get("parts") else []
+                        try:
+                            saved[id(thing)] = future.result()
+                        except Exception as e:
+                            errors[_key(thing)] = e
+                            for p in walk_tree(thing, min_depth=1, get=_tree_get):
+                                errors[_key(p)] = ThingError(
+                                    "Not saved, saving %s failed" % (_key(thing),)
+                                )
+                            continue
+                        for p in parts:
+                            _set_part_of(p, saved[id(thing)].uuid)
+                            level.append(p)
+        finally:
+            if own_session:
+                c_session.close()
+            invalidate_meta_cache(meta_host)
+
+        # Rebuild the tree from the persisted instances
+        stack = [self]
+        while stack:
+            thing = stack.pop()
+            if id(thing) not in saved or not thing._extra.get("parts"):
+                continue
+            saved[id(thing)].parts = [saved.get(id(p), p) for p in thing.parts]
+            stack.extend(thing.parts)
+
+        updated_thing = saved.get(id(self))
+        if return_errors:
+            return updated_thing, errors
+        if errors:
+            raise ThingError(
+                "Could not save %d Things: %s" % (len(errors), list(errors))
+            )
+        return updated_thing
+
+    def delete(
+        self,
+        meta_host,
+        header=None,
+        recursive=True,
+        session=None,
+        max_workers=None,
+        dry_run=False,
+    ):
         """Delete the object in meta-data service
 
         The server side API will make sure the part_of structure
         will remain/stay consistent after the delete.
+
+        A recursive delete fetches the tree (trees deeper than 100 levels
+        in more requests) and deletes it from the leaves up, one level at
+        a time (a Thing is deleted after all of its parts). If max_workers
+        is larger than one the Things of each level are deleted
+        concurrently.
+
         Args:
             meta_host: URL of 'metaflow' service
             header: HTTP request header (for JWT authentication and encryption)
             recursive: Also delete child objects
-            session: Requests session object
+            session: Requests session object (or pyniva.Client), a pooled
+                     session is created for concurrent deletes if not given
+            max_workers: Number of concurrent requests
+            dry_run: If True nothing is deleted, the plan is returned
 
         Returns:
-            The deleted instance (self).
+            The deleted instance (self). For a dry run the plan, a list of
+            levels (lists of Things) in the order they would be deleted.
         """
-        if recursive:
-            c_instance = self.get_tree(
-                meta_host, header=header, levels=1, session=session
-            )
-            c_parts = c_instance.parts if hasattr(c_instance, "parts") else []
-            for p in c_parts:
-                p.delete(meta_host, header=header, recursive=recursive, session=session)
-        if hasattr(self, "parts"):
-            del self._meta_dict["parts"]
-
-        deleted_data = meta_delete_thing(
-            meta_host, self.as_dict(shallow=True), session=session
-        )
+        plan = self._delete_plan(meta_host, header, session) if recursive else [[self]]
+        if dry_run:
+            return plan
+
+        def _delete(thing):
+            data = thing.as_dict(shallow=True)
+            data.pop("parts", None)
+            return meta_delete_thing(meta_host, data, header=header, session=c_session)
+
+        concurrent = max_workers is not None and max_workers > 1
+        own_session = session is None and concurrent
+        c_session = pooled_session(max_workers) if own_session else session
+        deleted_data = None
+        try:
+            for level in plan:
+                if not concurrent:
+                    deleted = [_delete(thing) for thing in level]
+                else:
+                    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                        futures = [(t, executor.submit(_delete, t)) for t in level]
+                    deleted = []
+                    errors = {}
+                    for thing, future in futures:
+                        try:
+                            deleted.append(future.result())
+                        except Exception as e:
+                            errors[getattr(thing, "path", None) or thing.uuid] = e
+                    if errors:
+                        # Stop, so the parents of the failed Things are kept
+                        raise ThingError(
+                            "Could not delete %d Things: %s" % (len(errors), list(errors))
+                        ) from next(iter(errors.values()))
+                for thing, data in zip(level, deleted):
+                    if getattr(thing, "uuid", None) == self.uuid:
+                        deleted_data = data
+        finally:
+            if own_session:
+                c_session.close()
+            invalidate_meta_cache(meta_host)
+
+        self._extra.pop("parts", None)
         deleted_thing = self._thing_dispatch(deleted_data)
         return deleted_thing
 
+    def _delete_plan(self, meta_host, header, session, levels=100):
+        """Levels of Things to delete, see delete. A level holds the
+        Things whose parts are all in earlier levels."""
+        tree = self.get_tree(meta_host, header=header, levels=levels, session=session)
+        # The tree is cut at the given depth, fetch the subtrees below it
+        truncated = list(
+            walk_tree(tree, min_depth=levels, max_depth=levels, get=_tree_get)
+        )
+        while truncated:
+            node = truncated.pop()
+            subtree = self.get_thing(
+                meta_host, header=header, uuid=_tree_get(node, "uuid"), parts=levels,
+                session=session,
+            )
+            parts = _tree_get(subtree, "parts")
+            if not parts:
+                continue
+            if isinstance(node, dict):
+                node["parts"] = parts
+            else:
+                node._extra["parts"] = parts
+            truncated.extend(
+                walk_tree(node, min_depth=levels, max_depth=levels, get=_tree_get)
+            )
+        heights = {}
+        plan = []
+        # Post-order, parts are visited before their parent
+        for node in walk_tree(tree, get=_tree_get):
+            parts = _tree_get(node, "parts") or []
+            height = max((heights[id(p)] + 1 for p in parts), default=0)
+            heights[id(node)] = height
+            if node is tree:
+                thing = self
+            elif isinstance(node, Thing):
+                thing = node
+            else:
+                thing = self._thing_dispatch(node)
+            while len(plan) <= height:
+                plan.append([])
+            plan[height].append(thing)
+        return plan
+
     def get_tree(self, meta_host, header=None, levels=100, session=None):
         """Get data model tree for Thing instance
 
@@ -384,6 +839,7 @@ class Thing:
 class Component(Thing):
     """Component or part of a thing"""
 
+    __slots__ = ()
     TTYPE = "component"
     pass
 
@@ -391,6 +847,7 @@ class Component(Thing):
 class Platform(Thing):
     """Base class for sensor/measurement platforms"""
 
+    __slots__ = ()
     TTYPE = "platform"
 
     def get_all_tseries(self, meta_host, header=None, session=None):
@@ -403,40 +860,30 @@ class Platform(Thing):
             session: Requests session object
 
         Returns:
-            A list of TimeSeries instances attached to the Platform
+            A ThingIndex (a sequence with lookup on path and uuid) with the
+            TimeSeries instances attached to the Platform
         """
 
-        def _part_uuid2thing(thing, tlookup):
-            if isinstance(thing, dict):
-                return tlookup[thing["uuid"]]
-            if hasattr(thing, "parts") and thing._meta_dict["parts"] is not None:
-                thing._meta_dict["parts"] = [
-                    _part_uuid2thing(part, tlookup) for part in thing.parts
-                ]
-            return tlookup[thing.uuid]
-
         full_thing = self.get_tree(meta_host, header=header, session=session)
-        thing_tree = full_thing.as_dict()
-
-        ts_list = [Thing.tdict2thing(ts) for ts in thing_tree2ts(thing_tree)]
-        ts_dict = {ts.uuid: ts for ts in ts_list}
-        out_ts_list = [_part_uuid2thing(ts, ts_dict) for ts in ts_list]
-        return out_ts_list
+        return ThingIndex.from_tree(full_thing)
 
 
 class Vessel(Platform):
     """Ship/Vessels"""
 
+    __slots__ = ()
     TTYPE = "vessel"
 
 
 class Sensor(Component):
     """Measurement system or sensor system"""
 
+    __slots__ = ()
     TTYPE = "sensor"
 
 
 class TimeSeries(Thing):
+    __slots__ = ()
     TTYPE = "tseries"
 
     @classmethod
@@ -452,7 +899,8 @@ class TimeSeries(Thing):
            timeseries:    a single TimeSeries instance or a list of TimeSeries instances
            session:       Requests session object
            **kwargs:      Keyword arguments for the query, see 'pyniva' documentation for
-                          further details.
+                          further details. output="arrow" or "polars" returns
+                          a pyarrow.Table or polars.DataFrame (see get_signals)
         Returns:
             A Pandas DataFrame with the timeseries
         """
@@ -470,9 +918,8 @@ class TimeSeries(Thing):
                 for ts in timeseries
                 if hasattr(ts, "name")
             }
-            df.columns = map(
-                lambda x: x if not uuid2meta.get(x, False) else uuid2meta[x]["path"],
-                df.columns,
+            df = _output(kwargs.get("output")).rename(
+                df, {u: meta["path"] for u, meta in uuid2meta.items()}
             )
         return df
 
@@ -527,19 +974,19 @@ class TimeSeries(Thing):
 
     @property
     def start_time(self):
-        if self._meta_dict.get("start_time", False):
-            if isinstance(self._meta_dict["start_time"], str):
-                self._meta_dict["start_time"] = parse(self._meta_dict["start_time"])
-            return self._meta_dict["start_time"]
+        if self._extra.get("start_time", False):
+            if isinstance(self._extra["start_time"], str):
+                self._extra["start_time"] = parse(self._extra["start_time"])
+            return self._extra["start_time"]
         else:
             return None
 
     @property
     def end_time(self):
-        if self._meta_dict.get("end_time", False):
-            if isinstance(self._meta_dict["end_time"], str):
-                self._meta_dict["end_time"] = parse(self._meta_dict["end_time"])
-            return self._meta_dict["end_time"]
+        if self._extra.get("end_time", False):
+            if isinstance(self._extra["end_time"], str):
+                self._extra["end_time"] = parse(self._extra["end_time"])
+            return self._extra["end_time"]
         else:
             return None
 
@@ -548,19 +995,254 @@ class TimeSeries(Thing):
 
 
 class FlagTimeSeries(TimeSeries):
+    __slots__ = ()
     TTYPE = "qctseries"
     pass
 
 
 class GPSTrack(TimeSeries):
+    __slots__ = ()
     TTYPE = "gpstrack"
     pass
 
 class Spectra(TimeSeries):
+    __slots__ = ()
     TTYPE = "spectra"
-    pass
 
+    def get_spectra(self, ts_host, dtype=np.float64, session=None, **kwargs):
+        """Query the spectral time series from the tsb backend as a dense
+        time x wavelength array. Takes the same query arguments as
+        get_tseries.
+
+        Params:
+           ts_host (str): URL for time series backend (tsb)
+           dtype:         dtype of the array, e.g. np.float32
+           session:       Requests session object
+        Returns:
+            A SpectralData instance
+        """
+        df = get_signals(ts_host, [self.uuid], session=session, **kwargs)
+        return SpectralData.from_long(df, dtype=dtype)
+
+
+
+def _tree_get(node, key):
+    """Attribute of a tree node, a dictionary or a Thing (for walk_tree).
+    Parts of Things are returned without converting them."""
+    if isinstance(node, dict):
+        return node.get(key)
+    if key == "parts":
+        return node._extra.get("parts")
+    return getattr(node, key, None)
+
+
+class ThingIndex(Sequence):
+    """Index over a list of Things (typically the time series of a Platform)
+
+    The index is a sequence of the Things in their original order, with
+    O(1) lookup on path and uuid, prefix and glob queries over the path
+    components and filtering on ttype.
+
+    Args:
+        things: Iterable of Thing instances
+
+    Example:
+        signals = vessel.get_all_tseries(meta_host, header=header)
+        gps = signals.by_path("FA/gpstrack")
+        temperatures = signals.glob("FA/*/TEMPERATURE")
+        flags = signals.of_type("qctseries")
+    """
+
+    def __init__(self, things=()):
+        self._things = list(things)
+        self._by_path = {}
+        self._by_uuid = {}
+        self._by_ttype = {}
+        self._ttypes = []
+        # Nested dictionaries of path components, None holds the position
+        self._trie = {}
+        for pos, thing in enumerate(self._things):
+            path = getattr(thing, "path", None)
+            if path is not None:
+                self._by_path.setdefault(path, pos)
+                node = self._trie
+                for component in path.split("/"):
+                    node = node.setdefault(component, {})
+                node.setdefault(None, pos)
+            c_uuid = getattr(thing, "uuid", None)
+            if c_uuid is not None:
+                self._by_uuid.setdefault(c_uuid, pos)
+            ttype = getattr(thing, "ttype", getattr(thing, "TTYPE", None))
+            self._ttypes.append(ttype)
+            self._by_ttype.setdefault(ttype, []).append(pos)
+
+    @classmethod
+    def from_tree(cls, top, ttypes=TSERIES_TTYPES):
+        """Index the Things of the given types in a Thing tree
+
+        The tree is traversed once (see metaflow.walk_tree); nodes may be
+        Things or (unconverted) dictionaries. The Things are ordered as by
+        metaflow.thing_tree2ts, and their parts refer to the indexed
+        instances.
+
+        Args:
+            top:    Top Thing (or dictionary) of the tree, e.g. from get_tree
+            ttypes: Types of the Things to index, default all time series
+
+        Returns:
+            A ThingIndex instance
+        """
+        things = []
+        for node in walk_tree(top, ttypes=ttypes, get=_tree_get):
+            if isinstance(node, dict):
+                things.append(Thing.tdict2thing(node))
+                continue
+            thing = Thing.tdict2thing(node._meta_copy())
+            # Keep the changes tracked on the source instance
+            _set_changes(thing, copy.copy(node._changes))
+            things.append(thing)
+
+        index = cls(things)
+        for thing in things:
+            parts = thing._extra.get("parts")
+            if parts:
+                thing.parts = [
+                    index._things[index._by_uuid[_tree_get(p, "uuid")]]
+                    if _tree_get(p, "uuid") in index._by_uuid
+                    else p
+                    for p in parts
+                ]
+        return index
+
+    def __getitem__(self, i):
+        return self._things[i]
 
+    def __len__(self):
+        return len(self._things)
+
+    def __contains__(self, item):
+        if isinstance(item, str):
+            return item in self._by_path or item in self._by_uuid
+        return any(item is thing for thing in self._things)
+
+    def __repr__(self):
+        return "%s(%d things)" % (type(self).__name__, len(self._things))
+
+    @property
+    def paths(self):
+        """List with the path of each Thing"""
+        return [getattr(thing, "path", None) for thing in self._things]
+
+    def by_path(self, path):
+        """Thing with the given path, raises KeyError if not found"""
+        return self._things[self._by_path[path]]
+
+    def by_uuid(self, uuid):
+        """Thing with the given uuid, raises KeyError if not found"""
+        return self._things[self._by_uuid[uuid]]
+
+    def get(self, path, default=None):
+        """Thing with the given path, or default if not found"""
+        pos = self._by_path.get(path)
+        return default if pos is None else self._things[pos]
+
+    def of_type(self, *ttypes):
+        """List of the Things with one of the given ttypes"""
+        positions = [pos for t in ttypes for pos in self._by_ttype.get(t, [])]
+        return self._select(positions)
+
+    def prefix(self, path, ttypes=None):
+        """List of the Things at or below path (compared on whole path
+        components, i.e. 'FA/RAMSES' does not match 'FA/RAMSES2')
+
+        Args:
+            path:   Path prefix
+            ttypes: Optional list of ttypes to include
+        """
+        node = self._trie
+        for component in path.rstrip("/").split("/"):
+            node = node.get(component)
+            if node is None:
+                return []
+        return self._select(self._subtree(node), ttypes)
+
+    def glob(self, pattern, ttypes=None):
+        """List of the Things with paths matching a glob pattern
+
+        The pattern is matched per path component (see fnmatch), '**'
+        matches any number of components, e.g. 'FA/**/TEMPERATURE'.
+
+        Args:
+            pattern: Glob pattern
+            ttypes:  Optional list of ttypes to include
+        """
+        positions = []
+        stack = [(self._trie, tuple(pattern.strip("/").split("/")))]
+        while stack:
+            node, components = stack.pop()
+            if not components:
+                if None in node:
+                    positions.append(node[None])
+                continue
+            head, rest = components[0], components[1:]
+            if head == "**":
+                stack.append((node, rest))
+                stack.extend((child, components) for k, child in node.items() if k is not None)
+            elif not any(c in head for c in "*?["):
+                if head in node:
+                    stack.append((node[head], rest))
+            else:
+                stack.extend(
+                    (child, rest)
+                    for k, child in node.items()
+                    if k is not None and fnmatchcase(k, head)
+                )
+        return self._select(positions, ttypes)
+
+    @staticmethod
+    def _subtree(node):
+        positions = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for k, child in node.items():
+                if k is None:
+                    positions.append(child)
+                else:
+                    stack.append(child)
+        return positions
+
+    def _select(self, positions, ttypes=None):
+        positions = sorted(set(positions))
+        if ttypes is not None:
+            positions = [pos for pos in positions if self._ttypes[pos] in ttypes]
+        return [self._things[pos] for pos in positions]
+
+
+# Slot setters used when creating instances (faster than setattr)
+_CORE_SETTERS = {k: getattr(Thing, k).__set__ for k in _CORE_FIELDS}
+_set_extra = Thing._extra.__set__
+_set_changes = Thing._changes.__set__
+
+
+def _fetched(things):
+    """Mark Things (or a list of Things) created from 'metaflow' documents
+    as unchanged"""
+    if isinstance(things, list):
+        for thing in things:
+            thing._mark_saved()
+        return things
+    return things._mark_saved()
+
+
+def _set_part_of(thing, parent_uuid):
+    """Set part_of of a part being saved. A fetched part without part_of
+    already belongs to the parent it was fetched with, filling it in is
+    not a change."""
+    if thing._changes is not None and not hasattr(thing, "part_of"):
+        _CORE_SETTERS["part_of"](thing, parent_uuid)
+    else:
+        thing.part_of = parent_uuid
 
 # Dictionary to call individual __init__ functions
 _dispatcher = {
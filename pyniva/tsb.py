@@ -3,13 +3,28 @@
 """
 Functions to connect to and get data from tsb back-end 
 """
-__all__ = ["TSB_HOST", "PUB_TSB", "get_signals", "ts_list2df"]
+__all__ = [
+    "TSB_HOST",
+    "PUB_TSB",
+    "get_signals",
+    "ts_list2df",
+    "align_frames",
+    "DtypePolicy",
+    "COMPACT_DTYPES",
+    "iter_signals",
+]
+import logging
 import os
-from collections import OrderedDict
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from math import ceil
+import numpy as np
 import pandas as pd
 from dateutil.parser import parse
 
-from .get_data import get_data
+from .get_data import get_data, pooled_session
 
 # "Public" endpoints for data
 # PUB_SIGNAL = "https://ferrybox-api.niva.no/v1/signal/"
@@ -24,42 +39,501 @@ TSB_HOST_ADDR = os.environ.get("TSB_SERVICE_HOST", "localhost")
 TSB_HOST_PORT = os.environ.get("TSB_SERVICE_PORT", 5555)
 TSB_HOST = "http://" + TSB_HOST_ADDR + ":" + str(TSB_HOST_PORT) + "/ts/"
 
+# Keys placed in the index or first in the frame by ts_list2df
+_TS_INDEX_KEYS = ("time", "longitude", "latitude")
 
-def ts_list2df(ts_dict_list):
+
+class DtypePolicy:
+    """How columns decoded from tsb data are typed
+
+    The default policy (all arguments at their defaults) gives the
+    float64, int64 and object columns of earlier versions.
+
+    Args:
+        float_dtype: dtype of measurement columns, e.g. "float32".
+                     Coordinates (longitude and latitude) stay float64.
+        nullable:    Integer and boolean columns (e.g. flags and counts)
+                     become nullable pandas integer/boolean columns,
+                     narrowed to the smallest integer type holding the
+                     values, instead of float64 with NaN or object columns
+        categorical: String columns become categorical
+    """
+
+    def __init__(self, float_dtype="float64", nullable=False, categorical=False):
+        self.float_dtype = np.dtype(float_dtype)
+        self.nullable = nullable
+        self.categorical = categorical
+
+    def __repr__(self):
+        return (
+            f"DtypePolicy(float_dtype={self.float_dtype.name!r}, "
+            f"nullable={self.nullable}, categorical={self.categorical})"
+        )
+
+
+# About half the memory of the default types for measurement data
+COMPACT_DTYPES = DtypePolicy(float_dtype="float32", nullable=True, categorical=True)
+
+
+def _dtype_policy(dtypes):
+    """DtypePolicy for the dtypes argument of the query functions: None
+    (default types), "compact" or a DtypePolicy"""
+    if dtypes is None or isinstance(dtypes, DtypePolicy):
+        return dtypes
+    if dtypes == "compact":
+        return COMPACT_DTYPES
+    raise ValueError(f"Unknown dtypes {dtypes!r}, use None, 'compact' or a DtypePolicy")
+
+
+def _nullable_int(values, mask):
+    """Nullable integer array of the smallest signed type holding values"""
+    as_int = np.where(mask, 0, values).astype(np.int64)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if as_int.size == 0 or (info.min <= as_int.min() and as_int.max() <= info.max):
+            as_int = as_int.astype(dtype)
+            break
+    return pd.arrays.IntegerArray(as_int, mask)
+
+
+def _ts_column(ts_dict_list, key, policy=None):
+    """Build a single typed column from a list of tsb row dictionaries.
+
+    Numeric columns are decoded straight into a float64 array (missing
+    values become NaN), and narrowed to int64 when the column is complete
+    and integral. Complete boolean columns become bool arrays, other value
+    types fall back to an object array.
+    With a DtypePolicy measurement columns are converted to its float
+    type, and integer, boolean and string columns to nullable or
+    categorical columns.
+    """
+    n_rows = len(ts_dict_list)
+    float_dtype = np.float64
+    if policy is not None and key not in _TS_INDEX_KEYS:
+        float_dtype = policy.float_dtype
+    sample = next(
+        (r[key] for r in ts_dict_list if r.get(key) is not None), None
+    )
+    if sample is None:
+        return np.full(n_rows, np.nan, dtype=float_dtype)
+    if isinstance(sample, (int, float)) and not isinstance(sample, bool):
+        try:
+            values = np.fromiter(
+                (np.nan if (v := r.get(key)) is None else v for r in ts_dict_list),
+                dtype=np.float64,
+                count=n_rows,
+            )
+        except (TypeError, ValueError):
+            pass
+        else:
+            if isinstance(sample, int):
+                missing = np.isnan(values)
+                if policy is not None and policy.nullable:
+                    if (values[~missing] % 1 == 0).all():
+                        return _nullable_int(values, missing)
+                elif not missing.any():
+                    as_int = values.astype(np.int64)
+                    if (as_int == values).all():
+                        return as_int
+            return values.astype(float_dtype, copy=False)
+    values = np.array([r.get(key) for r in ts_dict_list], dtype=object)
+    if policy is not None:
+        if policy.nullable and isinstance(sample, bool):
+            try:
+                return pd.array(values, dtype="boolean")
+            except (TypeError, ValueError):
+                pass
+        if policy.categorical and isinstance(sample, str):
+            return pd.Categorical(values)
+    if isinstance(sample, bool) and all(isinstance(v, bool) for v in values):
+        return values.astype(bool)
+    return values
+
+
+# Resolution pandas gives ISO8601 timestamps (depends on the pandas version)
+_TIME_UNIT = pd.to_datetime(["2020-01-01T00:00:00Z"], format="ISO8601").unit
+
+
+def _parse_utc_times(times):
+    """Parse UTC timestamps ("Z" suffix, as returned by tsb) with NumPy
+
+    Returns:
+        A naive datetime64 array (UTC) in the resolution pandas would
+        give, or None if the timestamps are not all UTC ISO8601 strings
+    """
+    if times and all(isinstance(t, str) and t.endswith("Z") for t in times):
+        try:
+            parsed = np.array([t[:-1] for t in times], dtype="datetime64")
+        except ValueError:
+            return None
+        unit = "ns" if parsed.dtype == np.dtype("datetime64[ns]") else _TIME_UNIT
+        return parsed.astype(f"datetime64[{unit}]")
+    return None
+
+
+def _parse_times(times):
+    """Parse ISO8601 timestamps from tsb
+
+    UTC timestamps are parsed by NumPy, several times faster than the
+    generic ISO8601 parser of pandas, with the same result. Other
+    timestamps use the pandas parser.
+    """
+    parsed = _parse_utc_times(times)
+    if parsed is not None:
+        return pd.DatetimeIndex(parsed).tz_localize("UTC")
+    return pd.to_datetime(times, format="ISO8601")
+
+
+def ts_list2df(ts_dict_list, dtypes=None):
     """Create pandas DataFrame from list of dictionaries
 
+    The frame is built column by column: every column is decoded directly
+    into a typed NumPy array and the timestamps are parsed as ISO8601.
+
     Params:
         ts_dict_list (list like): List of dictionaries for time series
              like JSON returned by tsb endpoint, each of the dictionaries
              must contain a timestamp (key = time)
+        dtypes: None for the default column types, "compact" or a
+             DtypePolicy (see DtypePolicy)
     Returns:
         Time indexed pandas dictionary with data in list
-    """ 
+    """
+    policy = _dtype_policy(dtypes)
     assert(len(ts_dict_list) > 0)
-    keys_set = set([k for rd in ts_dict_list for k in rd.keys()])
-    assert("time" in keys_set)
-    data_dict = OrderedDict([("time", []),])
-    if "longitude" in keys_set and "latitude" in keys_set:
-        data_dict["longitude"] = []
-        data_dict["latitude"] = []
-    for k in list(keys_set):
-        if k not in set(["time", "longitude", "latitude"]):
-            data_dict[k] = []
-
-    for ts_row in ts_dict_list:
-        c_keys = set()
-        for k, v in ts_row.items():
-            data_dict[k].append(v)
-            c_keys.add(k)
-        for c_k in list(keys_set - c_keys):
-            data_dict[c_k].append(None)
-
-    df = pd.DataFrame(data_dict)
-    df["time"] = pd.to_datetime(df["time"])
-    df.set_index("time", inplace=True)
-    return df
+    # Union of keys in first-seen order, rows from tsb normally share keys
+    keys = dict.fromkeys(ts_dict_list[0])
+    for row in ts_dict_list:
+        if not keys.keys() >= row.keys():
+            keys.update(dict.fromkeys(row))
+    assert("time" in keys)
+
+    columns = []
+    if "longitude" in keys and "latitude" in keys:
+        columns += ["longitude", "latitude"]
+    columns += [k for k in keys if k not in _TS_INDEX_KEYS]
+
+    time_index = pd.DatetimeIndex(
+        _parse_times([r.get("time") for r in ts_dict_list]), name="time"
+    )
+    data = {k: _ts_column(ts_dict_list, k, policy) for k in columns}
+    return pd.DataFrame(data, index=time_index, columns=columns)
+
+
+def align_frames(frames, keep="last"):
+    """Outer join time indexed DataFrames on their index in one pass
+
+    The union of all time indexes is built once, and every frame is
+    reindexed onto it once, instead of growing the result with one
+    outer merge per frame.
+
+    Params:
+        frames (list): Time indexed DataFrames, e.g. from get_signals
+        keep (str):    Which row to keep for duplicate timestamps within
+                       a frame, "first" or "last"
+
+    Returns:
+        A time sorted DataFrame with the columns of all frames in input
+        order. Columns repeated in later frames are dropped.
+    """
+    frames = [f for f in frames if not f.empty]
+    if len(frames) == 0:
+        return pd.DataFrame()
+
+    clean_frames = []
+    for f in frames:
+        if not f.index.is_unique:
+            f = f[~f.index.duplicated(keep=keep)]
+        if not f.index.is_monotonic_increasing:
+            f = f.sort_index(kind="stable")
+        clean_frames.append(f)
+
+    union = clean_frames[0].index
+    if len(clean_frames) > 1:
+        union = union.append([f.index for f in clean_frames[1:]]).unique()
+        union = union.sort_values()
+    union = union.rename("time")
+
+    data = {}
+    for f in clean_frames:
+        if not f.index.equals(union):
+            f = f.reindex(union)
+        for col in f.columns:
+            if col in data:
+                logging.warning("Column %s found in several frames, keeping the first", col)
+                continue
+            # Keep extension arrays (nullable, categorical) as they are
+            data[col] = f[col].array
+    return pd.DataFrame(data, index=union, columns=list(data))
+
+
+_ISO_DURATION = re.compile(
+    r"^P(?:(?P<years>\d+(?:\.\d+)?)Y)?(?:(?P<months>\d+(?:\.\d+)?)M)?"
+    r"(?:(?P<weeks>\d+(?:\.\d+)?)W)?(?:(?P<days>\d+(?:\.\d+)?)D)?"
+    r"(?:T(?:(?P<hours>\d+(?:\.\d+)?)H)?(?:(?P<minutes>\d+(?:\.\d+)?)M)?"
+    r"(?:(?P<seconds>\d+(?:\.\d+)?)S)?)?$"
+)
+_ISO_DURATION_SECONDS = {
+    "years": 365 * 86400,
+    "months": 30 * 86400,
+    "weeks": 7 * 86400,
+    "days": 86400,
+    "hours": 3600,
+    "minutes": 60,
+    "seconds": 1,
+}
+
+
+def _duration_seconds(duration):
+    """Length in seconds of a tsb duration (number of seconds, timedelta
+    or ISO8601 duration string), None if it can not be interpreted.
+    Months and years are approximated as 30 and 365 days."""
+    if isinstance(duration, timedelta):
+        return duration.total_seconds()
+    if isinstance(duration, (int, float)) and not isinstance(duration, bool):
+        return float(duration)
+    if isinstance(duration, str):
+        try:
+            return float(duration)
+        except ValueError:
+            pass
+        match = _ISO_DURATION.match(duration.upper())
+        if match and duration.upper() not in ("P", "PT"):
+            return sum(
+                float(v) * _ISO_DURATION_SECONDS[k]
+                for k, v in match.groupdict().items()
+                if v is not None
+            )
+    return None
+
+
+def _time_windows(start_time, end_time, window, align=None):
+    """Split start_time - end_time into consecutive windows of (at most)
+    the given length. Inner window boundaries are floored to multiples of
+    align (seconds) to match tsb aggregation intervals."""
+    windows = []
+    w_start = start_time
+    while w_start < end_time:
+        w_end = w_start + window
+        if align:
+            w_end = pd.Timestamp(w_end).floor(f"{align}s").to_pydatetime()
+            if w_end <= w_start:
+                w_end = w_start + timedelta(seconds=align)
+        w_end = min(w_end, end_time)
+        windows.append((w_start, w_end))
+        w_start = w_end
+    return windows if windows else [(start_time, end_time)]
+
+
+def _index_time(t, index):
+    """Timestamp comparable with the (possibly timezone aware) time index,
+    naive timestamps are assumed to be UTC"""
+    t = pd.Timestamp(t)
+    if index.tz is not None and t.tz is None:
+        return t.tz_localize("UTC")
+    if index.tz is None and t.tz is not None:
+        return t.tz_convert("UTC").tz_localize(None)
+    return t
+
+
+def _count_params(params, start_time, end_time):
+    """Parameters of a tsb query counting the raw rows of a query"""
+    total = (end_time - start_time).total_seconds()
+    c_params = {k: v for k, v in params.items() if k != "n"}
+    c_params.update(
+        start=start_time.isoformat(),
+        end=end_time.isoformat(),
+        agg_type="count",
+        dt=int(ceil(total)) + 1,
+    )
+    return c_params
+
+
+def _count_total(data):
+    """Total number of rows from a count query response, None if unknown"""
+    if len(data) == 0:
+        return 0
+    counts = ts_list2df(data).drop(columns=list(_TS_INDEX_KEYS), errors="ignore")
+    counts = counts.select_dtypes("number")
+    if counts.empty:
+        return None
+    return int(counts.sum().sum())
+
+
+def _count_rows(query_url, params, start_time, end_time, header, session):
+    """Ask tsb for the number of raw rows in a query, None if unknown"""
+    c_params = _count_params(params, start_time, end_time)
+    try:
+        data = get_data(query_url, params=c_params, headers=header, session=session)
+    except Exception as e:
+        logging.warning("Could not estimate size of query: %s", e)
+        return None
+    return _count_total(data)
+
+
+def _window_dt(params):
+    """The fixed dt (seconds) of a query split into time windows, None
+    (with a warning) if dt is not fixed"""
+    dt_seconds = _duration_seconds(params.get("dt"))
+    if dt_seconds is None:
+        logging.warning(
+            "Splitting a query into time windows requires a fixed dt, "
+            "the query is sent as a single request."
+        )
+    return dt_seconds
+
+
+def _split_windows(start_time, end_time, dt_seconds, window, max_rows, n_rows=None):
+    """Time windows of a fixed length, or of about max_rows rows each
+    (n_rows is the number of raw rows of queries without aggregation)"""
+    total = (end_time - start_time).total_seconds()
+    if window is not None:
+        window_seconds = _duration_seconds(window)
+        if not window_seconds or window_seconds <= 0:
+            raise ValueError(f"Invalid window length {window}")
+    else:
+        if dt_seconds > 0:
+            n_rows = total / dt_seconds
+        n_windows = max(1, int(ceil(n_rows / max_rows)))
+        window_seconds = total / n_windows
+    if dt_seconds > 0:
+        window_seconds = max(dt_seconds, (window_seconds // dt_seconds) * dt_seconds)
+    return _time_windows(
+        start_time,
+        end_time,
+        timedelta(seconds=window_seconds),
+        align=dt_seconds if dt_seconds > 0 else None,
+    )
+
+
+def _signal_windows(
+    query_url, params, start_time, end_time, window, max_rows, header, session
+):
+    """Time windows for a sharded query, based on a fixed window length
+    or a target number of rows per window"""
+    dt_seconds = _window_dt(params)
+    if dt_seconds is None:
+        return [(start_time, end_time)]
+    n_rows = None
+    if window is None and dt_seconds == 0:
+        n_rows = _count_rows(query_url, params, start_time, end_time, header, session)
+        if n_rows is None:
+            return [(start_time, end_time)]
+    return _split_windows(start_time, end_time, dt_seconds, window, max_rows, n_rows)
 
 
+def _signal_query(uuids, kwargs):
+    """tsb query parameters and time range from get_signals arguments
+
+    Returns:
+        Tuple (params, start_time, end_time)
+    """
+    kwargs = dict(kwargs)
+    start_time = kwargs.pop("start_time", None)
+    if isinstance(start_time, str):
+        start_time = parse(start_time)
+    end_time = kwargs.pop("end_time", None)
+    if isinstance(end_time, str):
+        end_time = parse(end_time)
+    params = {}
+    for k, v in kwargs.items():
+        params[k] = v
+    params["uuid"] = ",".join(uuids)
+    return params, start_time, end_time
+
+
+def _concat_windows(frames, windows):
+    """Concatenate the frames of consecutive time windows. Rows at a window
+    boundary may be returned by both neighbouring windows, they are
+    dropped from the first one."""
+    frames = list(frames)
+    for i, (_, w_end) in enumerate(windows[:-1]):
+        if not frames[i].empty:
+            frames[i] = frames[i][frames[i].index < _index_time(w_end, frames[i].index)]
+    frames = [f for f in frames if not f.empty]
+    if len(frames) == 0:
+        return pd.DataFrame()
+    return pd.concat(frames)
+
+
+class _PandasOutput:
+    """pandas DataFrame output of the tsb query functions (the default),
+    see columnar for the Arrow and Polars outputs"""
+
+    name = "pandas"
+
+    def __init__(self, policy=None):
+        self.policy = policy
+
+    def decode(self, ts_dict_list):
+        return ts_list2df(ts_dict_list, dtypes=self.policy)
+
+    def empty(self):
+        return pd.DataFrame()
+
+    def concat(self, frames, windows):
+        return _concat_windows(frames, windows)
+
+    def rename(self, frame, names):
+        return frame.set_axis([names.get(c, c) for c in frame.columns], axis=1)
+
+    def align(self, frames, keep="last"):
+        return align_frames(frames, keep=keep)
+
+    def conform(self, frame, columns, w_end=None):
+        """Rows before w_end (if given) with exactly the given columns,
+        missing columns are filled with NaN"""
+        if w_end is not None and not frame.empty:
+            frame = frame[frame.index < _index_time(w_end, frame.index)]
+        _warn_dropped(frame.columns, columns)
+        float_dtype = np.float64 if self.policy is None else self.policy.float_dtype
+        data = {
+            c: frame[c].array if c in frame.columns else np.full(len(frame), np.nan, dtype=float_dtype)
+            for c in columns
+        }
+        return pd.DataFrame(data, index=frame.index, columns=columns)
+
+
+_PANDAS_OUTPUT = _PandasOutput()
+
+
+def _warn_dropped(frame_columns, columns):
+    dropped = [c for c in frame_columns if c != "time" and c not in columns]
+    if dropped:
+        logging.warning("Columns %s are not in the chunk layout and are dropped", dropped)
+
+
+def _output(output=None, dtypes=None):
+    """Output of the query functions: output is None or "pandas", "arrow"
+    or "polars", dtypes see DtypePolicy"""
+    policy = _dtype_policy(dtypes)
+    if output is None or output == "pandas":
+        return _PANDAS_OUTPUT if policy is None else _PandasOutput(policy)
+    if output == "arrow":
+        from .columnar import _ArrowOutput
+
+        return _ArrowOutput(policy)
+    if output == "polars":
+        from .columnar import _PolarsOutput
+
+        return _PolarsOutput(policy)
+    raise ValueError(f"Unknown output {output!r}, use 'pandas', 'arrow' or 'polars'")
+
+
+def _get_signal_frame(
+    query_url, params, start_time, end_time, header, session, output=_PANDAS_OUTPUT
+):
+    c_params = params.copy()
+    if start_time is not None:
+        c_params["start"] = start_time.isoformat()
+    if end_time is not None:
+        c_params["end"] = end_time.isoformat()
+    data = get_data(query_url, params=c_params, headers=header, session=session)
+
+    if len(data) == 0:
+        return output.empty()
+    return output.decode(data)
+
 
 # Helper to get data frames with time series data
 def get_signals(signals_url, uuids, session=None, **kwargs):
@@ -85,6 +559,23 @@ def get_signals(signals_url, uuids, session=None, **kwargs):
        headers (dict):        Header data for the request towards NIVA public endpoint,
                               must include JWT access token (internal endpoint requires no
                               header)
+       window:                Split the query into time windows of this length
+                              (seconds, timedelta or ISO8601 duration), fetched
+                              concurrently. Requires start_time, end_time and dt.
+       max_rows (int):        Split the query into time windows of about this
+                              many rows, alternative to window
+       max_workers (int):     Number of concurrent requests for split queries
+       cache (TimeSeriesCache): Local cache, only the parts of the time range
+                              not already cached are fetched from tsb
+       dtypes:                Column types, None for the default types,
+                              "compact" (float32 measurements, nullable
+                              integer flags and counts, categorical strings)
+                              or a DtypePolicy
+       output (str):          "pandas" (default), "arrow" for a pyarrow.Table
+                              or "polars" for a polars.DataFrame, built
+                              directly from the tsb data (see columnar). The
+                              Arrow and Polars frames have a time column
+                              instead of a time index.
 
     Returns:
        A Pandas DataFrame with the data returned
@@ -92,31 +583,244 @@ def get_signals(signals_url, uuids, session=None, **kwargs):
     """
     
 
-    header = kwargs.get("header")
-    if "header" in kwargs:
-        del kwargs["header"]
+    header = kwargs.pop("header", None)
+    window = kwargs.pop("window", None)
+    max_rows = kwargs.pop("max_rows", None)
+    max_workers = kwargs.pop("max_workers", 4)
+    cache = kwargs.pop("cache", None)
+    output = _output(kwargs.pop("output", None), kwargs.pop("dtypes", None))
 
     query_url = signals_url
-    params = {}
-    if "start_time" in kwargs:
-        if isinstance(kwargs["start_time"], str):
-            kwargs["start_time"] = parse(kwargs["start_time"])
-        params["start"] = kwargs["start_time"].isoformat()
-        del kwargs["start_time"]
-    if "end_time" in kwargs:
-        if isinstance(kwargs["end_time"], str):
-            kwargs["end_time"] = parse(kwargs["end_time"])
-        params["end"] =  kwargs["end_time"].isoformat()
-        del kwargs["end_time"]
-    for k, v in kwargs.items():
-        params[k] = v
-    params["uuid"] = ",".join(uuids)
+    params, start_time, end_time = _signal_query(uuids, kwargs)
 
-    data = get_data(query_url, params=params, headers=header, session=session)
+    if cache is not None:
+        if output.name != "pandas":
+            raise ValueError("The time series cache only supports pandas output")
+        df = cache.get_signals(
+            uuids,
+            params,
+            start_time,
+            end_time,
+            lambda s, e: _fetch_signals(
+                query_url, params, s, e, window, max_rows, max_workers, header, session
+            ),
+        )
+        # Cached segments are stored with the default types
+        return df if output.policy is None else _apply_dtypes(df, output.policy)
+    return _fetch_signals(
+        query_url,
+        params,
+        start_time,
+        end_time,
+        window,
+        max_rows,
+        max_workers,
+        header,
+        session,
+        output,
+    )
+
+
+def _apply_dtypes(df, policy):
+    """Convert the columns of a frame with default types to a DtypePolicy
+
+    Integer columns with missing values are float64 in default frames,
+    float columns with missing values and only integral values are
+    converted back to nullable integers (as ts_list2df does).
+    """
+    data = {}
+    for col in df.columns:
+        values = df[col]
+        if col not in _TS_INDEX_KEYS and pd.api.types.is_float_dtype(values):
+            as_float = values.to_numpy()
+            missing = np.isnan(as_float)
+            if (
+                policy.nullable
+                and missing.any()
+                and not missing.all()
+                and (as_float[~missing] % 1 == 0).all()
+            ):
+                values = _nullable_int(as_float, missing)
+            else:
+                values = values.astype(policy.float_dtype)
+        elif policy.nullable and pd.api.types.is_integer_dtype(values):
+            as_int = values.to_numpy()
+            values = _nullable_int(as_int, np.zeros(len(as_int), dtype=bool))
+        elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            present = values.dropna()
+            sample = present.iloc[0] if len(present) else None
+            if policy.nullable and isinstance(sample, bool):
+                values = values.astype("boolean")
+            elif policy.categorical and isinstance(sample, str):
+                values = values.astype("category")
+        data[col] = values if isinstance(values, pd.arrays.IntegerArray) else values.array
+    return pd.DataFrame(data, index=df.index, columns=df.columns)
+
+
+def _fetch_signals(
+    query_url,
+    params,
+    start_time,
+    end_time,
+    window,
+    max_rows,
+    max_workers,
+    header,
+    session,
+    output=_PANDAS_OUTPUT,
+):
+    """Fetch a signals query from tsb, optionally split in time windows"""
+    windows = [(start_time, end_time)]
+    if (window is not None or max_rows is not None) and (
+        start_time is not None and end_time is not None
+    ):
+        windows = _signal_windows(
+            query_url, params, start_time, end_time, window, max_rows, header, session
+        )
+    if len(windows) == 1:
+        return _get_signal_frame(
+            query_url, params, start_time, end_time, header, session, output
+        )
+
+    own_session = session is None
+    if own_session:
+        session = pooled_session(max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(
+                executor.map(
+                    lambda w: _get_signal_frame(
+                        query_url, params, w[0], w[1], header, session, output
+                    ),
+                    windows,
+                )
+            )
+    finally:
+        if own_session:
+            session.close()
+
+    return output.concat(frames, windows)
+
+
+# Default window length of the chunked iterators
+ITER_WINDOW = "P1D"
+
+
+def _iter_windows(start_time, end_time, params, window):
+    """Time windows of a chunked iteration, aligned to dt if it is fixed"""
+    window_seconds = _duration_seconds(window)
+    if not window_seconds or window_seconds <= 0:
+        raise ValueError(f"Invalid window length {window}")
+    dt_seconds = _duration_seconds(params.get("dt"))
+    if dt_seconds:
+        window_seconds = max(dt_seconds, (window_seconds // dt_seconds) * dt_seconds)
+    return _time_windows(
+        start_time,
+        end_time,
+        timedelta(seconds=window_seconds),
+        align=dt_seconds if dt_seconds else None,
+    )
+
+
+def _prefetched(fetch, windows, prefetch):
+    """Yield fetch(window) for each window in order, fetching up to
+    prefetch windows ahead in background threads. At most prefetch + 1
+    windows are held in memory besides the one being consumed."""
+    if not prefetch or prefetch <= 0:
+        for w in windows:
+            yield fetch(w)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    windows = iter(windows)
+    pending = deque()
+    try:
+        for w in windows:
+            pending.append(executor.submit(fetch, w))
+            if len(pending) > prefetch:
+                break
+        while pending:
+            result = pending.popleft().result()
+            w = next(windows, None)
+            if w is not None:
+                pending.append(executor.submit(fetch, w))
+            yield result
+    finally:
+        # Also when the consumer stops early: drop the windows not started
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_signals(
+    signals_url,
+    uuids,
+    start_time,
+    end_time,
+    window=ITER_WINDOW,
+    prefetch=1,
+    columns=None,
+    session=None,
+    **kwargs,
+):
+    """Iterate over time series data from tsb in chunks of a time window
+
+    The time range is queried one window at a time, and the next window(s)
+    are downloaded while the current chunk is consumed, so memory use is
+    bounded by the window length regardless of the length of the time range.
+    Rows at a window boundary are only included in one chunk, and all
+    chunks have the same columns.
+
+    Params:
+       signals_url (str):     The base url for the time series endpoint
+       uuids (list):          List of UUIDs for the signals to query
+       start_time, end_time:  Time range of the query
+       window:                Window length (seconds, timedelta or ISO8601
+                              duration), rounded down to a multiple of dt
+       prefetch (int):        Number of windows downloaded ahead, 0 downloads
+                              each window when the next chunk is requested
+       columns (list):        Column layout of the chunks (not including time).
+                              Defaults to the columns of the first non-empty
+                              chunk followed by the missing uuids. Columns
+                              outside the layout are dropped with a warning.
+       session (Session):     Requests session object (or pyniva.Client)
+       **kwargs:              Query parameters as for get_signals (dt,
+                              agg_type, noqc, header, dtypes, output, ...)
+
+    Yields:
+       One DataFrame (or Arrow table/Polars frame, see output) per window
+       with data, in time order
+    """
+    header = kwargs.pop("header", None)
+    output = _output(kwargs.pop("output", None), kwargs.pop("dtypes", None))
+    params, start_time, end_time = _signal_query(
+        uuids, {**kwargs, "start_time": start_time, "end_time": end_time}
+    )
+    if start_time is None or end_time is None:
+        raise ValueError("iter_signals requires start_time and end_time")
+    windows = _iter_windows(start_time, end_time, params, window)
+
+    own_session = session is None and prefetch
+    if own_session:
+        session = pooled_session(prefetch)
+
+    def _fetch(w):
+        return _get_signal_frame(signals_url, params, w[0], w[1], header, session, output)
+
+    chunks = _prefetched(_fetch, windows, prefetch)
+    try:
+        for (_, w_end), frame in zip(windows, chunks):
+            if len(frame) == 0:
+                continue
+            if columns is None:
+                names = [c for c in _frame_columns(frame) if c != "time"]
+                columns = names + [u for u in uuids if u not in names]
+            frame = output.conform(frame, columns, None if w_end == end_time else w_end)
+            if len(frame) > 0:
+                yield frame
+    finally:
+        chunks.close()
+        if own_session:
+            session.close()
 
-    if len(data) == 0:
-        df = pd.DataFrame()
-    else:
-        df = ts_list2df(data)
 
-    return df
\ No newline at end of file
+def _frame_columns(frame):
+    return list(frame.column_names if hasattr(frame, "column_names") else frame.columns)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File helpers shared by the on-disk caches and stores
+"""
+__all__ = []
+
+import json
+import os
+import threading
+
+
+def _tmp_name(file_name):
+    return f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _atomic_write_json(file_name, data):
+    """Write JSON to file through a temporary file, so a crash never
+    leaves a partly written file behind"""
+    tmp_name = _tmp_name(file_name)
+    with open(tmp_name, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_name, file_name)
+
+
+def _atomic_write_frame(file_name, df):
+    """Pickle a DataFrame to file through a temporary file"""
+    tmp_name = _tmp_name(file_name)
+    df.to_pickle(tmp_name)
+    os.replace(tmp_name, file_name)
@@ -0,0 +1,240 @@
+"""
+Local in-process stand-in for the tsb and metaflow HTTP services,
+serving the synthetic FerryBox test data
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+TEST_DATA_FILE = Path(__file__).parents[0] / "test_data" / "synthetic_ferrybox_data.json"
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def path2uuid(path):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, path))
+
+
+def _copy_path(path, copy):
+    """Path of a copy of a time series, e.g. SYNTH_FA/ferrybox_2/CTD/TEMPERATURE"""
+    if copy == 0:
+        return path
+    parts = path.split("/")
+    parts[1] = f"{parts[1]}_{copy + 1}"
+    return "/".join(parts)
+
+
+class StandInData:
+    """Metadata tree and time series built from the synthetic FerryBox data
+
+    Every path prefix becomes a Thing: the root is a vessel, paths with
+    data become tseries, qctseries or gpstrack documents and all other
+    prefixes become components.
+
+    The data can be scaled up: time_scale repeats the samples of every
+    series that many times (shifted by the length of the data), and
+    path_scale adds copies of the time series under new components (the
+    gpstrack is not copied).
+    """
+
+    def __init__(self, data_file=TEST_DATA_FILE, time_scale=1, path_scale=1):
+        with open(data_file, "r") as f:
+            raw = json.load(f)
+
+        self.values = {}
+        kinds = {}
+        for copy in range(path_scale):
+            for name, ttype in (("time_series", "tseries"), ("flags", "qctseries")):
+                for row in raw[name]:
+                    path = _copy_path(row[1], copy)
+                    kinds[path] = ttype
+                    self.values.setdefault(path, []).append((row[0], row[2]))
+        for row in raw["locations"]:
+            kinds[row[1]] = "gpstrack"
+            self.values.setdefault(row[1], []).append((row[0], (row[2], row[3])))
+
+        all_times = pd.to_datetime([r[0] for rows in self.values.values() for r in rows])
+        shift = all_times.max() - all_times.min() + pd.Timedelta(seconds=1)
+        self.series = {}
+        for path, rows in self.values.items():
+            rows.sort()
+            times = pd.to_datetime([r[0] for r in rows], utc=True)
+            times = times.append([times + i * shift for i in range(1, time_scale)])
+            values = [r[1] for r in rows] * time_scale
+            self.series[path2uuid(path)] = (path, times, values)
+        self.kinds = kinds
+        # Insert time of all data, for the insert time endpoint
+        self.created = pd.Timestamp.now(tz="UTC")
+
+        self.docs = {}
+        for path, ttype in kinds.items():
+            parts = path.split("/")
+            for i in range(1, len(parts) + 1):
+                c_path = "/".join(parts[:i])
+                if c_path not in self.docs:
+                    self.docs[c_path] = {
+                        "uuid": path2uuid(c_path),
+                        "path": c_path,
+                        "name": parts[i - 1],
+                        "ttype": "vessel" if i == 1 else "component",
+                    }
+                    if i > 1:
+                        self.docs[c_path]["part_of"] = path2uuid("/".join(parts[: i - 1]))
+            self.docs[path]["ttype"] = ttype
+        self.uuid2path = {d["uuid"]: p for p, d in self.docs.items()}
+        self._children = {}
+        for p, d in self.docs.items():
+            if "/" in p:
+                self._children.setdefault(p.rsplit("/", 1)[0], []).append(d)
+
+    def children(self, path):
+        return self._children.get(path, [])
+
+    def tree(self, path, levels):
+        doc = dict(self.docs[path])
+        if levels > 0:
+            children = self.children(path)
+            if children:
+                doc["parts"] = [self.tree(c["path"], levels - 1) for c in children]
+        return doc
+
+    def query_meta(self, params):
+        if "uuid" in params:
+            paths = [self.uuid2path[u] for u in params["uuid"].split(",") if u in self.uuid2path]
+        elif "path" in params:
+            paths = [params["path"]] if params["path"] in self.docs else []
+        elif "ttype" in params:
+            paths = [p for p, d in self.docs.items() if d["ttype"] == params["ttype"]]
+        else:
+            paths = list(self.docs)
+        levels = int(params.get("parts", 0))
+        return [self.tree(p, levels) for p in paths]
+
+    def query_ts(self, params):
+        start = pd.Timestamp(params["start"]) if "start" in params else None
+        end = pd.Timestamp(params["end"]) if "end" in params else None
+        if start is not None and start.tz is None:
+            start = start.tz_localize("UTC")
+        if end is not None and end.tz is None:
+            end = end.tz_localize("UTC")
+
+        rows = {}
+        for c_uuid in params.get("uuid", "").split(","):
+            if c_uuid not in self.series:
+                continue
+            path, times, values = self.series[c_uuid]
+            is_track = path.endswith("gpstrack")
+            for t, v in zip(times, values):
+                if (start is not None and t < start) or (end is not None and t > end):
+                    continue
+                row = rows.setdefault(t, {"time": t.strftime(TIME_FORMAT)})
+                if is_track:
+                    row["longitude"], row["latitude"] = v
+                else:
+                    row[c_uuid] = v
+        return [rows[t] for t in sorted(rows)]
+
+    def query_insert_time(self, params):
+        """Time series data (not flags or tracks) inserted in a time range"""
+        start = pd.Timestamp(params["start"])
+        end = pd.Timestamp(params["end"])
+        if start.tz is None:
+            start = start.tz_localize("UTC")
+        if end.tz is None:
+            end = end.tz_localize("UTC")
+        if not start <= self.created <= end:
+            return []
+
+        created = self.created.strftime(TIME_FORMAT)
+        aggregate = params.get("aggregate", "False") == "True"
+        rows = []
+        for c_uuid, (path, times, values) in self.series.items():
+            if self.kinds[path] != "tseries":
+                continue
+            if aggregate:
+                rows.append({"uuid": c_uuid, "count": len(values),
+                             "min": min(values), "max": max(values)})
+            else:
+                rows.extend(
+                    {"uuid": c_uuid, "time": t.strftime(TIME_FORMAT), "value": v,
+                     "created_timestamp": created}
+                    for t, v in zip(times, values)
+                )
+        return rows
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def _params(self):
+        return {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        route = urlparse(self.path).path
+        params = self._params()
+        self.server.requests.append((route, params))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if route.startswith("/meta"):
+            things = self.server.data.query_meta(params)
+            if len(things) == 0:
+                return self._send_json({"message": "not found"})
+            return self._send_json({"t": things})
+        if route.startswith("/ts") and route.endswith("/time-series-by-insert-time"):
+            return self._send_json(self.server.data.query_insert_time(params))
+        if route.startswith("/ts"):
+            return self._send_json({"t": self.server.data.query_ts(params)})
+        self._send_json({"message": f"unknown endpoint {route}"}, status=404)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer:
+    """tsb and metaflow stand-in running in a background thread
+
+    Args:
+        data:    StandInData instance, defaults to the unscaled test data
+        latency: Seconds added to the response time of every request
+
+    Example:
+        with StandInServer() as server:
+            Vessel.get_thing(server.meta_url, path="SYNTH_FA")
+    """
+
+    def __init__(self, data=None, latency=0.0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.httpd.data = data if data is not None else StandInData()
+        self.httpd.latency = latency
+        self.httpd.requests = []
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        self.meta_url = f"{self.url}/meta/"
+        self.tsb_url = f"{self.url}/ts/"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def data(self):
+        return self.httpd.data
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,106 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+from pyniva import TimeSeriesCache, Vessel, get_ship_data
+from pyniva.tsb import get_signals
+
+from .standin import StandInServer, path2uuid
+
+httpx = pytest.importorskip("httpx")
+aio = pytest.importorskip("pyniva.aio")
+
+PATHS = [
+    "SYNTH_FA/ferrybox/CTD/TEMPERATURE",
+    "SYNTH_FA/ferrybox/CTD/SALINITY",
+    "SYNTH_FA/ferrybox/CTD/SALINITY/FROZEN_TEST",
+]
+QUERY = dict(start_time="2018-12-16T21:00:00", end_time="2018-12-16T23:00:00")
+
+
+@pytest.fixture(scope="module")
+def server():
+    with StandInServer() as server:
+        yield server
+
+
+def test_async_get_ship_data_matches_sync(server):
+    expected = get_ship_data("SYNTH_FA", list(PATHS), noqc=True, header=None,
+                             pub_tsb=server.tsb_url, meta_host=server.meta_url, **QUERY)
+
+    paths = list(PATHS)
+
+    async def _run():
+        async with aio.AsyncClient(tsb_host=server.tsb_url, meta_host=server.meta_url,
+                                   max_concurrency=2) as client:
+            return await client.get_ship_data("SYNTH_FA", paths, noqc=True, **QUERY)
+
+    df = asyncio.run(_run())
+    assert not df.empty and paths == PATHS
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_async_get_ship_data_cancelled_fetch(server, monkeypatch):
+    get = aio.get_signals
+
+    async def get_signals(signals_url, uuids, **kwargs):
+        if uuids == [path2uuid(PATHS[1])]:
+            raise asyncio.CancelledError()
+        return await get(signals_url, uuids, **kwargs)
+
+    monkeypatch.setattr(aio, "get_signals", get_signals)
+
+    async def _run():
+        async with aio.AsyncClient(tsb_host=server.tsb_url, meta_host=server.meta_url) as client:
+            return await client.get_ship_data("SYNTH_FA", list(PATHS), noqc=True, **QUERY)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(_run())
+
+
+def test_async_get_signals_and_thing(server):
+    uuids = [path2uuid(p) for p in PATHS[:2]]
+    expected = get_signals(server.tsb_url, uuids, dt=0, **QUERY)
+
+    async def _run():
+        async with aio.AsyncClient(tsb_host=server.tsb_url, meta_host=server.meta_url) as client:
+            vessel = await Vessel.aget_thing(server.meta_url, path="SYNTH_FA", client=client)
+            windowed = await client.get_signals(uuids, dt=0, window="PT10M", **QUERY)
+            return vessel, await client.get_signals(uuids, dt=0, **QUERY), windowed
+
+    vessel, df, windowed = asyncio.run(_run())
+    assert isinstance(vessel, Vessel) and vessel.path == "SYNTH_FA"
+    pd.testing.assert_frame_equal(df, expected)
+    pd.testing.assert_frame_equal(windowed, expected)
+
+
+def test_async_get_signals_matches_sync_options(server, tmp_path, caplog):
+    uuids = [path2uuid(p) for p in PATHS[:2]]
+    by_rows = get_signals(server.tsb_url, uuids, dt=60, max_rows=30, **QUERY)
+
+    async def _run():
+        async with aio.AsyncClient(tsb_host=server.tsb_url, meta_host=server.meta_url) as client:
+            # Without a fixed dt the query is sent as a single request
+            n_requests = len(server.requests)
+            no_dt = await client.get_signals(uuids, window="PT10M", **QUERY)
+            assert len(server.requests) == n_requests + 1
+            n_requests = len(server.requests)
+            rows = await client.get_signals(uuids, dt=60, max_rows=30, **QUERY)
+            assert len(server.requests) == n_requests + 4
+            with pytest.raises(ValueError):
+                await client.get_signals(uuids, dt=0, window="later", **QUERY)
+
+            cache = TimeSeriesCache(tmp_path)
+            cached = await client.get_signals(uuids, dt=0, cache=cache, **QUERY)
+            n_requests = len(server.requests)
+            again = await client.get_signals(uuids, dt=0, cache=cache, **QUERY)
+            assert len(server.requests) == n_requests
+            return no_dt, rows, cached, again
+
+    no_dt, rows, cached, again = asyncio.run(_run())
+    assert "requires a fixed dt" in caplog.text
+    pd.testing.assert_frame_equal(no_dt, get_signals(server.tsb_url, uuids, **QUERY))
+    pd.testing.assert_frame_equal(rows, by_rows)
+    pd.testing.assert_frame_equal(cached, again)
+    pd.testing.assert_frame_equal(cached, get_signals(server.tsb_url, uuids, dt=0, **QUERY))
@@ -0,0 +1,102 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pyniva import Client
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answers 503 on the first request for each path, then JSON"""
+
+    seen = set()
+    headers_seen = []
+
+    def do_GET(self):
+        self.headers_seen.append(dict(self.headers))
+        if self.path not in self.seen:
+            self.seen.add(self.path)
+            self.send_response(503)
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            self.wfile.write(b"unavailable")
+            return
+        body = json.dumps({"t": [{"time": "2020-01-01T00:00:00Z", "u1": 1.5}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def flaky_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/ts/"
+    server.shutdown()
+
+
+def test_client_retries_and_sends_auth_header(flaky_server):
+    with Client(tsb_host=flaky_server, header={"Authorization": b"Bearer abc"},
+                backoff_factor=0) as client:
+        df = client.get_signals(["u1"], dt=0, start_time="2020-01-01", end_time="2020-01-02")
+
+    assert df["u1"].tolist() == [1.5]
+    assert len(FlakyHandler.headers_seen) == 2
+    assert all(h["Authorization"] == "Bearer abc" for h in FlakyHandler.headers_seen)
+    assert FlakyHandler.headers_seen[0]["Connection"] == "keep-alive"
+
+
+def test_client_retries_are_instrumented(flaky_server):
+    from pyniva.instrument import add_request_hook, remove_request_hook
+
+    events = []
+    add_request_hook(events.append)
+    try:
+        with Client(tsb_host=flaky_server, backoff_factor=0) as client:
+            client.get_signals(["u2"], dt=0, start_time="2020-01-01", end_time="2020-01-02")
+    finally:
+        remove_request_hook(events.append)
+
+    assert len(events) == 1 and events[0].retries == 1 and events[0].status == 200
+
+
+class WriteHandler(BaseHTTPRequestHandler):
+    """Answers PUT requests with the queued status codes, then 200"""
+
+    statuses = []
+    puts = 0
+
+    def do_PUT(self):
+        WriteHandler.puts += 1
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status = self.statuses.pop(0) if self.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_client_retries_writes_only_if_not_processed():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WriteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/meta/"
+    try:
+        with Client(meta_host=url, backoff_factor=0) as client:
+            WriteHandler.statuses[:] = [500]
+            assert client.put(url, data="{}").status_code == 500
+            assert WriteHandler.puts == 1
+
+            WriteHandler.statuses[:] = [503, 429]
+            assert client.put(url, data="{}").status_code == 200
+            assert WriteHandler.puts == 4
+    finally:
+        server.shutdown()
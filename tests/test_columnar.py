@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyniva import Vessel, get_ship_data
+from pyniva.tsb import get_signals, ts_list2df
+
+from .standin import StandInServer, path2uuid
+
+pa = pytest.importorskip("pyarrow")
+pl = pytest.importorskip("polars")
+
+from pyniva.columnar import ts_list2polars, ts_list2table  # noqa: E402
+
+ROWS = [
+    {"time": "2020-01-01T00:00:00Z", "longitude": 11.8, "latitude": 56.7, "a": 1.5, "flag": 1, "s": "x"},
+    {"time": "2020-01-01T00:00:01.5Z", "a": None, "flag": None, "s": "x"},
+    {"time": "2020-01-01T00:00:02Z", "b": 3.0, "flag": -1, "s": "y"},
+]
+PATHS = ["SYNTH_FA/ferrybox/CTD/TEMPERATURE", "SYNTH_FA/ferrybox/CTD/SALINITY"]
+
+
+def _as_pandas(frame):
+    """Time indexed pandas DataFrame from an Arrow table or Polars frame"""
+    df = frame.to_pandas()
+    return df.set_index("time") if "time" in df.columns else df
+
+
+def test_ts_list2table_and_polars():
+    expected = ts_list2df(ROWS)
+    table = ts_list2table(ROWS)
+    frame = ts_list2polars(ROWS)
+
+    assert table.column_names == ["time"] + list(expected.columns) == frame.columns
+    assert table.schema.field("time").type == pa.timestamp(expected.index.unit, tz="UTC")
+    assert table["flag"].type == pa.int64() and table["flag"].null_count == 1
+    assert frame["flag"].dtype == pl.Int64 and frame["time"].dtype.time_zone == "UTC"
+    for df in (_as_pandas(table), _as_pandas(frame)):
+        pd.testing.assert_index_equal(df.index, expected.index, check_names=False)
+        np.testing.assert_array_equal(df["a"].to_numpy(float), expected["a"].to_numpy())
+
+    compact = ts_list2table(ROWS, dtypes="compact")
+    assert compact["a"].type == pa.float32() and compact["longitude"].type == pa.float64()
+    assert compact["flag"].type == pa.int8() and pa.types.is_dictionary(compact["s"].type)
+    compact = ts_list2polars(ROWS, dtypes="compact")
+    assert compact["a"].dtype == pl.Float32 and compact["flag"].dtype == pl.Int8
+    assert compact["s"].dtype == pl.Categorical
+
+
+@pytest.mark.parametrize("output", ["arrow", "polars"])
+def test_get_signals_output(output):
+    uuids = [path2uuid(p) for p in PATHS]
+    kwargs = dict(start_time="2000-01-01", end_time="2100-01-01", dt=0)
+    with StandInServer() as server:
+        expected = get_signals(server.tsb_url, uuids, **kwargs)
+        frame = get_signals(server.tsb_url, uuids, output=output, **kwargs)
+        shard = dict(start_time="2018-12-16T21:00:00Z", end_time="2018-12-16T23:00:00Z", dt=60,
+                     window="PT10M", max_workers=2)
+        sharded = get_signals(server.tsb_url, uuids, output=output, **shard)
+        reference = get_signals(server.tsb_url, uuids, **shard)
+        vessel = Vessel.get_thing(server.meta_url, path="SYNTH_FA")
+        ts = vessel.get_all_tseries(server.meta_url).by_path(PATHS[0])
+        named = ts.get_tseries(server.tsb_url, output=output, **kwargs)
+        empty = get_signals(server.tsb_url, uuids, output=output, start_time="1990-01-01",
+                            end_time="1990-01-02", dt=0)
+
+    pd.testing.assert_frame_equal(_as_pandas(frame), expected, check_names=False)
+    pd.testing.assert_frame_equal(_as_pandas(sharded), reference, check_names=False)
+    assert list(named.to_pandas().columns) == ["time", PATHS[0]]
+    assert len(empty) == 0
+
+
+@pytest.mark.parametrize("output", ["arrow", "polars"])
+def test_get_ship_data_output(output):
+    with StandInServer() as server:
+        kwargs = dict(header=None, pub_tsb=server.tsb_url, meta_host=server.meta_url)
+        for noqc in (True, False):
+            expected = get_ship_data("SYNTH_FA", list(PATHS), "2000-01-01", "2100-01-01", noqc, **kwargs)
+            frame = get_ship_data("SYNTH_FA", list(PATHS), "2000-01-01", "2100-01-01", noqc,
+                                  output=output, **kwargs)
+            df = frame.to_pandas()
+            assert list(df.columns) == list(expected.columns)
+            pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+
+def test_iter_ship_data_polars():
+    from pyniva.request_dataframe import iter_ship_data
+
+    start, end = "2018-12-16T21:00:00Z", "2018-12-16T23:00:00Z"
+    with StandInServer() as server:
+        kwargs = dict(header=None, pub_tsb=server.tsb_url, meta_host=server.meta_url)
+        expected = get_ship_data("SYNTH_FA", list(PATHS), start, end, True, **kwargs)
+        chunks = list(iter_ship_data("SYNTH_FA", PATHS, start, end, True, window="PT10M",
+                                     output="polars", **kwargs))
+
+    columns = ["time", "longitude", "latitude"] + PATHS
+    assert len(chunks) > 3 and all(c.columns == columns for c in chunks)
+    df = pl.concat(chunks).to_pandas()
+    pd.testing.assert_frame_equal(df, expected[columns], check_dtype=False)
@@ -45,3 +45,22 @@ def test_tsb_for_newly_populated_data(populate_database):
     new_data = pyniva.get_newly_inserted_data(start, end, aggregate=False, meta_host=META_URL, ts_host=TSB_URL)
     assert len(new_data) == 1326  # 1326 new pieces of data in total
     assert all(key in new_data[0] for key in ["created_timestamp", "time", "uuid", "path"])
+
+
+def test_newly_inserted_data_standin():
+    """Same checks as above against the local stand-in server"""
+    from pyniva.metaflow import UuidPathMap
+    from .standin import StandInServer
+
+    start = dt.datetime.utcnow()-dt.timedelta(hours=1)
+    end = dt.datetime.utcnow()+dt.timedelta(hours=1)
+    with StandInServer(latency=0.001) as server:
+        new_data = pyniva.get_newly_inserted_data(start, end, aggregate=True, meta_host=server.meta_url,
+                                                  ts_host=server.tsb_url, path_map=UuidPathMap())
+        assert len(new_data) == 26
+        assert all(list(key in new_data[0] for key in ["count", "max", "min", "uuid", "path"]))
+
+        new_data = pyniva.get_newly_inserted_data(start, end, aggregate=False, meta_host=server.meta_url,
+                                                  ts_host=server.tsb_url, path_map=UuidPathMap())
+        assert len(new_data) == 1326
+        assert all(key in new_data[0] for key in ["created_timestamp", "time", "uuid", "path"])
@@ -0,0 +1,80 @@
+import pytest
+
+from pyniva import PyNIVAError, get_ship_data, instrument
+from pyniva.get_data import get_data
+from pyniva.instrument import (
+    add_request_hook,
+    remove_request_hook,
+    enable_metrics,
+    disable_metrics,
+)
+
+from .standin import StandInServer
+
+
+@pytest.fixture
+def events():
+    events = []
+    add_request_hook(events.append)
+    metrics = enable_metrics()
+    yield events, metrics
+    remove_request_hook(events.append)
+    disable_metrics()
+
+
+def test_request_events(events):
+    events, metrics = events
+    with StandInServer() as server:
+        df = get_ship_data(
+            "SYNTH_FA",
+            ["SYNTH_FA/ferrybox/CTD/TEMPERATURE"],
+            "2000-01-01",
+            "2100-01-01",
+            noqc=True,
+            header=None,
+            pub_tsb=server.tsb_url,
+            meta_host=server.meta_url,
+        )
+    assert not df.empty
+    assert {e.service for e in events} == {"metaflow", "tsb"}
+    assert len({e.trace_id for e in events}) == len(events) == len(metrics.events)
+    for e in events:
+        assert e.status == 200 and e.error is None and e.retries == 0
+        assert e.latency > 0 and e.decode_time > 0 and e.response_bytes > 0
+        assert metrics.find(e.trace_id) is e
+
+    summary = metrics.summary()
+    assert summary["metaflow /meta/"]["count"] >= 1
+    ts = [m for k, m in summary.items() if k.startswith("tsb")]
+    assert sum(m["count"] for m in ts) == sum(e.service == "tsb" for e in events)
+    assert all(sum(m["histogram"].values()) == m["count"] for m in summary.values())
+    assert metrics.slowest(1)[0].latency == max(e.latency for e in events)
+
+
+def test_request_event_errors(events):
+    events, metrics = events
+
+    def failing_hook(event):
+        raise RuntimeError("ignored")
+
+    add_request_hook(failing_hook)
+    try:
+        with StandInServer() as server:
+            with pytest.raises(PyNIVAError) as e:
+                get_data(server.url + "/unknown", params={"dt": 0})
+    finally:
+        remove_request_hook(failing_hook)
+
+    assert len(events) == 1 and events[0].trace_id == e.value.trace_id
+    assert events[0].status == 404 and isinstance(events[0].error, PyNIVAError)
+    assert metrics.summary()["tsb /unknown"]["errors"] == 1
+
+
+def test_remove_request_hook():
+    events = []
+    add_request_hook(events.append)
+    add_request_hook(print)
+    remove_request_hook(events.append)
+    assert instrument._request_hooks == (print,)
+    remove_request_hook(print)
+    assert instrument._request_hooks == ()
@@ -0,0 +1,257 @@
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+from pyniva import metaflow
+from pyniva.get_data import get_newly_inserted_data
+from pyniva.metaflow import MetaCache, get_thing
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class FakeMetaflow:
+    """Fake requests session serving a single vessel document"""
+
+    def __init__(self):
+        self.calls = []
+        self.name = "FA"
+
+    def get(self, url, params=None, headers=None):
+        self.calls.append(dict(params))
+        return FakeResponse({"t": [{"uuid": "v1", "path": "FA", "name": self.name,
+                                    "ttype": "vessel"}]})
+
+
+@pytest.fixture
+def fake_metaflow():
+    yield FakeMetaflow()
+    metaflow.disable_meta_cache()
+
+
+def test_get_thing_meta_cache(fake_metaflow):
+    cache = MetaCache(ttl=60)
+    first = get_thing("http://meta/", {"path": "FA"}, session=fake_metaflow, cache=cache)
+    first["name"] = "changed by caller"
+    second = get_thing("http://meta", {"path": "FA"}, session=fake_metaflow, cache=cache)
+    assert len(fake_metaflow.calls) == 1
+    assert second["name"] == "FA"
+
+    cache.invalidate("http://meta/")
+    get_thing("http://meta/", {"path": "FA"}, session=fake_metaflow, cache=cache)
+    assert len(fake_metaflow.calls) == 2
+
+
+def test_meta_cache_lru_and_stale_while_revalidate(fake_metaflow):
+    cache = MetaCache(ttl=0, stale_ttl=60, maxsize=1)
+    get_thing("http://meta/", {"path": "FA"}, session=fake_metaflow, cache=cache)
+    fake_metaflow.name = "renamed"
+    stale = get_thing("http://meta/", {"path": "FA"}, session=fake_metaflow, cache=cache)
+    assert stale["name"] == "FA"
+    for _ in range(100):
+        if len(fake_metaflow.calls) == 2 and not cache._refreshing:
+            break
+        time.sleep(0.01)
+    assert cache.get(cache.key("http://meta/", {"path": "FA"}))[0]["name"] == "renamed"
+
+    get_thing("http://meta/", {"path": "FB"}, session=fake_metaflow, cache=cache)
+    assert cache.get(cache.key("http://meta/", {"path": "FA"})) == (None, False)
+
+
+def test_meta_cache_on_disk(fake_metaflow, tmp_path):
+    metaflow.enable_meta_cache(directory=tmp_path)
+    get_thing("http://meta/", {"path": "FA"}, session=fake_metaflow)
+    # A new cache (e.g. a new process) reads the persisted entry
+    metaflow.enable_meta_cache(directory=tmp_path)
+    assert get_thing("http://meta/", {"path": "FA"}, session=fake_metaflow)["uuid"] == "v1"
+    assert len(fake_metaflow.calls) == 1
+
+    # Stored as JSON, invalidated per host without reading the files
+    other = get_thing("http://other/", {"path": "FA"}, session=fake_metaflow)
+    [c_file] = [f for f in tmp_path.iterdir() if "http://other" in f.read_text()]
+    assert json.loads(c_file.read_text())["value"] == other
+    metaflow.invalidate_meta_cache("http://meta/")
+    assert list(tmp_path.iterdir()) == [c_file]
+
+
+def test_meta_cache_keyed_on_authorization(fake_metaflow):
+    cache = MetaCache(ttl=60)
+    for token in ("a", "b", "a"):
+        get_thing("http://meta/", {"path": "FA"}, header={"Authorization": f"Bearer {token}"},
+                  session=fake_metaflow, cache=cache)
+    assert len(fake_metaflow.calls) == 2
+    key = cache.key("http://meta/", {"path": "FA"}, {"authorization": "Bearer a"})
+    assert "Bearer a" not in key and cache.get(key)[0]["uuid"] == "v1"
+
+
+def test_meta_cache_disk_bounds(fake_metaflow, tmp_path):
+    cache = MetaCache(ttl=60, directory=tmp_path, max_files=2)
+    for path in ("FA", "FB", "FC"):
+        get_thing("http://meta/", {"path": path}, session=fake_metaflow, cache=cache)
+        time.sleep(0.01)
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # Expired entries are removed from disk
+    expired = MetaCache(ttl=0, directory=tmp_path)
+    time.sleep(0.01)
+    assert expired.get(expired.key("http://meta/", {"path": "FC"})) == (None, False)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # The directory is pruned once per max_files // 8 writes
+    cache = MetaCache(ttl=60, directory=tmp_path, max_files=16)
+    for i in range(17):
+        cache.set(cache.key("http://meta/", {"path": f"F{i}"}), {"uuid": str(i)})
+    assert len(list(tmp_path.iterdir())) == 17
+    cache.set(cache.key("http://meta/", {"path": "F17"}), {"uuid": "17"})
+    assert len(list(tmp_path.iterdir())) == 16
+
+
+class FakeTree(FakeMetaflow):
+    """Fake metaflow with a vessel holding n time series"""
+
+    def __init__(self, n):
+        super().__init__()
+        self.series = [
+            {"uuid": f"{i:08d}-0000-0000-0000-000000000000", "path": f"FA/S{i}",
+             "ttype": "tseries"}
+            for i in range(n)
+        ]
+
+    def get(self, url, params=None, headers=None):
+        self.calls.append(dict(params))
+        if "path" in params:
+            return FakeResponse({"t": [{"uuid": "v1", "path": "FA", "ttype": "vessel"}]})
+        if "parts" in params:
+            tree = {"uuid": "v1", "path": "FA", "ttype": "vessel",
+                    "parts": [{"uuid": "c1", "ttype": "component", "parts": self.series}]}
+            return FakeResponse({"t": tree})
+        uuids = params["uuid"].split(",")
+        # Reverse order, the result must not depend on the response order
+        return FakeResponse({"t": [s for s in self.series[::-1] if s["uuid"] in uuids]})
+
+
+def test_path2all_ts_batches_uuid_lookups():
+    fake = FakeTree(200)
+    ts = metaflow.path2all_ts("http://meta/", "FA", session=fake)
+
+    assert [t["path"] for t in ts] == [s["path"] for s in fake.series]
+    batch_calls = fake.calls[2:]
+    assert 1 < len(batch_calls) < 10
+    for params in batch_calls:
+        assert len("http://meta/?uuid=") + len(params["uuid"].replace(",", "%2C")) <= 2000
+
+
+class FakeInsertLog(FakeMetaflow):
+    """Fake session serving the tsb insert log and metaflow uuid queries"""
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+        self.headers = {}
+        self.unknown = set()
+
+    def get(self, url, params=None, headers=None):
+        self.calls.append((url, dict(params)))
+        if url.endswith("time-series-by-insert-time"):
+            return FakeResponse(self.rows)
+        return FakeResponse({"t": [{"uuid": u, "path": f"V/{u}"}
+                                   for u in params["uuid"].split(",") if u not in self.unknown]})
+
+
+def test_get_newly_inserted_data_reuses_paths(tmp_path):
+    rows = [{"created_timestamp": "2020-01-01T00:00:00Z", "time": "2020-01-01T00:00:00Z",
+             "uuid": u, "value": float(i)} for i, u in enumerate(["a", "b", "a"])]
+    session = FakeInsertLog(rows)
+    path_map = metaflow.UuidPathMap(directory=tmp_path)
+    headers = {"Authorization": "token"}
+
+    def _insertions(**kwargs):
+        return get_newly_inserted_data(datetime(2020, 1, 1), datetime(2020, 1, 2), False,
+                                       "http://meta/", "http://tsb/", headers=headers,
+                                       session=session, path_map=path_map, **kwargs)
+
+    data = _insertions()
+    assert [row["path"] for row in data] == ["V/a", "V/b", "V/a"]
+    assert headers == {"Authorization": "token"}
+
+    rows.append({**rows[0], "uuid": "c"})
+    df = _insertions(as_frame=True)
+    assert df["path"].dtype == "category"
+    assert df["path"].tolist() == ["V/a", "V/b", "V/a", "V/c"]
+    meta_calls = [params for url, params in session.calls if url == "http://meta/"]
+    assert meta_calls == [{"uuid": "a,b"}, {"uuid": "c"}]
+
+    # The persisted mapping is reused by a new session
+    assert metaflow.UuidPathMap(directory=tmp_path).resolve("http://meta", ["c"]) == {"c": "V/c"}
+
+    # Without a path_map the paths are not kept between calls
+    n_calls = len(session.calls)
+    get_newly_inserted_data(datetime(2020, 1, 1), datetime(2020, 1, 2), False,
+                            "http://meta/", "http://tsb/", session=session)
+    assert session.calls[n_calls + 1:] == [("http://meta/", {"uuid": "a,b,c"})]
+
+
+def test_get_newly_inserted_data_unknown_uuid():
+    session = FakeInsertLog([{"time": "2020-01-01T00:00:00Z", "uuid": u, "value": 1.0}
+                             for u in ("a", "gone")])
+    session.unknown.add("gone")
+    with pytest.raises(KeyError, match="gone"):
+        get_newly_inserted_data(datetime(2020, 1, 1), datetime(2020, 1, 2), False,
+                                "http://meta/", "http://tsb/", session=session)
+
+
+def test_uuid_path_map_lru(tmp_path):
+    session = FakeInsertLog([])
+    path_map = metaflow.UuidPathMap(directory=tmp_path, maxsize=2)
+    path_map.resolve("http://meta/", ["a", "b"], session=session)
+    path_map.resolve("http://meta/", ["a"], session=session)
+    path_map.resolve("http://meta/", ["c"], session=session)
+    assert len(path_map) == 2
+    # b was least recently used
+    restored = metaflow.UuidPathMap(directory=tmp_path)
+    assert len(restored) == 2 and restored.resolve("http://meta", ["a", "c"]) == {
+        "a": "V/a", "c": "V/c"}
+
+
+def _chain(depth):
+    """Tree of nested components with a time series at every level"""
+    top = node = {"path": "V", "ttype": "vessel"}
+    for i in range(depth):
+        ts = {"path": f"{node['path']}/TS", "ttype": "tseries"}
+        child = {"path": f"{node['path']}/C{i}", "ttype": "component"}
+        node["parts"] = [ts, child]
+        node = child
+    return top
+
+
+def test_walk_tree_order_and_filters():
+    tree = _chain(3)
+    post = [n["path"] for n in metaflow.walk_tree(tree)]
+    assert post[0] == "V/TS" and post[-1] == "V"
+    pre = [n["path"] for n in metaflow.walk_tree(tree, postorder=False)]
+    assert pre[:3] == ["V", "V/TS", "V/C0"] and sorted(pre) == sorted(post)
+
+    assert [n["path"] for n in metaflow.thing_tree2ts(tree)] == [
+        "V/TS", "V/C0/TS", "V/C0/C1/TS"]
+    assert [n["path"] for n in metaflow.thing_tree2ts(tree, max_depth=1)] == ["V/TS"]
+    assert [n["path"] for n in metaflow.walk_tree(
+        tree, ttypes={"component"}, path_filter=lambda p: p.endswith("C1"))] == ["V/C0/C1"]
+    assert [n["path"] for n in metaflow.walk_tree(tree, min_depth=1, max_depth=1)] == [
+        "V/TS", "V/C0"]
+
+
+def test_walk_tree_deep():
+    tree = _chain(5000)
+    assert sum(1 for _ in metaflow.thing_tree2ts(tree)) == 5000
+    first = next(metaflow.walk_tree(tree, postorder=False, min_depth=1))
+    assert first["path"] == "V/TS"
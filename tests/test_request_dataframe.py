@@ -0,0 +1,179 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyniva import request_dataframe
+from pyniva.request_dataframe import get_ship_data
+
+
+class FakeSignal:
+    """Stand-in for a TimeSeries instance returning a fixed frame"""
+
+    def __init__(self, path, df=None, error=None, delay=0.0):
+        self.path = path
+        self._df = df
+        self._error = error
+        self._delay = delay
+
+    def get_tseries(self, ts_host, session=None, **kwargs):
+        time.sleep(self._delay)
+        if self._error is not None:
+            raise self._error
+        return self._df.copy()
+
+
+def _frame(column, times, values):
+    index = pd.DatetimeIndex(pd.to_datetime(times, utc=True), name="time")
+    return pd.DataFrame({column: values}, index=index)
+
+
+@pytest.fixture
+def fake_vessel(monkeypatch):
+    times = ["2020-01-01T00:00:00", "2020-01-01T00:01:00", "2020-01-01T00:02:00"]
+    gps = _frame("longitude", times, [10.0, 10.1, 10.2])
+    gps["latitude"] = [59.0, 59.1, 59.2]
+    signals = [
+        FakeSignal("V/gpstrack", gps, delay=0.02),
+        FakeSignal("V/A", _frame("V/A", times[1:], [1.0, 2.0]), delay=0.03),
+        FakeSignal("V/B", _frame("V/B", times[:2], [3.0, 4.0]), delay=0.01),
+        FakeSignal("V/EMPTY", pd.DataFrame()),
+        FakeSignal("V/BROKEN", error=RuntimeError("boom")),
+    ]
+    paths = [s.path for s in signals]
+    monkeypatch.setattr(
+        request_dataframe,
+        "get_paths_measurements",
+        lambda *args, **kwargs: (signals, paths),
+    )
+
+
+def _ship_data(**kwargs):
+    return get_ship_data(
+        "V",
+        ["V/A", "V/B", "V/EMPTY", "V/BROKEN"],
+        "2020-01-01T00:00:00",
+        "2020-01-01T01:00:00",
+        noqc=False,
+        header={},
+        **kwargs,
+    )
+
+
+def test_get_ship_data_concurrent_matches_sequential(fake_vessel):
+    sequential, seq_errors = _ship_data(return_errors=True)
+    concurrent, errors = _ship_data(max_workers=4, return_errors=True)
+
+    pd.testing.assert_frame_equal(sequential, concurrent)
+    assert list(concurrent.columns) == ["time", "V/A", "V/B", "longitude", "latitude", "V/EMPTY"]
+    assert np.isnan(concurrent["V/A"].iloc[0])
+    assert list(errors) == list(seq_errors) == ["V/BROKEN"]
+    assert isinstance(errors["V/BROKEN"], RuntimeError)
+
+
+class FakeSpectra(FakeSignal):
+    """Long format spectral data, one spectrum per minute"""
+
+    TTYPE = "spectra"
+
+    def get_tseries(self, ts_host, session=None, start_time=None, end_time=None, **kwargs):
+        times = pd.date_range(pd.Timestamp(start_time, tz="UTC").ceil("min"),
+                              pd.Timestamp(end_time, tz="UTC"), freq="min", name="time")
+        wl = np.array([400.0, 500.0, 450.0])
+        index = times.repeat(len(wl))
+        wls = np.tile(wl, len(times))
+        minutes = (index - pd.Timestamp("2020-01-01", tz="UTC")).total_seconds() / 60
+        return pd.DataFrame({"wl": wls, "value": minutes + wls / 1000}, index=index)
+
+
+class FakeRamsesSignal(FakeSignal):
+    TTYPE = "tseries"
+
+    def get_tseries(self, ts_host, session=None, start_time=None, end_time=None, **kwargs):
+        times = pd.date_range(pd.Timestamp(start_time, tz="UTC").ceil("5min"),
+                              pd.Timestamp(end_time, tz="UTC"), freq="5min", name="time")
+        return pd.DataFrame({self.path: np.ones(len(times))}, index=times)
+
+
+def test_get_ramses_data_slices(monkeypatch):
+    signals = [FakeSpectra("V/RAMSES/RRS"), FakeRamsesSignal("V/RAMSES/PAR")]
+    paths = [s.path for s in signals]
+    monkeypatch.setattr(request_dataframe, "get_paths_measurements",
+                        lambda *args, **kwargs: (signals, paths))
+
+    def _ramses(**kwargs):
+        return request_dataframe.get_ramses_data(
+            "V", paths, "2020-01-01T00:00:00", "2020-01-02T06:00:00",
+            noqc=False, header={}, **kwargs)
+
+    sliced = _ramses()
+    sequential = _ramses(max_workers=1)
+    single = _ramses(period=pd.Timedelta(days=2).to_pytimedelta())
+
+    pd.testing.assert_frame_equal(sliced, single)
+    pd.testing.assert_frame_equal(sliced, sequential)
+    assert sliced.index.is_unique and len(sliced) == 30 * 60 + 1
+    assert list(sliced.columns) == [400.0, 450.0, 500.0, "V/RAMSES/PAR"]
+
+
+def test_get_ship_data_profile():
+    from pyniva import instrument
+    from pyniva.profiling import StageProfiler
+    from .standin import StandInServer
+
+    profiler = StageProfiler(trace_memory=True)
+    paths = ["SYNTH_FA/ferrybox/CTD/TEMPERATURE", "SYNTH_FA/ferrybox/CTD/SALINITY"]
+    with StandInServer() as server:
+        df = get_ship_data("SYNTH_FA", list(paths), "2000-01-01", "2100-01-01", noqc=True,
+                           header=None, pub_tsb=server.tsb_url, meta_host=server.meta_url,
+                           max_workers=2, profile=profiler)
+
+    stages = profiler.to_frame()
+    assert stages["name"].tolist()[:2] == ["metaflow", "download"]
+    assert stages["name"].tolist()[-2:] == ["align", "finalize"]
+    per_path = stages[stages["path"].notna()].set_index("path")
+    assert sorted(per_path.index) == sorted(paths + ["SYNTH_FA/gpstrack"])
+    assert (per_path["requests"] == 1).all() and (per_path["rows"] > 0).all()
+    assert (per_path["network_s"] > 0).all() and (per_path["seconds"] >= per_path["network_s"]).all()
+    assert stages.set_index("name").loc["metaflow", "requests"] >= 1
+    finalize = stages.iloc[-1]
+    assert finalize["rows"] == len(df) and finalize["peak_mib"] > 0
+    assert "finalize" in profiler.format()
+    # The profiler's request hook is removed when the call returns
+    assert instrument._request_hooks == ()
+
+
+def test_get_ship_data_compact_dtypes():
+    from .standin import StandInServer
+
+    paths = ["SYNTH_FA/ferrybox/CTD/TEMPERATURE", "SYNTH_FA/ferrybox/CTD/SALINITY"]
+    with StandInServer() as server:
+        kwargs = dict(noqc=True, header=None, pub_tsb=server.tsb_url, meta_host=server.meta_url)
+        default = get_ship_data("SYNTH_FA", list(paths), "2000-01-01", "2100-01-01", **kwargs)
+        compact = get_ship_data("SYNTH_FA", list(paths), "2000-01-01", "2100-01-01",
+                                dtypes="compact", **kwargs)
+
+    assert list(compact.columns) == list(default.columns)
+    assert (compact[paths].dtypes == np.float32).all()
+    assert compact["latitude"].dtype == np.float64
+    np.testing.assert_allclose(compact[paths].to_numpy(np.float64), default[paths].to_numpy(), rtol=1e-6)
+    assert compact.memory_usage().sum() < default.memory_usage().sum()
+
+
+def test_iter_ship_data_chunks():
+    from pyniva.request_dataframe import iter_ship_data
+    from .standin import StandInServer
+
+    paths = ["SYNTH_FA/ferrybox/CTD/TEMPERATURE", "SYNTH_FA/ferrybox/CTD/SALINITY"]
+    start, end = "2018-12-16T21:00:00Z", "2018-12-16T23:00:00Z"
+    with StandInServer() as server:
+        kwargs = dict(header=None, pub_tsb=server.tsb_url, meta_host=server.meta_url)
+        expected = get_ship_data("SYNTH_FA", list(paths), start, end, noqc=True, **kwargs)
+        chunks = list(iter_ship_data("SYNTH_FA", paths, start, end, True, window="PT10M",
+                                     max_workers=2, **kwargs))
+
+    columns = ["time", "longitude", "latitude"] + paths
+    assert len(chunks) > 3 and all(list(c.columns) == columns for c in chunks)
+    df = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(df, expected[columns])
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from pyniva import SpectralData
+
+
+def _long_frame():
+    times = pd.date_range("2020-01-01", periods=4, freq="min", tz="UTC", name="time")
+    wl = np.array([400.0, 500.0, 450.0, 550.0])
+    index = times.repeat(len(wl))
+    wls = np.tile(wl, len(times))
+    return pd.DataFrame({"wl": wls, "value": np.arange(len(index)) + wls}, index=index)
+
+
+def test_from_long_matches_pivot():
+    long_df = _long_frame()
+    expected = long_df.reset_index().pivot(index="time", columns="wl", values="value")
+    spectra = SpectralData.from_long(long_df)
+
+    pd.testing.assert_frame_equal(spectra.to_frame(), expected)
+    assert SpectralData.from_long(long_df, dtype=np.float32).values.dtype == np.float32
+
+
+def test_from_long_integer_wavelengths():
+    long_df = _long_frame().astype({"wl": np.int64})
+    expected = long_df.reset_index().pivot(index="time", columns="wl", values="value")
+    spectra = SpectralData.from_long(long_df)
+
+    assert spectra.wavelengths.dtype == np.int64
+    pd.testing.assert_frame_equal(spectra.to_frame(), expected)
+    assert list(spectra.to_frame().columns) == [400, 450, 500, 550]
+    assert list(spectra.sel(wl_min=450, wl_max=500).wavelengths) == [450, 500]
+
+
+def test_sel_is_a_view():
+    spectra = SpectralData.from_long(_long_frame())
+    band = spectra.sel(start_time="2020-01-01T00:01", end_time="2020-01-01T00:02",
+                       wl_min=450, wl_max=500)
+
+    assert band.shape == (2, 2)
+    assert list(band.wavelengths) == [450.0, 500.0]
+    assert np.shares_memory(band.values, spectra.values)
+
+
+def test_interpolate_and_bin():
+    time = pd.DatetimeIndex(["2020-01-01", "2020-01-02"], tz="UTC")
+    spectra = SpectralData(np.array([[0.0, 10.0, 20.0], [1.0, np.nan, 3.0]]),
+                           [400.0, 410.0, 420.0], time)
+
+    interp = spectra.interpolate([395.0, 400.0, 405.0, 415.0, 425.0])
+    np.testing.assert_allclose(interp.values[0], [np.nan, 0.0, 5.0, 15.0, np.nan])
+    assert interp.values[1, 1] == 1.0
+
+    binned = spectra.bin([400.0, 415.0, 430.0])
+    np.testing.assert_allclose(binned.wavelengths, [407.5, 422.5])
+    np.testing.assert_allclose(binned.values, [[5.0, 20.0], [1.0, 3.0]])
@@ -0,0 +1,131 @@
+import datetime as dt
+import os
+
+import pandas as pd
+import pytest
+
+from pyniva import sync
+from pyniva.sync import InsertTimeSync
+
+T0 = pd.Timestamp("2020-01-01T00:00:00Z")
+
+
+class FakeInsertLog:
+    """Fake tsb insert log, rows are (created, time, uuid, value)"""
+
+    def __init__(self):
+        self.rows = []
+        self.calls = []
+
+    def insert(self, created_min, time_min, c_uuid, value):
+        self.rows.append((T0 + pd.Timedelta(minutes=created_min),
+                          T0 + pd.Timedelta(minutes=time_min), c_uuid, value))
+
+    def __call__(self, start_time, end_time, aggregate, meta_host, ts_host, headers=None,
+                 session=None, path_map=None, as_frame=False):
+        self.calls.append((start_time, end_time))
+        df = pd.DataFrame(
+            [(c, t, u, v, f"V/{u}") for c, t, u, v in self.rows if start_time <= c <= end_time],
+            columns=["created_timestamp", "time", "uuid", "value", "path"],
+        )
+        return df.astype({"uuid": "category", "path": "category"})
+
+
+@pytest.fixture
+def insert_log(monkeypatch):
+    log = FakeInsertLog()
+    monkeypatch.setattr(sync, "get_newly_inserted_data", log)
+    return log
+
+
+def _sync(tmp_path, **kwargs):
+    return InsertTimeSync(tmp_path, "http://meta/", "http://tsb/", start_time=T0,
+                          overlap=dt.timedelta(minutes=5), max_window=dt.timedelta(hours=1),
+                          **kwargs)
+
+
+def test_sync_upserts_late_rows(tmp_path, insert_log):
+    insert_log.insert(1, 0, "a", 1.0)
+    insert_log.insert(2, 1, "a", 2.0)
+    insert_log.insert(2, 1, "b", 5.0)
+    store = _sync(tmp_path)
+    assert store.sync_once(end_time=T0 + pd.Timedelta(hours=2, minutes=30)) == 3
+    # Catch up in windows of max_window
+    assert len(insert_log.calls) == 3
+
+    # A late correction of an old row and a new row
+    insert_log.insert(160, 1, "a", 20.0)
+    insert_log.insert(161, 150, "a", 3.0)
+    store = _sync(tmp_path)
+    store.sync_once(end_time=T0 + pd.Timedelta(hours=3))
+
+    a = store.read(path="V/a")
+    assert a["value"].tolist() == [1.0, 20.0, 3.0]
+    assert a.index.is_monotonic_increasing
+    assert store.read(uuid="b")["value"].tolist() == [5.0]
+    assert store.watermark == T0 + pd.Timedelta(hours=3)
+
+
+def test_sync_resumes_after_crash(tmp_path, insert_log, monkeypatch):
+    insert_log.insert(1, 0, "a", 1.0)
+    insert_log.insert(1, 0, "b", 2.0)
+    store = _sync(tmp_path)
+
+    write = sync._atomic_write_frame
+
+    def failing_write(file_name, df):
+        if os.path.basename(os.path.dirname(file_name)) == "b":
+            raise OSError("disk full")
+        write(file_name, df)
+
+    monkeypatch.setattr(sync, "_atomic_write_frame", failing_write)
+    with pytest.raises(OSError):
+        store.sync_once(end_time=T0 + pd.Timedelta(minutes=30))
+    assert store.watermark == T0
+
+    monkeypatch.setattr(sync, "_atomic_write_frame", write)
+    store = _sync(tmp_path)
+    store.sync_once(end_time=T0 + pd.Timedelta(minutes=30))
+    assert store.read(uuid="a")["value"].tolist() == [1.0]
+    assert store.read(uuid="b")["value"].tolist() == [2.0]
+
+
+def test_sync_appends_segments_and_compacts(tmp_path, insert_log, monkeypatch):
+    store = _sync(tmp_path, max_segments=3)
+    written = []
+    write = sync._atomic_write_frame
+    def counting_write(file_name, df):
+        if not file_name.endswith(InsertTimeSync.OVERLAP_FILE):
+            written.append(len(df))
+        write(file_name, df)
+
+    monkeypatch.setattr(sync, "_atomic_write_frame", counting_write)
+
+    for i in range(4):
+        insert_log.insert(60 * i + 10, i, "a", float(i))
+        store.sync_once(end_time=T0 + pd.Timedelta(hours=i + 1))
+        assert store.read(uuid="a")["value"].tolist() == [float(j) for j in range(i + 1)]
+    # Each sync writes only its new rows, the fourth segment triggers a compaction
+    assert written == [1, 1, 1, 1, 4]
+    assert len(store._segments("a")) == 1
+
+
+def test_sync_skips_rows_stored_in_the_overlap(tmp_path, insert_log, monkeypatch):
+    written = []
+    write = sync._atomic_write_frame
+    monkeypatch.setattr(sync, "_atomic_write_frame",
+                        lambda file_name, df: written.append((file_name, len(df)))
+                        or write(file_name, df))
+
+    insert_log.insert(58, 0, "a", 1.0)
+    _sync(tmp_path).sync_once(end_time=T0 + pd.Timedelta(hours=1))
+    # Committed late, with an insert time in the overlap
+    insert_log.insert(57, 1, "a", 2.0)
+    insert_log.insert(61, 2, "a", 3.0)
+    store = _sync(tmp_path)
+    store.sync_once(end_time=T0 + pd.Timedelta(hours=2))
+
+    # Segments of one and two rows, the first row is not written again
+    segments = [n for f, n in written if not f.endswith(InsertTimeSync.OVERLAP_FILE)]
+    assert segments == [1, 2]
+    assert store.read(uuid="a")["value"].tolist() == [1.0, 2.0, 3.0]
@@ -0,0 +1,308 @@
+import copy
+import json
+import pickle
+
+import pytest
+
+from pyniva import Thing, Vessel, Sensor, TimeSeries, FlagTimeSeries, ThingIndex
+from pyniva.thing import ThingError, _fetched
+from pyniva.metaflow import thing_tree2ts, walk_tree
+
+TREE = {
+    "uuid": "v1",
+    "path": "FA",
+    "ttype": "vessel",
+    "owner": "NIVA",
+    "parts": [
+        {
+            "uuid": "t1",
+            "path": "FA/TS",
+            "name": "TS",
+            "ttype": "tseries",
+            "part_of": "v1",
+            "start_time": "2020-01-01T00:00:00Z",
+            "parts": [
+                {"uuid": "q1", "path": "FA/TS/QC", "ttype": "qctseries", "part_of": "t1"}
+            ],
+        }
+    ],
+}
+
+
+def test_thing_attributes():
+    vessel = Thing._thing_dispatch(copy.deepcopy(TREE))
+    assert isinstance(vessel, Vessel)
+    assert not hasattr(vessel, "__dict__")
+    assert vessel.name == "FA" and vessel.owner == "NIVA"
+    assert not hasattr(vessel, "missing")
+
+    vessel.owner = "someone"
+    vessel.note = "new"
+    assert vessel._meta_dict["owner"] == "someone" and vessel.note == "new"
+    del vessel.note
+    assert "note" not in vessel._meta_dict
+    assert "owner" in dir(vessel)
+
+    ts = TimeSeries(path="FA/X")
+    assert ts.name == "X" and ts.ttype == "tseries" and not hasattr(ts, "uuid")
+
+
+def test_lazy_parts():
+    vessel = Thing._thing_dispatch(copy.deepcopy(TREE))
+    assert isinstance(vessel._extra["parts"][0], dict)
+
+    ts = vessel.parts[0]
+    assert isinstance(ts, TimeSeries) and ts is vessel.parts[0]
+    assert ts.start_time.year == 2020
+    assert isinstance(ts.parts[0], FlagTimeSeries)
+
+
+def test_as_dict():
+    vessel = Thing._thing_dispatch(copy.deepcopy(TREE))
+    unmaterialized = vessel.as_dict()
+    vessel.parts[0].parts
+    materialized = vessel.as_dict()
+    assert unmaterialized == materialized
+    assert unmaterialized["parts"][0]["parts"][0]["name"] == "QC"
+    assert vessel.parts[0].as_dict()["parts"][0]["name"] == "QC"
+    assert vessel.as_dict(shallow=True)["parts"] == ["t1"]
+
+
+def test_pickle():
+    vessel = Thing._thing_dispatch(copy.deepcopy(TREE))
+    vessel.parts[0].parts
+    copied = pickle.loads(pickle.dumps(vessel))
+    assert isinstance(copied, Vessel)
+    assert copied.as_dict() == vessel.as_dict()
+    assert isinstance(copied.parts[0].parts[0], FlagTimeSeries)
+
+
+def _vessel_tree():
+    tree = copy.deepcopy(TREE)
+    tree["parts"].append({
+        "uuid": "c1", "path": "FA/C", "ttype": "component", "part_of": "v1",
+        "parts": [
+            {"uuid": "t2", "path": "FA/C/TEMP", "ttype": "tseries", "part_of": "c1"},
+            {"uuid": "g1", "path": "FA/C/gpstrack", "ttype": "gpstrack", "part_of": "c1"},
+        ],
+    })
+    tree["parts"].append({"uuid": "t3", "path": "FA/CC/TEMP", "ttype": "tseries"})
+    return tree
+
+
+def test_thing_index_from_tree():
+    vessel = Thing._thing_dispatch(_vessel_tree())
+    index = ThingIndex.from_tree(vessel)
+    tree_order = [ts["path"] for ts in thing_tree2ts(_vessel_tree())]
+
+    assert index.paths == tree_order
+    assert index.by_path("FA/C/TEMP") is index.by_uuid("t2")
+    assert index.get("FA/MISSING") is None and "FA/TS" in index and "t3" in index
+    assert index.by_path("FA/TS").parts[0] is index.by_path("FA/TS/QC")
+    assert [ts.path for ts in index.of_type("qctseries", "gpstrack")] == [
+        "FA/TS/QC", "FA/C/gpstrack"]
+
+
+def test_thing_index_queries():
+    index = ThingIndex.from_tree(_vessel_tree())
+
+    assert [ts.path for ts in index.prefix("FA/C")] == ["FA/C/TEMP", "FA/C/gpstrack"]
+    assert [ts.path for ts in index.prefix("FA/C", ttypes=["gpstrack"])] == ["FA/C/gpstrack"]
+    assert index.prefix("FA/X") == []
+    assert [ts.path for ts in index.glob("FA/*/TEMP")] == ["FA/C/TEMP", "FA/CC/TEMP"]
+    assert [ts.path for ts in index.glob("FA/**/QC")] == ["FA/TS/QC"]
+    assert [ts.path for ts in index.glob("**/TEMP")] == ["FA/C/TEMP", "FA/CC/TEMP"]
+    assert len(index.glob("FA/**")) == len(index)
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class FakeMetaflowPut:
+    """Fake requests session assigning uuids to saved documents"""
+
+    def __init__(self, fail_paths=()):
+        self.saved = {}
+        self.fail_paths = fail_paths
+
+    def put(self, url, data=None, headers=None):
+        doc = json.loads(data)
+        if doc["path"] in self.fail_paths:
+            raise RuntimeError("boom")
+        doc.setdefault("uuid", "u-" + doc["path"])
+        self.saved[doc["path"]] = doc
+        return FakeResponse({"t": doc})
+
+
+def _new_tree():
+    vessel = Vessel(path="NEW")
+    sensors = [Sensor(path=f"NEW/S{i}") for i in range(3)]
+    for i, sensor in enumerate(sensors):
+        sensor.parts = [TimeSeries(path=f"NEW/S{i}/TS{j}") for j in range(2)]
+    vessel.parts = sensors
+    return vessel
+
+
+def test_bulk_save():
+    session = FakeMetaflowPut()
+    saved = _new_tree().save("http://meta", session=session, max_workers=4)
+
+    assert len(session.saved) == 10
+    assert session.saved["NEW/S1/TS0"]["part_of"] == "u-NEW/S1"
+    assert "parts" not in session.saved["NEW"]
+    assert saved.uuid == "u-NEW" and isinstance(saved.parts[0], Sensor)
+    assert saved.parts[2].parts[1].uuid == "u-NEW/S2/TS1"
+
+
+def test_bulk_save_errors():
+    session = FakeMetaflowPut(fail_paths=["NEW/S1"])
+    saved, errors = _new_tree().save(
+        "http://meta", session=session, max_workers=4, return_errors=True
+    )
+
+    assert sorted(errors) == ["NEW/S1", "NEW/S1/TS0", "NEW/S1/TS1"]
+    assert isinstance(errors["NEW/S1"], RuntimeError)
+    assert len(session.saved) == 7 and saved.parts[0].uuid == "u-NEW/S0"
+    assert not hasattr(saved.parts[1], "uuid")
+    with pytest.raises(ThingError):
+        _new_tree().save("http://meta", session=session, max_workers=4)
+
+
+class FakeMetaflowTree(FakeMetaflowPut):
+    """Fake requests session serving a saved tree and deleting documents"""
+
+    def __init__(self, tree, fail_paths=()):
+        super().__init__(fail_paths)
+        self.tree = tree
+        self.gets = 0
+        self.deleted = []
+
+    def get(self, url, params=None, headers=None):
+        self.gets += 1
+        params = params or {}
+        top = self.tree
+        if "uuid" in params:
+            top = next(t for t in walk_tree(self.tree) if t["uuid"] == params["uuid"])
+        top = copy.deepcopy(top)
+        # Cut the tree at the requested depth
+        for node in walk_tree(top, min_depth=params.get("parts", 100),
+                              max_depth=params.get("parts", 100)):
+            node.pop("parts", None)
+        return FakeResponse({"t": top})
+
+    def delete(self, url, data=None, headers=None):
+        doc = json.loads(data)
+        if doc["path"] in self.fail_paths:
+            raise RuntimeError("boom")
+        self.deleted.append(doc["path"])
+        return FakeResponse({"t": doc})
+
+
+def test_delete_plan():
+    tree = _vessel_tree()
+    session = FakeMetaflowTree(tree)
+    vessel = Thing._thing_dispatch(copy.deepcopy(tree))
+    plan = vessel.delete("http://meta", session=session, dry_run=True)
+
+    assert [sorted(t.path for t in level) for level in plan] == [
+        ["FA/C/TEMP", "FA/C/gpstrack", "FA/CC/TEMP", "FA/TS/QC"],
+        ["FA/C", "FA/TS"],
+        ["FA"],
+    ]
+    assert plan[-1][0] is vessel and session.gets == 1 and session.deleted == []
+
+
+def test_delete_deep_tree():
+    tree = _vessel_tree()
+    session = FakeMetaflowTree(tree)
+    vessel = Thing._thing_dispatch(copy.deepcopy(tree))
+    plan = vessel._delete_plan("http://meta", None, session, levels=1)
+    # Each Thing at the cut depth is fetched again with its parts
+    assert session.gets == 7
+    assert [len(level) for level in plan] == [4, 2, 1]
+
+    vessel.parts = [TimeSeries(path="FA/X")]
+    deleted = vessel.delete("http://meta", session=session, recursive=False)
+    assert session.deleted == ["FA"] and deleted.uuid == "v1"
+
+
+def test_delete_concurrent():
+    tree = _vessel_tree()
+    session = FakeMetaflowTree(tree)
+    vessel = Thing._thing_dispatch(copy.deepcopy(tree))
+    deleted = vessel.delete("http://meta", session=session, max_workers=4)
+
+    assert session.gets == 1 and len(session.deleted) == 7
+    assert session.deleted[-1] == "FA" and set(session.deleted[-3:-1]) == {"FA/C", "FA/TS"}
+    assert isinstance(deleted, Vessel) and deleted.uuid == "v1"
+
+    session = FakeMetaflowTree(tree, fail_paths=["FA/TS/QC"])
+    with pytest.raises(ThingError):
+        vessel.delete("http://meta", session=session, max_workers=4)
+    assert "FA/TS" not in session.deleted and "FA" not in session.deleted
+
+
+def test_change_tracking():
+    vessel = _fetched(Thing._thing_dispatch(copy.deepcopy(TREE)))
+    ts = vessel.parts[0]
+    assert not vessel.is_new and not ts.is_new and TimeSeries(path="X").is_new
+    assert vessel.changes() == {} and ts.changed_fields == set()
+
+    vessel.owner = "NIVA"
+    vessel.update(name="FA2")
+    del vessel._meta_dict["owner"]
+    assert vessel.changes() == {"name": ("FA", "FA2"), "owner": ("NIVA", None)}
+    vessel.name = "FA"
+    assert vessel.changed_fields == {"owner"}
+
+    copied = pickle.loads(pickle.dumps(vessel))
+    assert copied.changed_fields == {"owner"} and not copied.parts[0].is_new
+    ts.mark_changed("start_time")
+    assert ts.changed_fields == {"start_time"}
+
+
+def test_save_skips_unchanged():
+    session = FakeMetaflowPut()
+    vessel = _fetched(Thing._thing_dispatch(_vessel_tree()))
+    vessel.parts[1].parts[0].unit = "C"
+    vessel.parts[1].parts.append(TimeSeries(path="FA/C/NEW"))
+
+    plan = vessel.save("http://meta", session=session, dry_run=True)
+    assert [d["path"] for d in plan] == ["FA/C/TEMP", "FA/C/NEW"]
+    assert plan[1]["part_of"] == "c1" and not hasattr(vessel.parts[1].parts[2], "part_of")
+    assert len(vessel.save("http://meta", dry_run=True, force=True)) == 8
+
+    saved = vessel.save("http://meta", session=session)
+    assert sorted(session.saved) == ["FA/C/NEW", "FA/C/TEMP"]
+    assert session.saved["FA/C/TEMP"]["unit"] == "C" and saved is vessel
+
+    session = FakeMetaflowPut()
+    vessel = _fetched(Thing._thing_dispatch(_vessel_tree()))
+    vessel.parts[2].name = "TEMP2"
+    vessel.save("http://meta", session=session, max_workers=4)
+    assert list(session.saved) == ["FA/CC/TEMP"]
+    assert vessel.save("http://meta", dry_run=True) == []
+
+
+def test_save_skips_unchanged_tseries():
+    session = FakeMetaflowTree(_vessel_tree())
+    vessel = _fetched(Thing._thing_dispatch(_vessel_tree()))
+    index = vessel.get_all_tseries("http://meta", session=session)
+    assert not any(ts.is_new for ts in index)
+
+    temp = index.by_path("FA/C/TEMP")
+    assert temp.save("http://meta", session=session) is temp
+    index.by_path("FA/TS").save("http://meta", session=session, max_workers=4)
+    assert session.saved == {}
+
+    temp.unit = "C"
+    temp.save("http://meta", session=session)
+    assert list(session.saved) == ["FA/C/TEMP"]
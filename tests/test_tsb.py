@@ -0,0 +1,325 @@
+import numpy as np
+import pandas as pd
+
+from pyniva import tsb
+from pyniva.cache import TimeSeriesCache
+from pyniva.tsb import align_frames, ts_list2df
+
+
+def test_ts_list2df_schema_and_dtypes():
+    rows = [
+        {"time": "2018-12-16T22:10:05.000000Z", "longitude": 11.8083, "latitude": 56.7064,
+         "a": 1.5, "flag": 1},
+        {"time": "2018-12-16T22:11:05.000000Z", "longitude": 11.8128, "latitude": 56.7115,
+         "flag": 0},
+        {"time": "2018-12-16T22:12:05.000000Z", "b": 3.0, "a": 2.5, "flag": -1},
+    ]
+    df = ts_list2df(rows)
+
+    assert df.index.name == "time"
+    assert isinstance(df.index, pd.DatetimeIndex)
+    assert list(df.columns) == ["longitude", "latitude", "a", "flag", "b"]
+    assert df["a"].dtype == np.float64
+    assert df["flag"].dtype == np.int64
+    assert np.isnan(df["a"].iloc[1])
+    assert np.isnan(df["longitude"].iloc[2])
+    assert df["b"].iloc[2] == 3.0
+
+
+def test_ts_list2df_mixed_int_float_and_non_numeric():
+    rows = [
+        {"time": "2020-01-01T00:00:00Z", "x": 1, "s": "a"},
+        {"time": "2020-01-01T00:00:01Z", "x": 2.5, "s": None},
+    ]
+    df = ts_list2df(rows)
+
+    assert df["x"].dtype == np.float64
+    assert df["x"].tolist() == [1.0, 2.5]
+    assert df["s"].iloc[0] == "a"
+
+
+def test_ts_list2df_bool_columns():
+    rows = [
+        {"time": "2020-01-01T00:00:00Z", "ok": True, "partial": True},
+        {"time": "2020-01-01T00:00:01Z", "ok": False, "partial": None},
+    ]
+    df = ts_list2df(rows)
+
+    assert df["ok"].dtype == bool and df["ok"].tolist() == [True, False]
+    assert df["partial"].dtype == object and df["partial"].tolist() == [True, None]
+
+
+def _frame(column, times, values):
+    index = pd.DatetimeIndex(pd.to_datetime(times, utc=True), name="time")
+    return pd.DataFrame({column: values}, index=index)
+
+
+def test_ts_list2df_compact_dtypes():
+    rows = [
+        {"time": "2020-01-01T00:00:00Z", "longitude": 11.8083, "latitude": 56.7064,
+         "a": 1.5, "flag": 1, "s": "x", "ok": True, "empty": None},
+        {"time": "2020-01-01T00:00:01Z", "a": 2.5, "flag": None, "s": "x", "ok": None},
+        {"time": "2020-01-01T00:00:02Z", "a": None, "flag": -1, "s": "y", "ok": False},
+    ]
+    df = ts_list2df(rows, dtypes="compact")
+    default = ts_list2df(rows)
+
+    assert df.index.equals(default.index)
+    assert df["longitude"].dtype == np.float64 and df["a"].dtype == np.float32
+    assert df["flag"].dtype == "Int8" and df["flag"].isna().tolist() == [False, True, False]
+    assert df["ok"].dtype == "boolean" and df["s"].dtype == "category"
+    assert df["empty"].dtype == np.float32
+    assert default["flag"].dtype == np.float64 and default["ok"].dtype == object
+
+    aligned = align_frames([df, ts_list2df(rows[:1], dtypes="compact")[["s"]].rename(columns={"s": "t"})])
+    assert aligned["flag"].dtype == "Int8" and aligned["t"].dtype == "category"
+    # As for cached frames, stored with the default types
+    converted = tsb._apply_dtypes(default, tsb.COMPACT_DTYPES)
+    assert converted.dtypes.equals(df.dtypes)
+    assert converted["flag"].isna().tolist() == [False, True, False]
+
+
+def test_parse_times_matches_pandas():
+    for times in (
+        ["2020-01-01T00:00:00Z", "2020-01-01T00:00:01.5Z"],
+        ["2020-01-01T00:00:00.123456789Z"],
+        ["2020-01-01T00:00:00", "2020-01-01T01:00:00"],
+        ["2020-01-01T01:00:00+01:00"],
+    ):
+        assert tsb._parse_times(times).equals(pd.to_datetime(times, format="ISO8601"))
+
+
+def test_align_frames_matches_outer_merge():
+    a = _frame("a", ["2020-01-01 00:00", "2020-01-01 00:02"], [1.0, 2.0])
+    b = _frame("b", ["2020-01-01 00:01", "2020-01-01 00:02", "2020-01-01 00:03"], [1, 2, 3])
+    c = _frame("c", ["2020-01-01 00:03", "2020-01-01 00:00"], [5.0, 4.0])
+
+    expected = a.merge(b, on="time", how="outer").merge(c, on="time", how="outer")
+    expected = expected.sort_values(by="time")
+    pd.testing.assert_frame_equal(align_frames([a, b, pd.DataFrame(), c]), expected)
+
+
+def test_align_frames_duplicate_timestamps():
+    a = _frame("a", ["2020-01-01 00:00", "2020-01-01 00:00", "2020-01-01 00:01"], [1.0, 2.0, 3.0])
+    b = _frame("b", ["2020-01-01 00:01"], [9.0])
+
+    assert align_frames([a, b])["a"].tolist() == [2.0, 3.0]
+    assert align_frames([a, b], keep="first")["a"].tolist() == [1.0, 3.0]
+    assert align_frames([]).empty
+
+    output = tsb._output()
+    assert output.align([a, b], keep="first")["a"].tolist() == [1.0, 3.0]
+    renamed = output.rename(a, {"a": "x"})
+    assert list(renamed.columns) == ["x"] and list(a.columns) == ["a"]
+
+
+def _fake_tsb(calls):
+    """Fake get_data serving one raw row per minute, end points inclusive"""
+    base = pd.Timestamp("2020-01-01T00:00:00Z")
+
+    def get_data(url, params=None, headers=None, session=None):
+        calls.append(params)
+        start = pd.Timestamp(params["start"])
+        start = start.tz_localize("UTC") if start.tz is None else start
+        end = pd.Timestamp(params["end"])
+        end = end.tz_localize("UTC") if end.tz is None else end
+        times = pd.date_range(start.ceil("min"), end.floor("min"), freq="min")
+        if params.get("agg_type") == "count":
+            return [{"time": start.isoformat(), params["uuid"]: len(times)}]
+        return [
+            {"time": t.isoformat(), params["uuid"]: float((t - base).total_seconds())}
+            for t in times
+        ]
+
+    return get_data
+
+
+def test_get_signals_sharded_matches_single_request(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tsb, "get_data", _fake_tsb(calls))
+    query = dict(start_time="2020-01-01T00:00:00", end_time="2020-01-01T10:00:00", dt=0)
+
+    single = tsb.get_signals("http://tsb/", ["u1"], **query)
+    assert len(calls) == 1
+
+    by_window = tsb.get_signals("http://tsb/", ["u1"], window="PT1H", **query)
+    assert len(calls) == 11
+    pd.testing.assert_frame_equal(single, by_window)
+
+    by_rows = tsb.get_signals("http://tsb/", ["u1"], max_rows=100, max_workers=2, **query)
+    # One count query and seven data windows
+    assert calls[11]["agg_type"] == "count"
+    assert len(calls) == 11 + 1 + 7
+    pd.testing.assert_frame_equal(single, by_rows)
+
+
+def test_get_signals_not_sharded_without_dt(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tsb, "get_data", _fake_tsb(calls))
+    tsb.get_signals(
+        "http://tsb/", ["u1"], window=3600,
+        start_time="2020-01-01T00:00:00", end_time="2020-01-01T10:00:00",
+    )
+    assert len(calls) == 1
+
+
+def test_get_signals_cache_fetches_missing_ranges(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr(tsb, "get_data", _fake_tsb(calls))
+    cache = TimeSeriesCache(tmp_path)
+
+    def query(start, end):
+        return tsb.get_signals(
+            "http://tsb/", ["u1"], start_time=start, end_time=end, dt=0, noqc=True, cache=cache
+        )
+
+    first = query("2020-01-01T01:00:00", "2020-01-01T02:00:00")
+    assert len(first) == 61
+    second = query("2020-01-01T00:00:00", "2020-01-01T03:00:00")
+    assert [(c["start"], c["end"]) for c in calls[1:]] == [
+        ("2020-01-01T00:00:00+00:00", "2020-01-01T01:00:00+00:00"),
+        ("2020-01-01T02:00:00+00:00", "2020-01-01T03:00:00+00:00"),
+    ]
+    direct = tsb.get_signals(
+        "http://tsb/", ["u1"], start_time="2020-01-01T00:00:00",
+        end_time="2020-01-01T03:00:00", dt=0, noqc=True,
+    )
+    pd.testing.assert_frame_equal(second, direct)
+
+    # Fully covered, also by a new cache instance reading the index
+    n_calls = len(calls)
+    cache = TimeSeriesCache(tmp_path)
+    pd.testing.assert_frame_equal(query("2020-01-01T00:30:00", "2020-01-01T01:30:00"),
+                                  direct.iloc[30:91])
+    assert len(calls) == n_calls
+
+    # A different dt is a different cache key
+    tsb.get_signals("http://tsb/", ["u1"], start_time="2020-01-01T00:30:00",
+                    end_time="2020-01-01T01:30:00", dt=60, noqc=True, cache=cache)
+    assert len(calls) == n_calls + 1
+
+
+def test_get_signals_cache_open_ended_query(monkeypatch, tmp_path):
+    now = pd.Timestamp.now(tz="UTC").floor("min")
+    available = [now - pd.Timedelta(minutes=30)]
+    calls = []
+    fake = _fake_tsb(calls)
+
+    def get_data(url, params=None, headers=None, session=None):
+        # Serve data inserted up to the available time only
+        params = dict(params, end=min(pd.Timestamp(params["end"]), available[0]).isoformat())
+        return fake(url, params=params, headers=headers, session=session)
+
+    monkeypatch.setattr(tsb, "get_data", get_data)
+    cache = TimeSeriesCache(tmp_path, settle_margin=3600)
+
+    def query():
+        return tsb.get_signals(
+            "http://tsb/", ["u1"], start_time=now - pd.Timedelta(hours=3),
+            end_time=now + pd.Timedelta(hours=1), dt=0, noqc=True, cache=cache,
+        )
+
+    first = query()
+    assert first.index[-1] == now - pd.Timedelta(minutes=30)
+    # New data arrives for the open end of the query
+    available[0] = now
+    second = query()
+    assert second.index[-1] == now and second.index.is_unique
+    assert len(second) == len(first) + 30
+    # Only the range after the settle margin is fetched again
+    settled = pd.Timestamp(calls[-1]["start"]) - (now - pd.Timedelta(hours=1))
+    assert pd.Timedelta(0) <= settled < pd.Timedelta(minutes=1)
+
+
+def test_cache_appends_ranges_and_compacts(monkeypatch, tmp_path):
+    from pyniva import cache as cache_module
+
+    monkeypatch.setattr(tsb, "get_data", _fake_tsb([]))
+    written = []
+    write = cache_module._atomic_write_frame
+    monkeypatch.setattr(cache_module, "_atomic_write_frame",
+                        lambda file_name, df: written.append(len(df)) or write(file_name, df))
+    cache = TimeSeriesCache(tmp_path, max_segments=3)
+
+    for hours in range(1, 5):
+        df = tsb.get_signals("http://tsb/", ["u1"], start_time="2020-01-01T00:00:00",
+                             end_time=f"2020-01-01T0{hours}:00:00", dt=0, cache=cache)
+        assert len(df) == 60 * hours + 1 and df.index.is_unique
+    # Each query writes only its new range, the fourth range triggers a compaction
+    assert written == [61, 61, 61, 61, 241]
+    assert len(next(iter(cache._index.values()))["segments"]) == 1
+
+
+def test_cache_skips_ranges_stored_while_fetching(monkeypatch, tmp_path):
+    from pyniva import cache as cache_module
+
+    written = []
+    write = cache_module._atomic_write_frame
+    monkeypatch.setattr(cache_module, "_atomic_write_frame",
+                        lambda file_name, df: written.append(file_name) or write(file_name, df))
+    cache = TimeSeriesCache(tmp_path)
+    start, end = pd.Timestamp("2020-01-01T00:00:00Z"), pd.Timestamp("2020-01-01T01:00:00Z")
+    index = pd.date_range(start, end, freq="min")
+    data = pd.DataFrame({"u1": np.arange(len(index), dtype=float)}, index=index)
+
+    def fetch(c_start, c_end):
+        if fetch.nested:
+            # Another query stores the same range in the meantime
+            fetch.nested = False
+            cache.get_signals(["u1"], {"dt": 0}, start, end, fetch)
+        return data
+
+    fetch.nested = True
+    df = cache.get_signals(["u1"], {"dt": 0}, start, end, fetch)
+    pd.testing.assert_frame_equal(df, data)
+    assert len(written) == 1 and len(next(iter(cache._index.values()))["segments"]) == 1
+
+
+def test_cache_eviction(monkeypatch, tmp_path):
+    monkeypatch.setattr(tsb, "get_data", _fake_tsb([]))
+    cache = TimeSeriesCache(tmp_path, max_bytes=1)
+    tsb.get_signals("http://tsb/", ["u1"], start_time="2020-01-01T00:00:00",
+                    end_time="2020-01-01T01:00:00", dt=0, cache=cache)
+    assert cache.size == 0
+    assert list(tmp_path.glob("*/*.pkl")) == []
+
+
+def test_iter_signals_chunks_match_get_signals():
+    from .standin import StandInServer, path2uuid
+
+    uuids = [path2uuid(p) for p in ("SYNTH_FA/ferrybox/CTD/TEMPERATURE",
+                                    "SYNTH_FA/ferrybox/CTD/SALINITY")] + ["missing"]
+    query = dict(start_time="2018-12-16T21:00:00Z", end_time="2018-12-16T23:00:00Z", dt=60)
+    with StandInServer() as server:
+        expected = tsb.get_signals(server.tsb_url, uuids, **query)
+        chunks = list(tsb.iter_signals(server.tsb_url, uuids, window="PT10M", **query))
+        compact = list(tsb.iter_signals(server.tsb_url, uuids, window="PT10M", prefetch=0,
+                                        dtypes="compact", **query))
+
+    assert len(chunks) > 3 and all(list(c.columns) == uuids for c in chunks)
+    assert all(c.index.max() < n.index.min() for c, n in zip(chunks, chunks[1:]))
+    assert all(c["missing"].isna().all() for c in chunks)
+    pd.testing.assert_frame_equal(pd.concat(chunks)[uuids[:2]], expected[uuids[:2]], check_names=False)
+    assert all((c.dtypes == np.float32).all() for c in compact)
+
+
+def test_prefetched_bounded_and_closed_early():
+    import threading
+
+    started = []
+    release = threading.Event()
+
+    def fetch(w):
+        started.append(w)
+        if w >= 3:
+            release.wait(5)
+        return w
+
+    chunks = tsb._prefetched(fetch, range(100), prefetch=2)
+    assert [next(chunks) for _ in range(3)] == [0, 1, 2]
+    # Three consumed plus at most prefetch + 1 submitted
+    assert len(started) <= 6
+    release.set()
+    # Waits for the running fetches, the queued ones are cancelled
+    chunks.close()
+    assert sorted(started) == list(range(len(started))) and len(started) <= 6